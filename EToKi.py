@@ -1,7 +1,7 @@
 #! /usr/bin/python3
 import sys, os
 import argparse
-from modules.configure import logger
+from modules.configure import logger, startReport, stopReport
 
 class MyParser(argparse.ArgumentParser):
     def error(self, message):
@@ -37,12 +37,18 @@ def etoki():
     if arg.cmd is None :
         parser.print_help()
         sys.exit(2)
+    startReport(arg.cmd, sys.argv[2:])
     try :
         sys.argv[0] += ' ' + arg.cmd
         exec('from modules.{0} import {0}'.format(arg.cmd))
         eval(arg.cmd)(sys.argv[2:])
     except ValueError as e :
+        stopReport(e)
         parser.print_help()
+    except BaseException as e :
+        stopReport(e)
+        raise
+    stopReport()
 
 
 if __name__ == '__main__' :
@@ -0,0 +1,75 @@
+#! /usr/bin/env python3
+# throughput and recall of uberBlast --minimap against --blastn. Both search the same queries (by default the
+# MLST alleles in examples/) in each genome. A BLASTn hit with an identity >= --min_iden counts as recalled if
+# minimap2 reports the same query on the same strand of the same reference sequence, covering >= --overlap of it.
+import os, sys, time, json, argparse, glob
+import numpy as np
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ETOKI = os.path.dirname(BENCH)
+sys.path.insert(0, ETOKI)
+sys.path.insert(0, BENCH)
+from modules.configure import logger, externals, readFastq
+
+
+def recalled(blastab, minimap, min_iden, overlap) :
+    '''[identity, recalled] of every BLASTn hit with an identity >= min_iden'''
+    found = {}
+    for h in minimap :
+        found.setdefault((h[0], h[1], h[8] < h[9]), []).append([min(h[8], h[9]), max(h[8], h[9])])
+    res = []
+    for h in blastab :
+        if h[2] < min_iden :
+            continue
+        s, e = min(h[8], h[9]), max(h[8], h[9])
+        hit = any(min(e, me) - max(s, ms) + 1 >= overlap*(e - s + 1) for ms, me in found.get((h[0], h[1], h[8] < h[9]), []))
+        res.append([h[2], hit])
+    return res
+
+def bench_minimap(args) :
+    parser = argparse.ArgumentParser(description='Compare the throughput and recall of uberBlast --minimap with --blastn.')
+    parser.add_argument('-q', '--query', help='[DEFAULT: examples/Escherichia.Achtman.alleles.fasta] genes to search', \
+                        default=os.path.join(ETOKI, 'examples', 'Escherichia.Achtman.alleles.fasta'))
+    parser.add_argument('-g', '--genomes', help='[DEFAULT: examples/GCF_*.fna.gz] genomes to search in', nargs='*', \
+                        default=sorted(glob.glob(os.path.join(ETOKI, 'examples', 'GCF_*.fna.gz'))))
+    parser.add_argument('-t', '--n_thread', help='[DEFAULT: 4] threads given to uberBlast', type=int, default=4)
+    parser.add_argument('--min_iden', help='[DEFAULT: 0.9] BLASTn hits below this identity are not counted', type=float, default=0.9)
+    parser.add_argument('--overlap', help='[DEFAULT: 0.9] part of a BLASTn hit that a minimap2 hit has to cover', type=float, default=0.9)
+    parser.add_argument('--standins', help='[DEFAULT: missing] when to use the stand-ins in standins.py instead of programs in externals/', \
+                        choices=['missing', 'always', 'never'], default='missing')
+    parser.add_argument('-o', '--output', help='write the measurements as JSON to this file', default=None)
+    args = parser.parse_args(args)
+
+    # the programs have to be set before uberBlast reads them from externals
+    from run_benchmarks import resolvePrograms
+    externals.update({p: c for p, (c, s) in resolvePrograms(args.standins).items() if s == 'standin'})
+    from modules.uberBlast import blastSeqs, blastParams
+
+    qry = readFastq(args.query)[0]
+    qryBases = sum(map(len, qry.values()))
+    res = {}
+    for genome in args.genomes :
+        ref = readFastq(genome)[0]
+        hits = {}
+        for method in ('blastn', 'minimap') :
+            t = time.time()
+            blastab = blastSeqs(ref, qry, blastParams(n_thread=args.n_thread, re_score=1, filter=True, fix_end=[0, 3], **{method: True}))
+            hits[method] = [blastab, time.time() - t]
+        recall = np.array(recalled(hits['blastn'][0], hits['minimap'][0], args.min_iden, args.overlap), dtype=float).reshape(-1, 2)
+        bins = [[args.min_iden, 0.95], [0.95, 0.99], [0.99, 1.01]]
+        res[os.path.basename(genome)] = dict( \
+            **{ method: dict(seconds=round(s, 3), hits=len(b), kbp_per_s=round(qryBases/1000./s, 1)) for method, (b, s) in hits.items() }, \
+            recall=round(float(np.mean(recall.T[1])), 4) if recall.size else None, \
+            recall_by_identity={ '{0}-{1}'.format(lo, min(hi, 1.)): [int(np.sum(recall.T[1][(recall.T[0] >= lo) & (recall.T[0] < hi)])), \
+                                                                     int(np.sum((recall.T[0] >= lo) & (recall.T[0] < hi)))] for lo, hi in bins })
+        r = res[os.path.basename(genome)]
+        logger('{0}: blastn {1} hits in {2:.1f} s; minimap {3} hits in {4:.1f} s ({5:.1f}x); recall {6}'.format( \
+            os.path.basename(genome), r['blastn']['hits'], r['blastn']['seconds'], r['minimap']['hits'], r['minimap']['seconds'], \
+            r['blastn']['seconds']/max(r['minimap']['seconds'], 1e-6), r['recall']))
+    if args.output :
+        with open(args.output, 'w') as fout :
+            json.dump(res, fout, indent=1, sort_keys=True)
+    return res
+
+
+if __name__ == '__main__' :
+    bench_minimap(sys.argv[1:])
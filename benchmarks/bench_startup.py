@@ -0,0 +1,58 @@
+#! /usr/bin/env python3
+# startup-time check of the EToKi subcommands: "EToKi.py <cmd> -h" has to finish within a time budget,
+# and the modules of frequently called commands must not import heavy libraries at load time.
+# exits with 1 if any budget is exceeded.
+import os, sys, time, argparse, subprocess, json
+ETOKI = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# seconds for "EToKi.py <cmd> -h" (best of --repeat runs), measured with numba caches in place
+budgets = dict(MLSType=0.4, EBEis=0.4, uberBlast=0.5, MLSTdb=0.5, clust=0.5, isCRISPOL=0.5, prepare=0.5,
+               assemble=0.5, align=0.5, phylo=0.5, cgMLST=0.5, configure=0.5)
+# libraries that must not be loaded just by importing the module of these commands
+heavy = ['pandas', 'numba', 'scipy', 'sklearn', 'ete3']
+lightCommands = ['MLSType', 'EBEis', 'uberBlast', 'MLSTdb', 'clust', 'phylo', 'cgMLST']
+
+
+def timeHelp(cmd, repeat) :
+    ts = []
+    for _ in range(repeat) :
+        t = time.time()
+        p = subprocess.Popen([sys.executable, os.path.join(ETOKI, 'EToKi.py'), cmd, '-h'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        p.communicate()
+        ts.append(time.time() - t)
+    return min(ts), p.returncode
+
+def loadedHeavy(cmd) :
+    code = 'import sys; sys.path.insert(0, {0!r}); import modules.{1}; print(" ".join(m for m in {2!r} if m in sys.modules))'.format(ETOKI, cmd, heavy)
+    p = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    return p.communicate()[0].split()
+
+def bench_startup(args) :
+    parser = argparse.ArgumentParser(description='Check the startup time of EToKi subcommands against a budget.')
+    parser.add_argument('-c', '--commands', help='subcommands to check. [DEFAULT: all with a budget]', nargs='*', default=None)
+    parser.add_argument('-r', '--repeat', help='[DEFAULT: 5] runs per command; the fastest is used', type=int, default=5)
+    parser.add_argument('-s', '--scale', help='[DEFAULT: 1.0] multiply all budgets, e.g. for slow shared filesystems', type=float, default=1.0)
+    parser.add_argument('-o', '--output', help='write the measurements as JSON to this file', default=None)
+    args = parser.parse_args(args)
+
+    # warm up: the first run may have to compile and cache numba kernels
+    timeHelp('MLSType', 1)
+    res, failed = {}, []
+    for cmd in args.commands or sorted(budgets) :
+        t, code = timeHelp(cmd, args.repeat)
+        budget = budgets.get(cmd, 0.5) * args.scale
+        loaded = loadedHeavy(cmd) if cmd in lightCommands else []
+        ok = code == 0 and t <= budget and not loaded
+        res[cmd] = dict(seconds=round(t, 3), budget=budget, heavy_imports=loaded, ok=ok)
+        sys.stderr.write('{0}\t{1:.3f}s / {2:.3f}s\t{3}{4}\n'.format(cmd, t, budget, 'OK' if ok else 'FAILED', \
+                         '\timports: ' + ','.join(loaded) if loaded else ''))
+        if not ok :
+            failed.append(cmd)
+    if args.output :
+        with open(args.output, 'w') as fout :
+            json.dump(res, fout, indent=1)
+    return failed
+
+
+if __name__ == '__main__' :
+    sys.exit(1 if bench_startup(sys.argv[1:]) else 0)
@@ -0,0 +1,67 @@
+#! /usr/bin/env python3
+# latency of uberBlast --sw against --blastn on the gene sets shipped with EToKi: the EBEis serotype antigens, the
+# CRISPOL repeats and spacers and the MLST alleles in examples/, each searched in one genome. Every search is timed
+# from the sequences in memory to the hit table, as blastSeqs is called by the modules. A BLASTn hit counts as
+# found if --sw reports the same query on the same strand of the same reference sequence, covering >= --overlap of it.
+import os, sys, time, json, argparse, glob
+import numpy as np
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ETOKI = os.path.dirname(BENCH)
+sys.path.insert(0, ETOKI)
+sys.path.insert(0, BENCH)
+from modules.configure import logger, externals, readFastq
+from bench_minimap import recalled
+
+geneSets = dict(EBEis=[os.path.join(ETOKI, 'modules', 'EBEis.Escherichia.fas'), 40], \
+                CRISPOL=[os.path.join(ETOKI, 'modules', 'CRISPOL.db'), 20], \
+                MLST=[os.path.join(ETOKI, 'examples', 'Escherichia.Achtman.alleles.fasta'), 40])
+
+def bench_sw(args) :
+    parser = argparse.ArgumentParser(description='Compare the latency of uberBlast --sw with --blastn on the bundled gene sets.')
+    parser.add_argument('-g', '--genome', help='[DEFAULT: the first of examples/GCF_*.fna.gz] genome to search in', \
+                        default=(sorted(glob.glob(os.path.join(ETOKI, 'examples', 'GCF_*.fna.gz'))) + [None])[0])
+    parser.add_argument('-s', '--sets', help='[DEFAULT: all] gene sets to search', nargs='*', choices=sorted(geneSets), default=sorted(geneSets))
+    parser.add_argument('-t', '--n_thread', help='[DEFAULT: 4] threads given to uberBlast', type=int, default=4)
+    parser.add_argument('-R', '--repeat', help='[DEFAULT: 3] runs of each search; the fastest is reported', type=int, default=3)
+    parser.add_argument('--min_iden', help='[DEFAULT: 0.8] BLASTn hits below this identity are not counted', type=float, default=0.8)
+    parser.add_argument('--overlap', help='[DEFAULT: 0.9] part of a BLASTn hit that a --sw hit has to cover', type=float, default=0.9)
+    parser.add_argument('--standins', help='[DEFAULT: missing] when to use the stand-ins in standins.py instead of programs in externals/', \
+                        choices=['missing', 'always', 'never'], default='missing')
+    parser.add_argument('-o', '--output', help='write the measurements as JSON to this file', default=None)
+    args = parser.parse_args(args)
+
+    from run_benchmarks import resolvePrograms
+    externals.update({p: c for p, (c, s) in resolvePrograms(args.standins).items() if s == 'standin'})
+    from modules.uberBlast import blastSeqs, blastParams
+
+    ref = readFastq(args.genome)[0]
+    res = {}
+    for name in args.sets :
+        fname, min_cov = geneSets[name]
+        qry = readFastq(fname)[0]
+        hits = {}
+        for method in ('blastn', 'sw') :
+            params = blastParams(n_thread=args.n_thread, min_cov=min_cov, **{method: True})
+            # the first --sw run also compiles the kernels; it is left out unless it is the only one
+            times = []
+            for ite in range(max(args.repeat, 1) + (method == 'sw' and args.repeat > 1)) :
+                t = time.time()
+                blastab = blastSeqs(ref, qry, params)
+                times.append(time.time() - t)
+            hits[method] = [blastab, min(times[1:] if len(times) > args.repeat else times)]
+        found = np.array(recalled(hits['blastn'][0], hits['sw'][0], args.min_iden, args.overlap), dtype=float).reshape(-1, 2)
+        res[name] = dict(queries=len(qry), \
+            **{ method: dict(seconds=round(s, 3), hits=len(b)) for method, (b, s) in hits.items() }, \
+            recall=round(float(np.mean(found.T[1])), 4) if found.size else None)
+        r = res[name]
+        logger('{0} ({1} queries): blastn {2} hits in {3:.2f} s; sw {4} hits in {5:.2f} s ({6:.1f}x); recall {7}'.format( \
+            name, r['queries'], r['blastn']['hits'], r['blastn']['seconds'], r['sw']['hits'], r['sw']['seconds'], \
+            r['blastn']['seconds']/max(r['sw']['seconds'], 1e-6), r['recall']))
+    if args.output :
+        with open(args.output, 'w') as fout :
+            json.dump(res, fout, indent=1, sort_keys=True)
+    return res
+
+
+if __name__ == '__main__' :
+    bench_sw(sys.argv[1:])
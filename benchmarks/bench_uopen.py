@@ -0,0 +1,63 @@
+#! /usr/bin/env python3
+# micro-benchmark of configure.uopen: in-process gzip layer vs. the pigz subprocess path
+import os, sys, time, argparse, tempfile, glob
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'modules'))
+from configure import uopen, logger, ETOKI
+
+
+def timeRead(fname, pigz, repeat) :
+    t = time.time()
+    for _ in range(repeat) :
+        with uopen(fname, 'r', pigz=pigz) as fin :
+            for line in fin :
+                pass
+    return (time.time() - t)/repeat
+
+def timeWrite(lines, fname, pigz, repeat) :
+    t = time.time()
+    for _ in range(repeat) :
+        with uopen(fname, 'w', pigz=pigz) as fout :
+            for line in lines :
+                fout.write(line)
+    return (time.time() - t)/repeat
+
+def timeSmallFiles(lines, dirPath, pigz, nFile) :
+    t = time.time()
+    for id in range(nFile) :
+        fname = os.path.join(dirPath, 'small.{0}.gz'.format(id))
+        with uopen(fname, 'w', pigz=pigz) as fout :
+            fout.write(lines[id % len(lines)])
+        with uopen(fname, 'r', pigz=pigz) as fin :
+            fin.read()
+    return (time.time() - t)/nFile
+
+
+def bench_uopen(args) :
+    parser = argparse.ArgumentParser(description='Compare the in-process gzip layer of uopen with the pigz subprocess path.')
+    parser.add_argument('-i', '--inputs', help='gzipped files to read. [DEFAULT: examples/*.gz]', nargs='*', default=None)
+    parser.add_argument('-r', '--repeat', help='[DEFAULT: 3] repeats for each measurement', type=int, default=3)
+    parser.add_argument('-n', '--n_small', help='[DEFAULT: 200] number of small files to round-trip', type=int, default=200)
+    args = parser.parse_args(args)
+    inputs = args.inputs or sorted(glob.glob(os.path.join(ETOKI, 'examples', '*.gz')))
+
+    res = []
+    with tempfile.TemporaryDirectory(prefix='BU_', dir='.') as dirPath :
+        for fname in inputs :
+            with uopen(fname) as fin :
+                lines = fin.readlines()
+            for pigz in (False, True) :
+                tag = 'pigz' if pigz else 'inproc'
+                tRead = timeRead(fname, pigz, args.repeat)
+                tWrite = timeWrite(lines, os.path.join(dirPath, 'out.gz'), pigz, args.repeat)
+                res.append([os.path.basename(fname), tag, tRead, tWrite])
+                logger('{0}\t{1}\tread: {2:.3f}s\twrite: {3:.3f}s'.format(*res[-1]))
+        for pigz in (False, True) :
+            tag = 'pigz' if pigz else 'inproc'
+            tSmall = timeSmallFiles(lines[:100], dirPath, pigz, args.n_small)
+            res.append(['<small files>', tag, tSmall, tSmall])
+            logger('{0} small files\t{1}\tround-trip: {2:.2f}ms per file'.format(args.n_small, tag, tSmall*1000))
+    return res
+
+
+if __name__ == '__main__' :
+    bench_uopen(sys.argv[1:])
@@ -0,0 +1,490 @@
+#! /usr/bin/env python3
+# equivalence checks of compiled kernels against the reference implementations they replace, on random
+# inputs derived from the synthetic dataset (see synthetic.py). Results have to be identical, not just close.
+# Regression checks of fixed bugs are registered the same way. exits with 1 if any check fails.
+import os, sys, re, argparse
+from operator import itemgetter
+import numpy as np
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ETOKI = os.path.dirname(BENCH)
+sys.path.insert(0, ETOKI)
+sys.path.insert(0, BENCH)
+from modules.configure import logger, readFasta
+import synthetic
+
+checks = []
+def check(name) :
+    '''register a check: the decorated function gets the dataset, a random state and a size, and returns a list of failures'''
+    def wrap(func) :
+        checks.append([name, func])
+        return func
+    return wrap
+
+def sameArray(a, b) :
+    return a.shape == b.shape and np.array_equal(a, b, equal_nan=True)
+
+
+@check('uberBlast.scoreHits')
+def _(data, rng, size) :
+    from modules import uberBlast
+    from modules.uberBlast import RunBlast, HitTable, cigar2score
+    qryLens = {n: len(s) for n, s in readFasta(data['alleles']).items()}
+    refLens = {n: len(s) for n, s in readFasta(data['query']).items()}
+    rows = synthetic.gappedHits(rng, qryLens, refLens, size)
+    hits = HitTable.fromRows(rows)
+    rb = RunBlast()
+    rb.n_thread = 4
+    refSeq, qrySeq = rb.encodeSeq(data['query'], 'refSeq'), rb.encodeSeq(data['alleles'], 'qrySeq')
+    gt56, failures = uberBlast.gtable[56], []
+    for table_id in (11, 4) :
+        for mode in (1, 2, 3) :
+            iden, score = rb.scoreHits(data['query'], data['alleles'], hits, mode, table_id, perBatch=97)
+            expected = np.array([ cigar2score([t[14], refSeq[t[1]][t[8]-1:t[9]] if t[8] < t[9] else 4 - refSeq[t[1]][t[9]-1:t[8]][::-1], \
+                                               qrySeq[t[0]][t[6]-1:t[7]], t[6], mode, 6, 1, table_id]) for t in rows ], dtype=float)
+            # cigar2score switches the global codon table for table 4
+            uberBlast.gtable[56] = gt56
+            for name, a, b in (('identity', iden, expected.T[0]), ('score', score, expected.T[1])) :
+                if not sameArray(a, b) :
+                    failures.append('mode {0}, table {1}: {2} differs in {3} of {4} hits'.format(mode, table_id, name, np.sum(a != b), len(a)))
+    return failures
+
+
+def ovlFilterReference(blastab, coverage, delta) :
+    '''the pairwise Python loop that RunBlast.ovlFilter used before ovlSweep; returns the kept rows in order'''
+    rStart, rEnd = blastab.signedRef()
+    order = np.lexsort([blastab.qStart, rStart, blastab.qry, blastab.ref])
+    qry, ref, qS, qE, rS, rE, score = [ v[order].tolist() for v in (blastab.qry, blastab.ref, blastab.qStart, blastab.qEnd, rStart, rEnd, blastab.score) ]
+    nTab, removed = len(order), [False] * len(order)
+    for i in range(nTab) :
+        if removed[i] : continue
+        toDel = []
+        for j in range(i+1, nTab) :
+            if removed[j] : continue
+            if qry[i] != qry[j] or ref[i] != ref[j] or rE[i] < rS[j] :
+                break
+            c = min(rE[i], rE[j]) - rS[j] + 1
+            if (c >= coverage*(rE[i]-rS[i]+1) and score[j] - score[i] >= delta) :
+                removed[i] = True
+                break
+            elif (c >= coverage*(rE[j]-rS[j]+1) and score[i] - score[j] >= delta) :
+                toDel.append(j)
+            elif c >= (rE[i]-rS[i]+1) and c < coverage*(rE[j]-rS[j]+1) :
+                c2 = min(qE[i], qE[j]) - max(qS[j], qS[i]) + 1
+                if c2 >= (qE[i]-qS[i]+1) and c2 < coverage*(qE[j]-qS[j]+1) :
+                    break
+            elif c >= (rE[j]-rS[j]+1) and c < coverage*(rE[i]-rS[i]+1) :
+                c2 = min(qE[i], qE[j]) - max(qS[j], qS[i]) + 1
+                if c2 >= (qE[j]-qS[j]+1) and c2 < coverage*(qE[i]-qS[i]+1) :
+                    toDel.append(j)
+        if not removed[i] :
+            for j in toDel :
+                removed[j] = True
+    return order[~np.array(removed, dtype=bool)]
+
+@check('uberBlast.ovlFilter')
+def _(data, rng, size) :
+    from modules.uberBlast import RunBlast, HitTable
+    failures = []
+    for nQry, depth in ((1, 5), (20, 20), (3, 80)) :
+        hits = HitTable.fromRows(synthetic.repeatHits(rng, size, depth=depth, nQry=nQry))
+        for coverage, delta in ((0.9, 0.), (0.5, 0.), (0.9, 20.), (1.0, 0.)) :
+            kept = RunBlast().ovlFilter(hits.copy(), [True, coverage, delta]).rowId
+            expected = hits.rowId[ovlFilterReference(hits, coverage, delta)]
+            if not sameArray(kept, expected) :
+                failures.append('{0} queries, depth {1}, coverage {2}, delta {3}: {4} hits kept instead of {5}'.format( \
+                                nQry, depth, coverage, delta, kept.size, expected.size))
+    return failures
+
+
+@check('uberBlast.returnOverlap')
+def _(data, rng, size) :
+    from modules.uberBlast import RunBlast, HitTable
+    failures = []
+    for depth in (5, 40) :
+        hits = HitTable.fromRows(synthetic.repeatHits(rng, size, depth=depth, nQry=3))
+        ids, s, e = hits.rowId.tolist(), np.minimum(hits.rStart, hits.rEnd).tolist(), np.maximum(hits.rStart, hits.rEnd).tolist()
+        for ovl_l, ovl_p in ((300, 0.6), (50, 0.1)) :
+            rb = RunBlast()
+            rb.n_thread = 3
+            overlaps = rb.returnOverlap(hits, [True, ovl_l, ovl_p])
+            # every pair of hits [i, j] where j starts within i, i coming first in the order of (start, end)
+            expected, order = [], sorted(range(len(ids)), key=lambda i : (s[i], e[i]))
+            for x, i in enumerate(order) :
+                for j in order[x+1:] :
+                    if s[j] > e[i] : break
+                    ovl = min(e[i], e[j]) - s[j] + 1
+                    if ovl >= min(ovl_l, ovl_p*(e[i]-s[i]+1)) or ovl >= ovl_p*(e[j]-s[j]+1) :
+                        expected.append((ids[i], ids[j], ovl))
+            if sorted(map(tuple, overlaps.tolist())) != sorted(expected) :
+                failures.append('depth {0}, overlap {1}/{2}: {3} pairs instead of {4}'.format(depth, ovl_l, ovl_p, len(overlaps), len(expected)))
+    return failures
+
+
+def linearMergeGroup(data) :
+    '''_linearMerge, which RunBlast.linearMerge ran on the legacy rows of each query before chainHits'''
+    import pandas as pd
+    matches, params = data
+    grpCol = pd.Series(data= [[]] * matches.shape[0])
+    matches = np.hstack([matches, grpCol.values[:, np.newaxis]])
+    gapDist, lenDiff = params[1:]
+    gene, geneLen = matches[0][0], matches[0][12]
+    tailing = 20
+    
+    def resolve_edges(edges) :
+        grps = []
+        for id, m1 in edges[0] :
+            for jd, m2 in edges[1] :
+                if (m1[1] == m2[1] and max(abs(m1[8]), abs(m1[9])) > min(abs(m2[8]), abs(m2[9])) ) or \
+                   abs(m1[2]-m2[2]) > 0.3 or m1[6] >= m2[6] or m1[7] >= m2[7] or m2[6]-m1[7]-1 >= gapDist:
+                    continue
+                rLen = m2[7] - m1[6] + 1
+                g1 = -m1[9]-1 if m1[9] < 0 else m1[13] - m1[9]
+                g2 =  m2[8]-1 if m2[8] > 0 else m2[13] + m2[8]
+                qLen = m1[9]-m1[8]+1 + m2[9]-m2[8]+1 + g1 + g2
+                if g1+g2 >= gapDist or min(rLen, qLen)*lenDiff < max(rLen, qLen) :
+                    continue
+                overlap = sorted([m1[7] - m2[6] + 1, -g1-g2], reverse=True)
+
+                rLen1, rLen2 = m1[7] - m1[6] + 1, m2[7] - m2[6] + 1
+                if overlap[0] > 0 :
+                    score = m1[11] + m2[11] - overlap[0] * min( float(m1[11])/rLen1, float(m2[11])/rLen2 )
+                    ident = (m1[2]*rLen1 + m2[2]*rLen2 - overlap[0] * min(m1[2], m2[2]))/(rLen1 + rLen2 - overlap[0])
+                else :
+                    score = m1[11] + m2[11]
+                    ident = (m1[2]*rLen1 + m2[2]*rLen2)/(rLen1 + rLen2)
+                if overlap[1] < 0 :
+                    score +=  overlap[1]/3.
+                if score > m1[11] and score > m2[11] :
+                    grps.append( [ score, ident, rLen, 1, id, jd ] )
+        return grps
+    
+    groups = []
+    prev, edges = matches[0][1], [[], []]
+    nSave = len(matches)
+    
+    for id, m1 in enumerate(matches) :
+        rLen1 = m1[7] - m1[6] + 1
+        groups.append([ m1[11], m1[2], rLen1, 0, id ])
+        if m1[6] > tailing and ((m1[8] > 0 and m1[8] - 1 <= gapDist) or (m1[8] < 0 and m1[13] + m1[8] < gapDist)) :   # any hit within the last 300 bps to either end of a scaffold is a potential fragmented gene
+            edges[1].append([id, m1])
+        if m1[7] <= m1[12] - tailing :
+            if (m1[8] > 0 and m1[13]-m1[9] <= gapDist) or (m1[8] < 0 and -1-m1[9] < gapDist) :
+                edges[0].append([id, m1])
+            for jd in range(id+1, nSave) :
+                m2 = matches[jd]
+                if m1[1] != m2[1] or (m1[8] < 0 and m2[8] > 0) or m2[8] - m1[9] -1 >= gapDist :    # maximum 600bps between two continuous hits in the same scaffold
+                    break
+                rLen, qLen = m2[7]-m1[6]+1, m2[9]-m1[8]+1
+                if abs(m1[2]-m2[2]) > 0.3 or m1[8]+3 >= m2[8] or m1[9]+3 >= m2[9] or m1[6]+3 >= m2[6] or m1[7]+3 >= m2[7] or m2[6] - m1[7] -1 >= gapDist \
+                   or min(rLen, qLen)*lenDiff < max(rLen, qLen) :
+                    continue
+                rLen2 = m2[7] - m2[6] + 1
+                overlap = sorted([m1[7]-m2[6]+1, m1[9]-m2[8]+1], reverse=True)
+                if overlap[0] > 0 :
+                    score = m1[11] + m2[11] - overlap[0] * min( float(m1[11])/rLen1, float(m2[11])/rLen2 )
+                    ident = (m1[2]*rLen1 + m2[2]*rLen2 - overlap[0]*min(m1[2], m2[2]))/(rLen1 + rLen2 - overlap[0])
+                else :
+                    score = m1[11] + m2[11]
+                    ident = (m1[2]*rLen1 + m2[2]*rLen2)/(rLen1 + rLen2)
+                if overlap[1] < 0 :
+                    score +=  overlap[1]/3.
+                if score > m1[11] and score > m2[11] :
+                    groups.append( [ score, ident, rLen, 0, id, jd ] )
+    if len(edges[0]) and len(edges[1]) :
+        groups.extend(resolve_edges(edges))
+    if len(groups) > len(matches) :
+        groups.sort(reverse=True)
+        usedMatches, usedGroups = {}, []
+        for grp in groups :
+            if (grp[4], 4) in usedMatches or (grp[-1], 5) in usedMatches :
+                continue
+            if grp[3] > 0 :
+                if (grp[4], 5) in usedMatches or (grp[-1], 4) in usedMatches :
+                    continue
+            if grp[4] != grp[-1] :
+                lMat, rMat = matches[grp[4]], matches[grp[-1]]
+                il, im = sorted([grp[4], grp[-1]])
+                skp = 0
+                for i in range(il+1, im) :
+                    if matches[i][1] in {lMat[1], rMat[1]} :
+                        if (i, 4) in usedMatches or (i, 5) in usedMatches :
+                            skp = 1
+                            break
+                if skp :
+                    continue
+                for i in range(il+1, im) :
+                    if matches[i][1] in {lMat[1], rMat[1]} :
+                        usedMatches[(i, 4)] = usedMatches[(i, 5)] = 0
+            usedGroups.append(grp)
+            usedMatches[(grp[4], 4)] = usedMatches[(grp[-1], 5)] = 1
+            if grp[3] > 0 :
+                usedMatches[(grp[4], 5)] = usedMatches[(grp[-1], 4)] = 1
+
+        usedGroups.sort(key=itemgetter(4), reverse=True)
+        for gId in range(len(usedGroups)-1) :
+            g1, g2 = usedGroups[gId:gId+2]
+            if g1[4] == g2[-1] :
+                m = matches[g1[4]]
+                score = g1[0] + g2[0] - m[11]
+                length = g1[2] + g2[2] - (m[7]-m[6]+1)
+                iden = (g1[1]*g1[2] + g2[1]*g2[2] - min(g1[1],g2[1])*(m[7]-m[6]+1))/length
+                usedGroups[gId+1] = [score, iden, length, 0, g2[4]] + g1[4:]
+                g1[1] = -1
+    else :
+        usedGroups = groups
+        usedMatches = {(k, k): 1 for k in np.arange(matches.shape[0])}
+    for g in usedGroups :
+        if g[1] >= 0 :
+            ids = [matches[i][15] for i in g[4:]]
+            for i in g[4:] :
+                matches[i, -1] = g[:3] + ids
+    ids = { k[0] for k, v in usedMatches.items() if v == 1 }
+    matches = matches[np.array(list(ids))]
+    return matches
+
+def linearMergeReference(blastab, params) :
+    '''RunBlast.linearMerge before chainHits: linearMergeGroup on legacy rows'''
+    # strand-signed reference coordinates; name codes stand in for the names
+    rStart, rEnd = blastab.signedRef()
+    order = np.lexsort([blastab.qStart, rStart, blastab.ref, blastab.qry])
+    blastab = blastab.take(order)
+    rows = np.empty([len(blastab), 16], dtype=object)
+    for i, v in enumerate((blastab.qry, blastab.ref, blastab.iden, blastab.alnLen, blastab.mism, blastab.gapOpen, blastab.qStart, blastab.qEnd, \
+                           rStart[order], rEnd[order], blastab.evalue, blastab.score.astype(int) if blastab.intScore else blastab.score, \
+                           blastab.qLen, blastab.rLen)) :
+        rows.T[i] = v.tolist()
+    rows.T[15] = blastab.rowId.tolist()
+    merged = np.vstack(list(map(linearMergeGroup, [[matches, params] for matches in np.split(rows, np.flatnonzero(np.diff(blastab.qry))+1)])))
+    index = np.zeros(np.max(blastab.rowId)+1, dtype=np.int64)
+    index[blastab.rowId] = np.arange(len(blastab))
+    blastab = blastab.take(index[merged.T[15].astype(np.int64)])
+    groups = merged.T[16].tolist()
+    blastab.setGroups([ g[:3] if len(g) else [np.nan]*3 for g in groups ], \
+                      np.concatenate([[0], np.cumsum([max(len(g)-3, 0) for g in groups])]), [ i for g in groups for i in g[3:] ])
+    return blastab
+
+
+
+@check('uberBlast.linearMerge')
+def _(data, rng, size) :
+    from modules.uberBlast import RunBlast, HitTable
+    qryLens = {n: len(s) for n, s in readFasta(data['alleles']).items()}
+    failures = []
+    # the contigs of the dataset, and many short ones so that genes are often broken across contig ends
+    for refLens in ({n: len(s) for n, s in readFasta(data['query']).items()}, {'contig_{0}'.format(i): rng.randint(1500, 5000) for i in range(50)}) :
+        rows = np.vstack([synthetic.hitTable(rng, qryLens, refLens, hitsPerQry=max(size // len(qryLens), 1), fragmented=0.5), \
+                          synthetic.contigEndHits(rng, qryLens, refLens, size // 4)])
+        # shifted copies with other scores compete with the originals
+        dup = rows[rng.rand(len(rows)) < 0.3].copy()
+        for d in dup :
+            d[6] += rng.randint(0, 5)
+            d[11] = d[11] - rng.randint(-5, 30)
+            d[14] = [[d[7]-d[6]+1, 'M']]
+        rows = np.vstack([rows, dup])
+        rows.T[15] = np.arange(len(rows))
+        for intScore in (True, False) :
+            hits = HitTable.fromRows(rows)
+            if not intScore :
+                hits.score, hits.intScore = np.round(hits.score / 3., 3), False
+            expected = linearMergeReference(hits.copy(), [True, 300., 1.2])
+            for n_thread in (1, 3) :
+                rb = RunBlast()
+                rb.n_thread = n_thread
+                merged = rb.linearMerge(hits.copy(), [True, 300., 1.2])
+                same = [ sameArray(getattr(merged, c), getattr(expected, c)) for c in ('rowId', 'grpInfo', 'grpStart', 'grpMembers') ]
+                if not all(same) :
+                    failures.append('{0} contigs, {1} scores, {2} threads: {3} hits kept instead of {4}, {5} differ'.format(len(refLens), \
+                                    'integer' if intScore else 'float', n_thread, len(merged), len(expected), \
+                                    ', '.join(c for c, s in zip(('rows', 'group info', 'group sizes', 'group members'), same) if not s)))
+    return failures
+
+
+def parseDiamondReference(data):
+    '''the SAM (outfmt 101) parser that uberBlast used for diamond before parseDiamondChunk'''
+    import pandas as pd
+    fn, refseq, qryseq, min_id, min_cov, min_ratio = data
+    blastab = []
+    if not os.path.isfile(fn) :
+        return None
+    with open(fn) as fin :
+        for line in fin:
+            if line.startswith('@'):
+                continue
+            part = line.strip().split('\t')
+            if part[2] == '*': continue
+            qn, qf = part[0].rsplit(':', 1)
+            rn, rf, rx = part[2].rsplit(':', 2)
+            rs = int(part[3]) + int(rx)
+            ql, rl = len(qryseq[str(qn)]), len(refseq[str(rn)])
+            qm = len(part[9])
+            if qm * 3 < min_cov: continue
+            cov_ratio = qm * 3. / ql
+            if cov_ratio < min_ratio: continue
+            cigar = [[int(n) * 3, t] for n, t in re.findall(r'(\d+)([A-Z])', part[5])]
+            cl = np.sum([c[0] for c in cigar])
+            variation = float(part[12][5:]) * 3 if part[12].startswith('NM:') else float(
+                re.findall('NM:i:(\d+)', line)[0]) * 3
+
+            iden = 1 - round(variation / cl, 3)
+            if iden < min_id: continue
+            qf, rf = int(qf), int(rf)
+            qs = int(part[18][5:]) if part[18].startswith('ZS:') else int(re.findall('ZS:i:(\d+)', line)[0])
+
+            rm = int(np.sum([c[0] for c in cigar if c[1] in {'M', 'D'}]) / 3)
+            if rf <= 3:
+                rs, r_e = rs * 3 + rf - 3, (rs + rm - 1) * 3 + rf - 1
+            else:
+                rs, r_e = rl - (rs * 3 + rf - 6) + 1, rl - ((rs + rm - 1) * 3 + rf - 4) + 1
+            if qf <= 3:
+                qs, qe = qs * 3 + qf - 3, (qs + qm - 1) * 3 + qf - 1
+            else:
+                qs, qe = ql - (qs * 3 + qf - 6) + 1, ql - ((qs + qm - 1) * 3 + qf - 4) + 1
+                qs, qe, rs, r_e = qe, qs, r_e, rs
+                cigar = list(reversed(cigar))
+
+            cd = [c[0] for c in cigar if c[1] != 'M']
+            score = int(part[14][5:]) if part[14].startswith('ZR:') else int(re.findall('ZR:i:(\d+)', line)[0])
+            blastab.append(
+                [qn, rn, iden, cl, int(variation - sum(cd)), len(cd), qs, qe, rs, r_e, 0.0, score, ql, rl, cigar])
+    try:
+        os.unlink(fn)
+    except :
+        pass
+
+    blastab = pd.DataFrame(blastab)
+    if blastab.size > 0:
+        blastab[[0, 1]] = blastab[[0, 1]].astype(str)
+        np.save(fn+'.match.npy', blastab.values, allow_pickle=True)
+        return fn + '.match.npy'
+    else :
+        return None
+
+
+@check('uberBlast.parseDiamondChunk')
+def _(data, rng, size) :
+    import tempfile, shutil
+    from modules.uberBlast import HitTable, parseDiamondChunk
+    qryLens = {n: len(s) for n, s in readFasta(data['alleles']).items()}
+    refLens = {n: len(s) for n, s in readFasta(data['query']).items()}
+    qryNames, refNames = sorted(qryLens), sorted(refLens)
+    # random alignments in all frames, written as SAM and as tabular lines
+    sam, tab = [], []
+    while len(tab) < size :
+        qn, rn = qryNames[rng.randint(len(qryNames))], refNames[rng.randint(len(refNames))]
+        cigar = [[rng.randint(5, 80), 'M']]
+        for _ in range(rng.randint(0, 4)) :
+            cigar.extend([[rng.randint(1, 6), 'ID'[rng.randint(2)]], [rng.randint(5, 80), 'M']])
+        qm, rm = sum(n for n, t in cigar if t != 'D'), sum(n for n, t in cigar if t != 'I')
+        if qm + 3 >= qryLens[qn]//3 or rm + 3 >= refLens[rn]//3 : continue
+        qs, rx = rng.randint(1, qryLens[qn]//3 - qm - 1), rng.randint(0, refLens[rn]//3 - rm - 1)
+        ss = rng.randint(1, refLens[rn]//3 - rm - rx)
+        length = sum(n for n, t in cigar)
+        nident = rng.randint(sum(n for n, t in cigar if t == 'M')//2, sum(n for n, t in cigar if t == 'M') + 1)
+        qf, rf, score, cs = rng.randint(1, 7), rng.randint(1, 7), rng.randint(20, 2000), ''.join('{0}{1}'.format(*c) for c in cigar)
+        sam.append('{0}:{1}\t0\t{2}:{3}:{4}\t{5}\t255\t{6}\t*\t0\t0\t{7}\t*\tAS:i:{8}\tNM:i:{9}\tZL:i:{10}\tZR:i:{11}\tZE:f:1e-10\tZI:i:{12}\tZF:i:1\tZS:i:{13}\tMD:Z:0\n'.format( \
+                   qn, qf, rn, rf, rx, ss, cs, 'A'*qm, score//3, length - nident, refLens[rn]//3, score, 100*nident//length, qs))
+        tab.append('{0}:{1}\t{2}:{3}:{4}\t{5}\t{6}\t{7}\t{8}\t{9}\t{10}\t{11}\n'.format(qn, qf, rn, rf, rx, qs, qs+qm-1, ss, length, nident, score, cs))
+    failures, tmp = [], tempfile.mkdtemp(prefix='EQ_')
+    try :
+        for min_id, min_cov, min_ratio in ((0., 0., 0.), (0.6, 150., 0.2)) :
+            fn = os.path.join(tmp, 'aaMatch')
+            with open(fn, 'w') as fout :
+                fout.write('@HD\tVN:1.5\tSO:query\n' + ''.join(sam))
+            r = parseDiamondReference([fn, {n: 'N'*l for n, l in refLens.items()}, {n: 'N'*l for n, l in qryLens.items()}, min_id, min_cov, min_ratio])
+            expected = HitTable.fromRows(np.load(r, allow_pickle=True)).toRows() if r else HitTable.empty().toRows()
+            for chunkSize in (size, 97) :
+                hits = HitTable.concat([ parseDiamondChunk(tab[i:i+chunkSize], qryLens, refLens, min_id, min_cov, min_ratio) for i in range(0, len(tab), chunkSize) ])
+                hits.rowId = np.arange(len(hits))
+                rows = hits.toRows()
+                if rows.shape != expected.shape or any(list(a) != list(b) for a, b in zip(rows.tolist(), expected.tolist())) :
+                    failures.append('filters {0}/{1}/{2}, chunks of {3}: {4} hits instead of {5}, {6} differ'.format(min_id, min_cov, min_ratio, \
+                                    chunkSize, len(rows), len(expected), sum(list(a) != list(b) for a, b in zip(rows.tolist(), expected.tolist()))))
+    finally :
+        shutil.rmtree(tmp)
+    return failures
+
+
+@check('configure.seqStore')
+def _(data, rng, size) :
+    '''a FASTQ file keeps its records and qualities: no store is built from it, and none next to it is used'''
+    import tempfile, shutil
+    from modules.configure import buildSeqStore, loadSeqStore, readFastq, _sourceStat
+    seqs = readFasta(data['query'])
+    names = sorted(seqs)[:2]
+    failures, tmp = [], tempfile.mkdtemp(prefix='EQ_')
+    try :
+        fasta, fastq = os.path.join(tmp, 'ref.fasta'), os.path.join(tmp, 'ref.fastq')
+        quals = { n: ''.join(chr(33 + q) for q in rng.randint(2, 41, size=len(seqs[n]))) for n in names }
+        with open(fasta, 'w') as fout :
+            fout.write(''.join('>{0}\n{1}\n'.format(n, seqs[n]) for n in names))
+        with open(fastq, 'w') as fout :
+            fout.write(''.join('@{0}\n{1}\n+\n{2}\n'.format(n, seqs[n], quals[n]) for n in names))
+        store = buildSeqStore(fasta)
+        if [ (n, str(store[n])) for n in store ] != [ (n, seqs[n]) for n in names ] :
+            failures.append('store of a FASTA differs from the FASTA')
+        try :
+            buildSeqStore(fastq)
+            failures.append('a store was built from a FASTQ file')
+        except ValueError :
+            pass
+        # a store left next to the FASTQ by an older version, up to date with the file
+        buildSeqStore(fasta, fastq)
+        idx = dict(np.load(fastq + '.2bit.idx.npz'))
+        idx['source'] = _sourceStat(fastq)
+        np.savez(fastq + '.2bit.idx.npz', **idx)
+        if loadSeqStore(fastq) is not None :
+            failures.append('the store next to a FASTQ file is used')
+        s, q = readFastq(fastq)
+        if list(s.items()) != [ (n, seqs[n]) for n in names ] or list(q.items()) != [ (n, quals[n]) for n in names ] :
+            failures.append('readFastq of a FASTQ file with a store next to it: {0} records'.format(len(s)))
+    finally :
+        shutil.rmtree(tmp)
+    return failures
+
+
+@check('uberBlast.blastSeqs')
+def _(data, rng, size) :
+    '''sequences given in memory under names that are not strings (as ortho does) give the hits of their str() names'''
+    from modules.uberBlast import blastSeqs, blastParams
+    ref, qry = readFasta(data['query']), readFasta(data['alleles'])
+    refNames, qryNames = sorted(ref)[:3], sorted(qry)[:100]
+    params = blastParams(sw=True, re_score=1, filter=True, linear_merge=True, return_overlap=True, n_thread=2, fix_end=[0, 3])
+    failures = []
+    try :
+        hits, overlap = blastSeqs({ i: ref[n] for i, n in enumerate(refNames) }, { i: qry[n] for i, n in enumerate(qryNames) }, params)
+    except Exception as e :
+        return ['integer names: {0}: {1}'.format(type(e).__name__, e)]
+    expected, expOverlap = blastSeqs({ str(i): ref[n] for i, n in enumerate(refNames) }, { str(i): qry[n] for i, n in enumerate(qryNames) }, params)
+    if not len(expected) :
+        failures.append('no hits to compare')
+    if hits.tolist() != expected.tolist() or not sameArray(overlap, expOverlap) :
+        failures.append('integer names: {0} hits instead of {1}'.format(len(hits), len(expected)))
+    return failures
+
+
+def equivalence(args) :
+    parser = argparse.ArgumentParser(description='Check compiled kernels against the reference implementations on random inputs.')
+    parser.add_argument('-c', '--checks', help='checks to run; a prefix selects a group [DEFAULT: all]', nargs='*', default=None)
+    parser.add_argument('-n', '--size', help='[DEFAULT: 5000] number of random items (e.g. hits) per check', type=int, default=5000)
+    parser.add_argument('-s', '--scale', help='[DEFAULT: 1.0] size of the synthetic dataset (see synthetic.py)', type=float, default=1.0)
+    parser.add_argument('--seed', help='[DEFAULT: 42] random seed of the dataset and of the checks', type=int, default=42)
+    parser.add_argument('-d', '--data', help='[DEFAULT: {0}] folder for the synthetic dataset; reused if the parameters match'.format(synthetic.dataDir), default=synthetic.dataDir)
+    args = parser.parse_args(args)
+
+    data = synthetic.dataset(args.data, args.scale, args.seed)
+    data = {k: os.path.abspath(v) for k, v in data.items()}
+    failed = []
+    for name, func in checks :
+        if args.checks and not any(name.startswith(c) for c in args.checks) :
+            continue
+        failures = func(data, np.random.RandomState(args.seed), args.size)
+        logger('{0}\t{1}'.format(name, 'FAILED' if failures else 'OK'))
+        for f in failures :
+            logger('    ' + f)
+        if failures :
+            failed.append(name)
+    return failed
+
+
+if __name__ == '__main__' :
+    sys.exit(1 if equivalence(sys.argv[1:]) else 0)
@@ -0,0 +1,361 @@
+#! /usr/bin/env python3
+# reproducible performance benchmarks of EToKi on synthetic data (see synthetic.py):
+#   micro : parsers, sequence containers, numba kernels and the uberBlast hit-table steps, timed in-process
+#   e2e   : whole subcommands (prepare, assemble, MLSType, uberBlast, align, phylo) run through EToKi.py, with the
+#           stage report of each run (ETOKI_REPORT) kept in the results
+# 3rd party programs missing from externals/ are replaced by the stand-ins in standins.py; workloads that still
+# lack a program or a python library are reported as skipped. Results can be saved as a baseline and compared
+# against one; exits with 1 if any workload fails or regresses.
+import os, sys, time, json, argparse, tempfile, subprocess, platform, gc
+import numpy as np
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ETOKI = os.path.dirname(BENCH)
+sys.path.insert(0, ETOKI)
+sys.path.insert(0, BENCH)
+from modules.configure import logger, externals
+import synthetic
+
+standinPrograms = ['bbduk', 'repair', 'bbmerge', 'spades', 'makeblastdb', 'blastn', 'minimap2', 'usearch', 'diamond']
+
+
+# ---------- micro-benchmarks ----------
+micros = []
+def micro(name) :
+    '''register a micro-benchmark: the decorated function prepares its inputs from the dataset and returns the callable to time'''
+    def wrap(func) :
+        micros.append([name, func])
+        return func
+    return wrap
+
+@micro('parse.iterFasta')
+def _(data) :
+    from modules.configure import iterFasta
+    return lambda : sum(len(s) for n, s in iterFasta(data['reference_gz']))
+
+@micro('parse.iterFastq')
+def _(data) :
+    from modules.configure import iterFastq
+    return lambda : sum(len(s) for n, s, q in iterFastq(data['reads_1']))
+
+@micro('parse.uopen')
+def _(data) :
+    from modules.configure import uopen
+    def run() :
+        with uopen(data['reads_1']) as fin :
+            return sum(1 for line in fin)
+    return run
+
+@micro('seq.SeqBatch.rc')
+def _(data) :
+    from modules.configure import SeqBatch
+    batch = SeqBatch.fromFasta(data['query'])
+    return lambda : batch.rc()
+
+@micro('seq.transeqBatch')
+def _(data) :
+    from modules.configure import SeqBatch, transeqBatch
+    batch = SeqBatch.fromFasta(data['query'])
+    return lambda : transeqBatch(batch, 7, stops=True)
+
+@micro('seq.transeq')
+def _(data) :
+    from modules.configure import readFasta, transeq
+    seqs = readFasta(data['alleles'])
+    return lambda : transeq(seqs, frame='1,2,3')
+
+@micro('cgMLST.seq_status')
+def _(data) :
+    from modules.configure import readFasta
+    from modules.cgMLST import seq_status
+    seqs = list(readFasta(data['alleles']).items())
+    return lambda : seq_status(seqs)
+
+@micro('uberBlast.translateRef')
+def _(data) :
+    from modules.configure import readFasta
+    from modules.uberBlast import RunBlast
+    rb = RunBlast()
+    rb.refSeq, rb.table_id = readFasta(data['query']), 11
+    return lambda : rb.translateRef('7')
+
+@micro('uberBlast.reScore')
+def _(data) :
+    from modules.uberBlast import RunBlast, HitTable
+    tab = HitTable.fromRows(np.load(data['hits'], allow_pickle=True))
+    def run() :
+        return RunBlast().reScore(data['query'], data['alleles'], tab.copy(), 2, 0.)
+    return run
+
+@micro('uberBlast.ovlFilter')
+def _(data) :
+    from modules.uberBlast import RunBlast, HitTable
+    tab = HitTable.fromRows(np.load(data['hits'], allow_pickle=True))
+    return lambda : RunBlast().ovlFilter(tab.copy(), [True, 0.9, 0.])
+
+# scaling of ovlFilter on repetitive hits: the overlap depth grows with the number of hits, the worst case of the sweep
+def ovlFilterRepeats(nHit) :
+    def prepare(data) :
+        from modules.uberBlast import RunBlast, HitTable
+        tab = HitTable.fromRows(synthetic.repeatHits(np.random.RandomState(nHit), nHit, depth=nHit/50))
+        return lambda : RunBlast().ovlFilter(tab.copy(), [True, 0.9, 50.])
+    return prepare
+for nHit in (1000, 4000, 16000, 64000) :
+    micro('uberBlast.ovlFilter.repeats_{0}k'.format(nHit//1000))(ovlFilterRepeats(nHit))
+
+# returnOverlap on a deep pile of hits (~4 million pairs)
+@micro('uberBlast.returnOverlap.dense')
+def _(data) :
+    from modules.uberBlast import RunBlast, HitTable
+    tab = HitTable.fromRows(synthetic.repeatHits(np.random.RandomState(42), 50000, depth=100))
+    return lambda : RunBlast().returnOverlap(tab, [True, 100, 0.3])
+
+@micro('uberBlast.linearMerge')
+def _(data) :
+    from modules.uberBlast import RunBlast, HitTable
+    tab = HitTable.fromRows(np.load(data['hits'], allow_pickle=True))
+    return lambda : RunBlast().linearMerge(tab.copy(), [True, 300., 1.2])
+
+# linearMerge of an MLST-like run: every locus hits 200 genomes of 20 contigs each
+@micro('uberBlast.linearMerge.mlst')
+def _(data) :
+    from modules.configure import readFasta
+    from modules.uberBlast import RunBlast, HitTable
+    rng = np.random.RandomState(42)
+    qryLens = {n: len(s) for n, s in readFasta(data['alleles']).items()}
+    refLens = {'genome_{0}_contig_{1}'.format(g, c): rng.randint(2000, 200000) for g in range(200) for c in range(20)}
+    tab = HitTable.fromRows(synthetic.hitTable(rng, qryLens, refLens, hitsPerQry=200, fragmented=0.2))
+    rb = RunBlast()
+    rb.n_thread = os.cpu_count() or 1
+    return lambda : rb.linearMerge(tab.copy(), [True, 300., 1.2])
+
+@micro('uberBlast.returnOverlap')
+def _(data) :
+    from modules.uberBlast import RunBlast, HitTable
+    tab = HitTable.fromRows(np.load(data['hits'], allow_pickle=True))
+    return lambda : RunBlast().returnOverlap(tab, [True, 300, 0.6])
+
+# writing a result of uberBlast and reading it back, as tab-delimited text and as npz
+def outputRoundTrip(outfmt) :
+    def prepare(data) :
+        from modules.configure import readFasta
+        from modules.uberBlast import HitTable, writeHits, readHits
+        rng = np.random.RandomState(42)
+        qryLens = {n: len(s) for n, s in readFasta(data['alleles']).items()}
+        refLens = {'genome_{0}_contig_{1}'.format(g, c): rng.randint(2000, 200000) for g in range(50) for c in range(20)}
+        tab = HitTable.fromRows(synthetic.hitTable(rng, qryLens, refLens, hitsPerQry=50, fragmented=0.2))
+        fname = os.path.join(tempfile.mkdtemp(prefix='output.'), 'hits.' + outfmt)
+        def run() :
+            if outfmt == 'npz' :
+                tab.save(fname)
+            else :
+                with open(fname, 'w') as fout :
+                    writeHits(tab.toRows(), fout)
+            return readHits(fname, asTable=True)
+        return run
+    return prepare
+for outfmt in ('tab', 'npz') :
+    micro('uberBlast.output.{0}'.format(outfmt))(outputRoundTrip(outfmt))
+
+def runMicro(name, func, data, repeat) :
+    try :
+        target = func(data)
+        t = time.time()
+        target()
+        first = time.time() - t
+        ts = []
+        for _ in range(repeat) :
+            gc.collect()
+            t = time.time()
+            target()
+            ts.append(time.time() - t)
+        return dict(kind='micro', status='ok', seconds=round(min(ts), 4), first_s=round(first, 4))
+    except Exception as e :
+        return dict(kind='micro', status='failed', error='{0}: {1}'.format(type(e).__name__, e))
+
+
+# ---------- end-to-end runs ----------
+# [name, EToKi arguments, programs needed, python libraries needed, extra environment]
+def e2eWorkloads(data, n_thread) :
+    strains = sorted(k for k in data if k.startswith('strain_'))
+    return [
+        ['prepare', ['prepare', '--pe', '{reads_1},{reads_2}', '-p', 'prep', '-c', str(n_thread)], ['bbduk', 'repair'], [], {}],
+        ['assemble', ['assemble', '--pe', '{reads_1},{reads_2}', '-p', 'asm', '--numPolish', '0', '--noQuality', '--n_cpu', str(n_thread)], \
+            ['spades'], [], {'ETOKI_STANDIN_CONTIGS': '{query}'}],
+        ['MLSType', ['MLSType', '-i', '{query}', '-r', '{references}', '-k', 'bench', '-o', 'mlst.out'], ['makeblastdb', 'blastn', 'usearch'], [], {}],
+        ['uberBlast', ['uberBlast', '-q', '{alleles}', '-r', '{query}', '-o', 'ub.bsn', '--blastn', '-s', '2', '-f', '-m', '-t', str(n_thread)], \
+            ['makeblastdb', 'blastn'], ['pandas'], {}],
+        ['uberBlast.minimap', ['uberBlast', '-q', '{alleles}', '-r', '{query}', '-o', 'ub.bsn', '--minimap', '-s', '2', '-f', '-m', '-t', str(n_thread)], \
+            ['minimap2'], [], {}],
+        ['uberBlast.sw', ['uberBlast', '-q', '{alleles}', '-r', '{query}', '-o', 'ub.bsn', '--sw', '-s', '2', '-f', '-m', '-t', str(n_thread)], [], [], {}],
+        ['uberBlast.diamond', ['uberBlast', '-q', '{alleles}', '-r', '{query}', '-o', 'ub.bsn', '--diamond', '-t', str(n_thread)], ['diamond'], [], {}],
+        # every repeat family has many copies; compare the peak RSS of the two runs to see what --top_k saves
+        ['uberBlast.repeats', ['uberBlast', '-q', '{repeat_families}', '-r', '{repeat_genome}', '-o', 'ub.bsn', '--blastn', '-s', '2', '-f', '-m', '-t', str(n_thread)], \
+            ['makeblastdb', 'blastn'], [], {}],
+        ['uberBlast.repeats.top_k', ['uberBlast', '-q', '{repeat_families}', '-r', '{repeat_genome}', '-o', 'ub.bsn', '--blastn', '-s', '2', '-f', '-m', '--top_k', '1', \
+            '-t', str(n_thread)], ['makeblastdb', 'blastn'], [], {}],
+        ['align', ['align', '-r', 'reference:{reference}', '-p', 'aln', '-n', str(n_thread)] + ['{0}:{{{0}}}'.format(s) for s in strains], \
+            ['minimap2', 'trf', 'pilercr'], [], {}],
+        ['phylo.matrix', ['phylo', '-t', 'matrix', '-p', 'phy', '-m', '{alignment}', '-n', str(n_thread)], [], [], {}],
+        ['phylo.all', ['phylo', '-t', 'all', '--nj', '-p', 'phy', '-m', '{alignment}', '-n', str(n_thread)], ['rapidnj', 'treetime'], ['ete3'], {}],
+    ]
+
+def programPath(cmd) :
+    '''the executable file behind an entry of configure.externals ("python script.py" resolves to the script)'''
+    parts = [p for p in str(cmd).split() if p not in (sys.executable, 'python', 'python3')]
+    return parts[0] if parts else ''
+
+def resolvePrograms(mode) :
+    '''{program: [command, "bundled"|"standin"|"missing"]} for every program a workload may need'''
+    res = {}
+    for prog, cmd in externals.items() :
+        path = programPath(cmd)
+        found = os.path.isfile(path) and os.access(path, os.X_OK if not path.endswith('.py') else os.R_OK)
+        res[prog] = [cmd, 'bundled' if found else 'missing']
+    for prog in standinPrograms :
+        if mode == 'always' or (mode == 'missing' and res.get(prog, [0, 'missing'])[1] == 'missing') :
+            script = os.path.join(BENCH, 'standins.py')
+            # assemble runs spades as "<python> {spades}"
+            res[prog] = ['{0} {1}'.format(script, prog) if prog == 'spades' else '{0} {1} {2}'.format(sys.executable, script, prog), 'standin']
+    return res
+
+def hasLibrary(name) :
+    import importlib.util
+    return importlib.util.find_spec(name) is not None
+
+driver = '''import sys, json
+sys.path.insert(0, sys.argv[1])
+from modules import configure
+configure.externals.update(json.loads(sys.argv[2]))
+sys.argv = ['EToKi.py'] + sys.argv[3:]
+import EToKi
+EToKi.etoki()
+'''
+
+def runE2E(name, argv, programs, libraries, env, data, resolved, workdir, repeat) :
+    tools = {p: resolved.get(p, [None, 'missing'])[1] for p in programs}
+    missing = [p for p, s in tools.items() if s == 'missing'] + [l for l in libraries if not hasLibrary(l)]
+    if missing :
+        return dict(kind='e2e', status='skipped', missing=missing, tools=tools)
+    argv = [a.format(**data) for a in argv]
+    env = dict(os.environ, **{k: v.format(**data) for k, v in env.items()})
+    overrides = {p: c for p, (c, s) in resolved.items() if s == 'standin'}
+    best = None
+    for ite in range(repeat) :
+        runDir = tempfile.mkdtemp(prefix='{0}.{1}.'.format(name, ite), dir=workdir)
+        env['ETOKI_REPORT'] = os.path.join(runDir, 'report.json')
+        t = time.time()
+        p = subprocess.Popen([sys.executable, '-c', driver, ETOKI, json.dumps(overrides)] + argv, cwd=runDir, env=env, \
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        out, err = p.communicate()
+        wall = time.time() - t
+        try :
+            with open(env['ETOKI_REPORT']) as fin :
+                report = json.load(fin)
+        except :
+            report = {'status': 'error', 'stages': {}}
+        if p.returncode != 0 or report.get('status') != 'ok' :
+            return dict(kind='e2e', status='failed', tools=tools, returncode=p.returncode, error=err.strip().split('\n')[-5:])
+        root = report['stages']
+        res = dict(kind='e2e', status='ok', tools=tools, seconds=round(wall, 3), cpu_s=round(root['cpu_s'] + root['child_cpu_s'], 3), \
+                   peak_rss_mb=report.get('max_rss_mb'), stages={s['name']: s['wall_s'] for s in root.get('stages', [])})
+        if best is None or res['seconds'] < best['seconds'] :
+            best = res
+    return best
+
+
+# ---------- baselines ----------
+def compare(results, baseline, tolerance, minDiff) :
+    '''[name, baseline seconds, current seconds, ratio, flag] for every workload; flags: regression, faster,
+    new, failed, skipped and incomparable (different programs or stand-ins than in the baseline)'''
+    rows = []
+    for name in sorted(results) :
+        cur, base = results[name], baseline.get(name)
+        if cur['status'] != 'ok' :
+            rows.append([name, base.get('seconds') if base else None, None, None, cur['status']])
+        elif base is None or base.get('status') != 'ok' :
+            rows.append([name, None, cur['seconds'], None, 'new'])
+        elif base.get('tools') != cur.get('tools') :
+            rows.append([name, base['seconds'], cur['seconds'], None, 'incomparable'])
+        else :
+            ratio = cur['seconds'] / max(base['seconds'], 1e-6)
+            diff = cur['seconds'] - base['seconds']
+            flag = 'regression' if ratio > 1+tolerance and diff > minDiff else \
+                   ('faster' if ratio < 1./(1+tolerance) and -diff > minDiff else '')
+            rows.append([name, base['seconds'], cur['seconds'], round(ratio, 3), flag])
+    return rows
+
+def writeReport(rows, pipe=sys.stderr) :
+    fmt = lambda v : '-' if v is None else ('{0:.3f}'.format(v) if isinstance(v, float) else str(v))
+    pipe.write('{0:<28}{1:>12}{2:>12}{3:>8}  {4}\n'.format('workload', 'baseline_s', 'current_s', 'ratio', 'flag'))
+    for row in rows :
+        pipe.write('{0:<28}{1:>12}{2:>12}{3:>8}  {4}\n'.format(*[fmt(v) for v in row]))
+
+
+def run_benchmarks(args) :
+    parser = argparse.ArgumentParser(description='Run the EToKi benchmark suite on synthetic data and compare against a stored baseline.')
+    parser.add_argument('-w', '--workloads', help='workloads to run; a prefix selects a group, e.g. "uberBlast." [DEFAULT: all]', nargs='*', default=None)
+    parser.add_argument('-k', '--kind', help='[DEFAULT: all] run only micro or e2e workloads', choices=['all', 'micro', 'e2e'], default='all')
+    parser.add_argument('-s', '--scale', help='[DEFAULT: 1.0] size of the synthetic dataset (see synthetic.py)', type=float, default=1.0)
+    parser.add_argument('--seed', help='[DEFAULT: 42] random seed of the synthetic dataset', type=int, default=42)
+    parser.add_argument('-d', '--data', help='[DEFAULT: {0}] folder for the synthetic dataset; reused if the parameters match'.format(synthetic.dataDir), default=synthetic.dataDir)
+    parser.add_argument('-r', '--repeat', help='[DEFAULT: 5] runs of each micro-benchmark; the fastest is reported', type=int, default=5)
+    parser.add_argument('-R', '--e2e_repeat', help='[DEFAULT: 1] runs of each end-to-end workload; the fastest is reported', type=int, default=1)
+    parser.add_argument('-t', '--n_thread', help='[DEFAULT: 2] threads given to the end-to-end workloads', type=int, default=2)
+    parser.add_argument('--standins', help='[DEFAULT: missing] when to use the stand-ins in standins.py instead of programs in externals/', \
+                        choices=['missing', 'always', 'never'], default='missing')
+    parser.add_argument('-b', '--baseline', help='[DEFAULT: baselines/default.json] baseline to compare with', default=os.path.join(BENCH, 'baselines', 'default.json'))
+    parser.add_argument('--save', help='save the results as a new baseline into this file', default=None)
+    parser.add_argument('--tolerance', help='[DEFAULT: 0.25] slow-down (as a fraction) before a workload is flagged as a regression', type=float, default=0.25)
+    parser.add_argument('--min_diff', help='[DEFAULT: 0.1] slow-downs smaller than this (in seconds) are never flagged', type=float, default=0.1)
+    parser.add_argument('-o', '--output', help='write results and comparison as JSON to this file', default=None)
+    args = parser.parse_args(args)
+
+    selected = lambda name : args.workloads is None or any(name == w or name.startswith(w) for w in args.workloads)
+    logger('Preparing synthetic data (scale {0}) in {1}'.format(args.scale, args.data))
+    data = synthetic.dataset(args.data, args.scale, args.seed)
+    data = {k: os.path.abspath(v) for k, v in data.items()}
+
+    results = {}
+    if args.kind in ('all', 'micro') :
+        for name, func in micros :
+            if selected(name) :
+                results[name] = runMicro(name, func, data, args.repeat)
+                logger('{0}\t{1}\t{2}'.format(name, results[name]['status'], results[name].get('seconds', results[name].get('error'))))
+    if args.kind in ('all', 'e2e') :
+        resolved = resolvePrograms(args.standins)
+        workdir = os.path.abspath(tempfile.mkdtemp(prefix='EB_', dir='.'))
+        try :
+            for name, argv, programs, libraries, env in e2eWorkloads(data, args.n_thread) :
+                if selected(name) :
+                    results[name] = runE2E(name, argv, programs, libraries, env, data, resolved, workdir, args.e2e_repeat)
+                    r = results[name]
+                    logger('{0}\t{1}\t{2}'.format(name, r['status'], r.get('seconds', r.get('missing', r.get('error')))))
+        finally :
+            import shutil
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    meta = dict(scale=args.scale, seed=args.seed, n_thread=args.n_thread, repeat=args.repeat, python=platform.python_version(), \
+                numpy=np.__version__, machine=platform.machine(), cpus=os.cpu_count(), date=time.strftime('%Y-%m-%d'))
+    rows = []
+    if args.baseline and os.path.isfile(args.baseline) :
+        with open(args.baseline) as fin :
+            baseline = json.load(fin)
+        if baseline['meta'].get('scale') != args.scale or baseline['meta'].get('seed') != args.seed :
+            logger('Baseline {0} was recorded on a different dataset (scale {1}, seed {2}); not compared.'.format( \
+                args.baseline, baseline['meta'].get('scale'), baseline['meta'].get('seed')))
+        else :
+            rows = compare(results, baseline['results'], args.tolerance, args.min_diff)
+            writeReport(rows)
+    if args.save :
+        if not os.path.isdir(os.path.dirname(os.path.abspath(args.save))) :
+            os.makedirs(os.path.dirname(os.path.abspath(args.save)))
+        with open(args.save, 'w') as fout :
+            json.dump(dict(meta=meta, results=results), fout, indent=1, sort_keys=True)
+    if args.output :
+        with open(args.output, 'w') as fout :
+            json.dump(dict(meta=meta, results=results, comparison=rows), fout, indent=1, sort_keys=True)
+    return [name for name, r in results.items() if r['status'] == 'failed'] + [r[0] for r in rows if r[4] == 'regression']
+
+
+if __name__ == '__main__' :
+    sys.exit(1 if run_benchmarks(sys.argv[1:]) else 0)
@@ -0,0 +1,389 @@
+#! /usr/bin/env python3
+# local stand-ins for the 3rd party programs called by EToKi, so that the end-to-end benchmarks run on a box
+# without the real binaries. Each stand-in accepts the command line EToKi sends, writes outputs in the same
+# format and does a comparable (but much simpler) amount of work:
+#   bbduk / repair / bbmerge : quality trimming and pass-through of fastq files
+#   spades                   : copies the FASTA in $ETOKI_STANDIN_CONTIGS (or chunks the reads) into contigs.fasta
+#   makeblastdb / blastn     : k-mer seeds + ungapped extension, reported in BLAST tabular format
+#   minimap2                 : the same seeds, chained across small indels and reported in PAF with cg:Z tags
+#   usearch                  : no-op that writes an empty result
+#   diamond                  : amino acid seeds, chained into gapped alignments, reported in SAM (101) or tabular (6)
+# Usage: standins.py <program> <arguments of the program>
+import os, sys, gzip, shutil
+import numpy as np
+
+complement = str.maketrans('ACGTNacgtn', 'TGCANtgcan')
+encoder = np.full(256, 4, dtype=np.int64)
+encoder[np.frombuffer(b'ACGTacgt', dtype=np.uint8)] = [0, 1, 2, 3, 0, 1, 2, 3]
+aaEncoder = np.full(256, 20, dtype=np.int64)
+aaEncoder[np.frombuffer(b'ACDEFGHIKLMNPQRSTVWY', dtype=np.uint8)] = np.arange(20)
+
+def xopen(fname, mode='rt') :
+    with open(fname, 'rb') as fin :
+        magic = fin.read(2)
+    return gzip.open(fname, mode) if magic == b'\x1f\x8b' else open(fname, mode)
+
+def readSeqs(fname) :
+    seqs, name, buf = {}, None, []
+    with xopen(fname) as fin :
+        head = fin.read(1)
+        fin.seek(0)
+        if head == '@' :
+            for id, line in enumerate(fin) :
+                if id % 4 == 0 :
+                    name = line[1:].strip().split()[0]
+                elif id % 4 == 1 :
+                    seqs[name] = line.strip().upper()
+            return seqs
+        for line in fin :
+            if line.startswith('>') :
+                if name is not None :
+                    seqs[name] = ''.join(buf).upper()
+                name, buf = line[1:].strip().split()[0], []
+            else :
+                buf.append(line.strip())
+        if name is not None :
+            seqs[name] = ''.join(buf).upper()
+    return seqs
+
+def keyValues(argv) :
+    return dict(a.split('=', 1) for a in argv if '=' in a and not a.startswith('-'))
+
+
+# ---------- bbtools ----------
+def iterFastq(fname) :
+    with xopen(fname) as fin :
+        while True :
+            lines = [fin.readline() for _ in range(4)]
+            if not lines[0] :
+                return
+            yield [l.rstrip('\n') for l in lines]
+
+def qualTrim(rec, trimq) :
+    q = np.frombuffer(rec[3].encode(), dtype=np.uint8).astype(int) - 33 >= trimq
+    good = np.where(q)[0]
+    if good.size == 0 :
+        return None
+    s, e = good[0], good[-1]+1
+    return [rec[0], rec[1][s:e], '+', rec[3][s:e]]
+
+def writeRecords(fout, recs) :
+    if fout is not None :
+        fout.write(''.join('{0}\n{1}\n{2}\n{3}\n'.format(*r) for r in recs))
+
+def bbtools(program, argv) :
+    kv = keyValues(argv)
+    trimq, minLen = int(kv.get('trimq', 0)), int(kv.get('minlength', 0))
+    outs = {k: gzip.open(kv[k], 'wt', compresslevel=1) if kv[k].endswith('.gz') else open(kv[k], 'wt') \
+            for k in ('out', 'out2', 'outs', 'outu1', 'outu2') if k in kv}
+    nRead = nBase = 0
+    if program == 'bbmerge' :
+        # nothing is merged; every pair is reported as unmerged
+        outs['out2'], outs['out'] = outs.pop('outu2', None), outs.pop('outu1', None)
+    inputs = [iterFastq(kv['in'])] + ([iterFastq(kv['in2'])] if 'in2' in kv else [])
+    for recs in zip(*inputs) :
+        nRead += len(recs)
+        if program == 'bbduk' and trimq > 0 :
+            recs = [qualTrim(r, trimq) for r in recs]
+            recs = [r if r is not None and len(r[1]) >= minLen else None for r in recs]
+        nBase += sum(len(r[1]) for r in recs if r is not None)
+        if len(recs) == 2 :
+            if recs[0] is not None and recs[1] is not None :
+                writeRecords(outs.get('out'), recs[:1])
+                writeRecords(outs.get('out2'), recs[1:])
+            else :
+                writeRecords(outs.get('outs'), [r for r in recs if r is not None])
+        elif recs[0] is not None :
+            writeRecords(outs.get('out'), recs)
+    for fout in outs.values() :
+        if fout is not None :
+            fout.close()
+    if 'refstats' in kv :
+        with open(kv['refstats'], 'wt') as fout :
+            fout.write('#File\tadapters\n#Reads\t{0}\n#Mapped\t0\n'.format(nRead))
+    sys.stderr.write('Input:\t{0} reads\t{1} bases\n'.format(nRead, nBase))
+
+
+# ---------- spades ----------
+def spades(argv) :
+    outdir = argv[argv.index('-o')+1]
+    if not os.path.isdir(outdir) :
+        os.makedirs(outdir)
+    contigs = os.environ.get('ETOKI_STANDIN_CONTIGS', '')
+    if os.path.isfile(contigs) :
+        seqs = readSeqs(contigs)
+    else :
+        reads = [argv[i+2] for i, a in enumerate(argv) if a in ('--pe-1', '--pe-s', '-s')]
+        seqs, buf = {}, []
+        for fname in reads :
+            for rec in iterFastq(fname) :
+                buf.append(rec[1])
+                if len(buf) >= 200 :
+                    seqs['NODE_{0}'.format(len(seqs)+1)] = ''.join(buf)
+                    buf = []
+    with open(os.path.join(outdir, 'contigs.fasta'), 'wt') as fout :
+        for id, (n, s) in enumerate(sorted(seqs.items())) :
+            fout.write('>NODE_{0}_length_{1}_cov_20.0\n{2}\n'.format(id+1, len(s), s))
+
+
+# ---------- seeding and extension, shared by blastn and minimap2 ----------
+class SeedIndex(object) :
+    def __init__(self, seqs, k, maxOcc=20, encoder=encoder, base=4) :
+        self.names = sorted(seqs)
+        self.seqs = [seqs[n] for n in self.names]
+        self.k, self.encoder, self.base = k, encoder, base
+        codes, self.starts = [], np.cumsum([0] + [len(s) + k for s in self.seqs])
+        for s in self.seqs :
+            codes.append(np.concatenate([self.kmers(s), np.full(k, -1, dtype=np.int64)]))
+        codes = np.concatenate(codes)
+        pos = np.where(codes >= 0)[0]
+        order = np.argsort(codes[pos], kind='stable')
+        self.codes, self.pos = codes[pos][order], pos[order]
+        u, inv, cnt = np.unique(self.codes, return_inverse=True, return_counts=True)
+        keep = cnt[inv] <= maxOcc
+        self.codes, self.pos = self.codes[keep], self.pos[keep]
+
+    def kmers(self, s) :
+        enc = self.encoder[np.frombuffer(s.encode(), dtype=np.uint8)]
+        k = self.k
+        if enc.size < k :
+            return np.full(enc.size, -1, dtype=np.int64)
+        win = np.lib.stride_tricks.sliding_window_view(enc, k)
+        codes = win.dot(self.base ** np.arange(k-1, -1, -1, dtype=np.int64))
+        codes[np.any(win >= self.base, 1)] = -1
+        return np.concatenate([codes, np.full(k-1, -1, dtype=np.int64)])
+
+    def seeds(self, qry, step=1) :
+        '''returns [qpos, target id, tpos] of all exact k-mer matches'''
+        codes = self.kmers(qry)
+        qPos = np.arange(0, codes.size, step)
+        qPos = qPos[codes[qPos] >= 0]
+        lo = np.searchsorted(self.codes, codes[qPos], 'left')
+        hi = np.searchsorted(self.codes, codes[qPos], 'right')
+        n = hi - lo
+        qPos = np.repeat(qPos, n)
+        idx = np.repeat(lo - np.cumsum(np.concatenate([[0], n[:-1]])), n) + np.arange(np.sum(n))
+        gPos = self.pos[idx]
+        tId = np.searchsorted(self.starts, gPos, 'right') - 1
+        return qPos, tId, gPos - self.starts[tId]
+
+def ungapped(qry, ref, qs, qe, ts, reward, penalty, xWin=100) :
+    '''extend a seeded diagonal block [qs, qe) x [ts, ...) in both directions without gaps'''
+    def ext(q, r) :
+        n = min(len(q), len(r))
+        if n == 0 :
+            return 0
+        sc = np.cumsum(np.where(np.frombuffer(q[:n].encode(), dtype=np.uint8) == np.frombuffer(r[:n].encode(), dtype=np.uint8), reward, penalty))
+        best = int(np.argmax(sc))
+        return best+1 if sc[best] > 0 else 0
+    left = ext(qry[max(qs-xWin, 0):qs][::-1], ref[max(ts-xWin, 0):ts][::-1])
+    right = ext(qry[qe:qe+xWin], ref[ts+qe-qs:ts+qe-qs+xWin])
+    return qs-left, qe+right, ts-left
+
+def hsps(index, qry, reward=2, penalty=-3, maxGap=200, minLen=30) :
+    '''ungapped high-scoring pairs of <qry> (both strands) against the index.
+    returns [strand, tId, qs, qe, ts, te, nMatch], 0-based half-open, with query coordinates on the searched strand'''
+    res = []
+    for strand, q in (('+', qry), ('-', qry.translate(complement)[::-1])) :
+        qPos, tId, tPos = index.seeds(q)
+        if qPos.size == 0 :
+            continue
+        diag = tPos - qPos
+        order = np.lexsort([qPos, diag, tId])
+        qPos, tId, diag = qPos[order], tId[order], diag[order]
+        brk = np.where((np.diff(tId) != 0) | (np.diff(diag) != 0) | (np.diff(qPos) > maxGap))[0] + 1
+        for s, e in zip(np.concatenate([[0], brk]), np.concatenate([brk, [qPos.size]])) :
+            t, d = tId[s], diag[s]
+            qs, qe = qPos[s], qPos[e-1] + index.k
+            ref = index.seqs[t]
+            qs, qe, ts = ungapped(q, ref, qs, qe, qs+d, reward, penalty)
+            if qe - qs < minLen :
+                continue
+            nMatch = int(np.sum(np.frombuffer(q[qs:qe].encode(), dtype=np.uint8) == np.frombuffer(ref[ts:ts+qe-qs].encode(), dtype=np.uint8)))
+            res.append([strand, t, qs, qe, ts, ts+qe-qs, nMatch])
+    return res
+
+
+# ---------- BLAST+ ----------
+def option(argv, key, default=None) :
+    return argv[argv.index(key)+1] if key in argv else default
+
+def makeblastdb(argv) :
+    fasta = option(argv, '-in')
+    out = option(argv, '-out', fasta)
+    with open(out + '.sdb', 'wt') as fout :
+        fout.write(os.path.abspath(fasta) + '\n')
+
+def blastn(argv) :
+    db = option(argv, '-db')
+    with open(db + '.sdb') as fin :
+        ref = readSeqs(fin.read().strip())
+    reward, penalty = int(option(argv, '-reward', 2)), int(option(argv, '-penalty', -3))
+    minIden, minCov = float(option(argv, '-perc_identity', 0))/100., float(option(argv, '-qcov_hsp_perc', 0))/100.
+    index = SeedIndex(ref, min(int(option(argv, '-word_size', 15)), 15))
+    out = option(argv, '-out')
+    fout = open(out, 'wt') if out else sys.stdout
+    for qn, qs_ in readSeqs(option(argv, '-query')).items() :
+        qLen = len(qs_)
+        for strand, t, qs, qe, ts, te, nMatch in hsps(index, qs_, reward, penalty) :
+            alnLen = qe - qs
+            if nMatch < minIden*alnLen or alnLen < minCov*qLen :
+                continue
+            tn, rSeq = index.names[t], index.seqs[t]
+            score = nMatch*reward + (alnLen-nMatch)*penalty
+            evalue = 5e6 * qLen * 2.**(-(0.625*score + 0.89)/0.693)
+            if strand == '+' :
+                q0, q1, s0, s1, qSeq, sSeq = qs+1, qe, ts+1, te, qs_[qs:qe], rSeq[ts:te]
+            else :
+                q0, q1, s0, s1 = qLen-qe+1, qLen-qs, te, ts+1
+                qSeq, sSeq = qs_[qLen-qe:qLen-qs], rSeq[ts:te].translate(complement)[::-1]
+            fout.write('{0}\t{1}\t{2:.3f}\t{3}\t{4}\t0\t{5}\t{6}\t{7}\t{8}\t{9:.2e}\t{10}\t{11}\t{12}\t{13}\t{14}\n'.format( \
+                qn, tn, 100.*nMatch/alnLen, alnLen, alnLen-nMatch, q0, q1, s0, s1, evalue, score, qLen, len(rSeq), qSeq, sSeq))
+    if out :
+        fout.close()
+
+
+# ---------- minimap2 ----------
+def chain(blocks, maxIndel=50) :
+    '''greedily join colinear blocks [qs, qe, ts, te] (sorted by qs) whose diagonals differ by <= maxIndel'''
+    chains = []
+    for b in blocks :
+        for c in chains :
+            p = c[-1]
+            dq, dt = b[0] - p[1], b[2] - p[3]
+            if -maxIndel <= dq <= maxIndel*10 and -maxIndel <= dt <= maxIndel*10 and abs(dq - dt) <= maxIndel and b[1] > p[1] and b[3] > p[3] :
+                c.append(b)
+                break
+        else :
+            chains.append([b])
+    return chains
+
+def minimap2(argv) :
+    # the "index" is a copy of the sequences, so that it stays usable once the FASTA file is gone
+    if '-d' in argv :
+        shutil.copyfile(argv[-1], option(argv, '-d'))
+        return
+    ref = readSeqs(argv[-2])
+    index = SeedIndex(ref, 15)
+    for qn, qry in readSeqs(argv[-1]).items() :
+        qLen, rq = len(qry), qry.translate(complement)[::-1]
+        byTarget = {}
+        for strand, t, qs, qe, ts, te, nMatch in hsps(index, qry, 1, -4, minLen=50) :
+            byTarget.setdefault((strand, t), []).append([qs, qe, ts, te])
+        for (strand, t), blocks in sorted(byTarget.items()) :
+            q, rSeq = qry if strand == '+' else rq, index.seqs[t]
+            for c in chain(sorted(blocks)) :
+                cigar, nMatch, nm, aLen = [], 0, 0, 0
+                prev = None
+                for qs, qe, ts, te in c :
+                    if prev is not None :
+                        # trim overlaps with the previous block, then report the gaps as I/D
+                        d = max(prev[1] - qs, prev[3] - ts, 0)
+                        qs, ts = qs + d, ts + d
+                        if qs >= qe : continue
+                        if qs > prev[1] : cigar.append([qs - prev[1], 'I'])
+                        if ts > prev[3] : cigar.append([ts - prev[3], 'D'])
+                        nm += (qs - prev[1]) + (ts - prev[3])
+                        aLen += max(qs - prev[1], ts - prev[3])
+                    m = int(np.sum(np.frombuffer(q[qs:qe].encode(), dtype=np.uint8) == np.frombuffer(rSeq[ts:ts+qe-qs].encode(), dtype=np.uint8)))
+                    nMatch, nm, aLen = nMatch + m, nm + (qe - qs - m), aLen + qe - qs
+                    cigar.append([qe - qs, 'M'])
+                    prev = [qs, qe, ts, ts+qe-qs]
+                qs, qe, ts, te = c[0][0], prev[1], c[0][2], prev[3]
+                if strand == '-' :
+                    qs, qe = qLen - qe, qLen - qs
+                score = nMatch - 4*nm
+                sys.stdout.write('{0}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\t{9}\t{10}\t60\tNM:i:{11}\tms:i:{12}\tAS:i:{12}\tnn:i:0\ttp:A:P\tcm:i:{13}\ts1:i:{14}\ts2:i:0\tde:f:{15:.4f}\trl:i:0\tcg:Z:{16}\n'.format( \
+                    qn, qLen, qs, qe, strand, index.names[t], len(rSeq), ts, te, nMatch, aLen, nm, score, len(c)*10, nMatch, \
+                    float(nm)/max(aLen, 1), ''.join('{0}{1}'.format(*x) for x in cigar)))
+
+
+# ---------- diamond ----------
+diamondFields = dict(qseqid=lambda a : a['qn'], sseqid=lambda a : a['tn'], pident=lambda a : '{0:.1f}'.format(100.*a['nident']/a['length']), \
+                     length=lambda a : a['length'], nident=lambda a : a['nident'], mismatch=lambda a : a['mismatch'], gapopen=lambda a : a['gapopen'], \
+                     qstart=lambda a : a['qs']+1, qend=lambda a : a['qe'], sstart=lambda a : a['ts']+1, send=lambda a : a['te'], \
+                     qlen=lambda a : a['qLen'], slen=lambda a : a['tLen'], evalue=lambda a : '{0:.2e}'.format(a['evalue']), \
+                     bitscore=lambda a : '{0:.1f}'.format(a['bits']), score=lambda a : a['score'], cigar=lambda a : a['cigar'])
+
+def proteinAlignments(index, qry, minLen=10) :
+    '''gapped alignments of a protein against the index: ungapped blocks from 5-mer seeds, chained across small
+    indels (see chain). Yields dicts with the values of the tabular fields.'''
+    byTarget = {}
+    qPos, tId, tPos = index.seeds(qry)
+    if qPos.size == 0 :
+        return
+    diag = tPos - qPos
+    order = np.lexsort([qPos, diag, tId])
+    qPos, tId, diag = qPos[order], tId[order], diag[order]
+    brk = np.where((np.diff(tId) != 0) | (np.diff(diag) != 0) | (np.diff(qPos) > 50))[0] + 1
+    for s, e in zip(np.concatenate([[0], brk]), np.concatenate([brk, [qPos.size]])) :
+        t, d = tId[s], diag[s]
+        qs, qe, ts = ungapped(qry, index.seqs[t], qPos[s], qPos[e-1] + index.k, qPos[s]+d, 5, -2, 30)
+        if qe - qs >= minLen :
+            byTarget.setdefault(t, []).append([qs, qe, ts, ts+qe-qs])
+    for t, blocks in sorted(byTarget.items()) :
+        ref = index.seqs[t]
+        for c in chain(sorted(blocks), 10) :
+            cigar, nident, gaps, prev = [], 0, [], None
+            for qs, qe, ts, te in c :
+                if prev is not None :
+                    d = max(prev[1] - qs, prev[3] - ts, 0)
+                    qs, ts = qs + d, ts + d
+                    if qs >= qe : continue
+                    if qs > prev[1] : cigar.append([qs - prev[1], 'I'])
+                    if ts > prev[3] : cigar.append([ts - prev[3], 'D'])
+                    gaps.extend(n for n in (qs - prev[1], ts - prev[3]) if n > 0)
+                nident += int(np.sum(np.frombuffer(qry[qs:qe].encode(), dtype=np.uint8) == np.frombuffer(ref[ts:ts+qe-qs].encode(), dtype=np.uint8)))
+                cigar.append([qe - qs, 'M'])
+                prev = [qs, qe, ts, ts+qe-qs]
+            length = sum(n for n, o in cigar)
+            score = 5*nident - 2*(length - nident - sum(gaps)) - 11*len(gaps) - sum(gaps)
+            yield dict(tn=index.names[t], tLen=len(ref), qs=c[0][0], qe=prev[1], ts=c[0][2], te=prev[3], length=length, nident=nident, \
+                       mismatch=length - nident - sum(gaps), gapopen=len(gaps), score=score, bits=score*0.3, \
+                       evalue=5e6 * len(qry) * 2.**(-score*0.3), cigar=''.join('{0}{1}'.format(*x) for x in cigar))
+
+def diamond(argv) :
+    # the "database" is a copy of the sequences, so that it stays usable once the FASTA file is gone
+    if argv[0] == 'makedb' :
+        shutil.copyfile(option(argv, '--in'), option(argv, '--db') + '.dmnd')
+        return
+    db = option(argv, '--db')
+    if not db.endswith('.dmnd') and os.path.isfile(db + '.dmnd') :
+        db += '.dmnd'
+    index = SeedIndex(readSeqs(db), 5, 50, aaEncoder, 20)
+    minIden, minCov = float(option(argv, '--id', 0))/100., float(option(argv, '--query-cover', 0))/100.
+    nHit = int(option(argv, '-k', 25))
+    fmt = argv[argv.index('--outfmt')+1:]
+    fmt = fmt[:next((i for i, a in enumerate(fmt) if a.startswith('-')), len(fmt))]
+    fields = fmt[1:] or ['qseqid', 'sseqid', 'pident', 'length', 'mismatch', 'gapopen', 'qstart', 'qend', 'sstart', 'send', 'evalue', 'bitscore']
+    out = option(argv, '--out')
+    fout = open(out, 'wt') if out else sys.stdout
+    if fmt[0] == '101' :
+        fout.write('@HD\tVN:1.5\tSO:query\n@PG\tPN:DIAMOND\n@mm\tBlastX\n@CO\tBlastX-like alignments\n')
+    for qn, qry in readSeqs(option(argv, '--query')).items() :
+        alns = [a for a in proteinAlignments(index, qry) if a['nident'] >= minIden*a['length'] and a['qe']-a['qs'] >= minCov*len(qry)]
+        for a in sorted(alns, key=lambda a : -a['score'])[:nHit] :
+            a['qn'], a['qLen'] = qn, len(qry)
+            if fmt[0] == '101' :
+                fout.write('{qn}\t0\t{tn}\t{0}\t255\t{cigar}\t*\t0\t0\t{1}\t*\tAS:i:{2}\tNM:i:{3}\tZL:i:{tLen}\tZR:i:{score}\tZE:f:{4:.2e}\tZI:i:{5}\tZF:i:1\tZS:i:{6}\tMD:Z:{length}\n'.format( \
+                    a['ts']+1, qry[a['qs']:a['qe']], int(a['bits']), a['length']-a['nident'], a['evalue'], 100*a['nident']//a['length'], a['qs']+1, **a))
+            else :
+                fout.write('\t'.join(str(diamondFields[f](a)) for f in fields) + '\n')
+    if out :
+        fout.close()
+
+
+def usearch(argv) :
+    out = option(argv, '-userout')
+    if out :
+        open(out, 'wt').close()
+
+
+programs = dict(bbduk=lambda a: bbtools('bbduk', a), repair=lambda a: bbtools('repair', a), bbmerge=lambda a: bbtools('bbmerge', a), \
+                spades=spades, makeblastdb=makeblastdb, blastn=blastn, minimap2=minimap2, usearch=usearch, diamond=diamond)
+
+if __name__ == '__main__' :
+    if len(sys.argv) < 2 or sys.argv[1] not in programs :
+        sys.stderr.write('Usage: {0} <{1}> [arguments]\n'.format(sys.argv[0], '|'.join(sorted(programs))))
+        sys.exit(2)
+    programs[sys.argv[1]](sys.argv[2:])
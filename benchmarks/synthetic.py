@@ -0,0 +1,351 @@
+#! /usr/bin/env python3
+# synthetic inputs for the benchmark suite: genomes, related strains, short reads, MLST-like allele sets, GFFs,
+# whole-genome alignments and uberBlast-like hit tables. Everything is derived from a single seed, so that the
+# same <scale> and <seed> always give identical files.
+import os, sys, gzip, json, argparse, tempfile
+import numpy as np
+
+bases = np.array(list('ACGT'))
+stopCodons = {'TAA', 'TAG', 'TGA'}
+senseCodons = np.array([a+b+c for a in 'ACGT' for b in 'ACGT' for c in 'ACGT' if a+b+c not in stopCodons])
+complement = str.maketrans('ACGTN', 'TGCAN')
+# default folder of the dataset, shared by the benchmark scripts and kept out of the source tree
+dataDir = os.path.join(tempfile.gettempdir(), 'EToKi_bench_data')
+
+def rc(seq) :
+    return seq.translate(complement)[::-1]
+
+def randomSeq(rng, length, gc=0.5) :
+    p = [(1-gc)/2, gc/2, gc/2, (1-gc)/2]
+    return ''.join(bases[rng.choice(4, size=length, p=p)])
+
+def randomGene(rng, length) :
+    nCodon = max(int(length/3) - 2, 1)
+    return 'ATG' + ''.join(senseCodons[rng.randint(senseCodons.size, size=nCodon)]) + 'TAA'
+
+def mutateSeq(rng, seq, snpRate, indelRate=0., codingSafe=False) :
+    '''substitute <snpRate> of the sites and insert/delete 1-10 bps at <indelRate> of the sites.
+    with <codingSafe>, only 3rd codon positions are changed and no indel or stop codon is introduced. '''
+    seq = np.array(list(seq))
+    if codingSafe :
+        sites = np.arange(5, seq.size-3, 3)
+        sites = sites[rng.rand(sites.size) < snpRate*3]
+        for site in sites :
+            codon = seq[site-2:site+1].copy()
+            codon[2] = bases[rng.randint(4)]
+            if ''.join(codon) not in stopCodons :
+                seq[site] = codon[2]
+        return ''.join(seq)
+    sites = np.where(rng.rand(seq.size) < snpRate)[0]
+    seq[sites] = bases[(np.searchsorted(bases, seq[sites]) + rng.randint(1, 4, size=sites.size)) % 4]
+    if indelRate <= 0 :
+        return ''.join(seq)
+    res, prev = [], 0
+    for site in np.sort(np.where(rng.rand(seq.size) < indelRate)[0]) :
+        if site < prev : continue
+        res.append(''.join(seq[prev:site]))
+        size = rng.randint(1, 11)
+        if rng.rand() < 0.5 :
+            res.append(randomSeq(rng, size))
+            prev = site
+        else :
+            prev = site + size
+    res.append(''.join(seq[prev:]))
+    return ''.join(res)
+
+
+def genome(rng, length, nContig=1, nGene=0, geneLen=(450, 1200), gc=0.5) :
+    '''a random genome of <nContig> contigs with <nGene> coding genes embedded.
+    returns {contig: sequence} and the gene list [name, contig, start, end, strand] (1-based, inclusive)'''
+    cuts = np.sort(rng.choice(np.arange(1, length), size=nContig-1, replace=False)) if nContig > 1 else np.array([], dtype=int)
+    sizes = np.diff(np.concatenate([[0], cuts, [length]]))
+    contigs, genes = {}, []
+    geneSizes = rng.randint(geneLen[0], geneLen[1], size=nGene)
+    geneContig = np.sort(rng.choice(nContig, size=nGene, p=sizes/float(length))) if nGene else np.array([], dtype=int)
+    for cId, size in enumerate(sizes) :
+        name = 'contig_{0}'.format(cId+1)
+        gs = geneSizes[geneContig == cId]
+        spacer = max(size - np.sum(gs), 0)
+        slots = np.sort(rng.randint(0, spacer+1, size=gs.size))
+        parts, prev = [], 0
+        for gLen, slot in zip(gs, slots) :
+            parts.append(randomSeq(rng, slot - prev, gc))
+            prev = slot
+            s = randomGene(rng, gLen)
+            strand = '+' if rng.rand() < 0.5 else '-'
+            start = sum(len(p) for p in parts) + 1
+            genes.append(['gene_{0}'.format(len(genes)+1), name, start, start+len(s)-1, strand])
+            parts.append(s if strand == '+' else rc(s))
+        parts.append(randomSeq(rng, spacer - prev, gc))
+        contigs[name] = ''.join(parts)
+    return contigs, genes
+
+def strains(rng, ref, nStrain, divergence=0.01, indelRate=0.) :
+    '''<nStrain> genomes related to <ref> by a random star-like genealogy'''
+    res = {}
+    for id in range(nStrain) :
+        d = divergence * rng.uniform(0.3, 1.0)
+        res['strain_{0}'.format(id+1)] = {n: mutateSeq(rng, s, d, indelRate) for n, s in ref.items()}
+    return res
+
+def alleles(rng, seqs, genes, nAllele=5, divergence=0.01, prefix='locus') :
+    '''MLST-like allele sets named <locus>_<id> from the genes in <seqs>; allele 1 is the genomic copy'''
+    res = {}
+    for lId, (name, contig, start, end, strand) in enumerate(genes) :
+        s = seqs[contig][start-1:end]
+        if strand == '-' :
+            s = rc(s)
+        locus = '{0}{1}'.format(prefix, lId+1)
+        res['{0}_1'.format(locus)] = s
+        for aId in range(1, nAllele) :
+            res['{0}_{1}'.format(locus, aId+1)] = mutateSeq(rng, s, divergence * rng.uniform(0.2, 1.0), codingSafe=True)
+    return res
+
+def reads(rng, seqs, depth=20, readLen=150, insert=(350, 50), errorRate=0.002) :
+    '''paired-end reads sampled uniformly from <seqs>; yields (name, r1, q1, r2, q2)'''
+    names = sorted(seqs)
+    lens = np.array([len(seqs[n]) for n in names])
+    nPair = int(np.sum(lens) * depth / (2*readLen))
+    cIds = rng.choice(len(names), size=nPair, p=lens/float(np.sum(lens)))
+    sizes = np.clip(rng.normal(insert[0], insert[1], size=nPair).astype(int), readLen, None)
+    for id, (cId, size) in enumerate(zip(cIds, sizes)) :
+        s = seqs[names[cId]]
+        size = min(size, len(s))
+        start = rng.randint(0, len(s) - size + 1)
+        frag = s[start:start+size]
+        if rng.rand() < 0.5 :
+            frag = rc(frag)
+        r1, r2 = frag[:readLen], rc(frag)[:readLen]
+        qs = []
+        for r in (r1, r2) :
+            q = np.clip(rng.normal(36, 3, size=len(r)) - np.linspace(0, 15, len(r)), 2, 41).astype(int)
+            err = np.where(rng.rand(len(r)) < errorRate)[0]
+            if err.size :
+                r = np.array(list(r))
+                r[err] = bases[rng.randint(4, size=err.size)]
+                q[err] = 2
+                r = ''.join(r)
+            qs.append([r, ''.join(chr(v+33) for v in q)])
+        yield 'read_{0}'.format(id+1), qs[0][0], qs[0][1], qs[1][0], qs[1][1]
+
+def hitTable(rng, qryLens, refLens, hitsPerQry=5, fragmented=0.2) :
+    '''an uberBlast-like hit table (16 columns, see uberBlast.RunBlast.run) with random but consistent coordinates.
+    <fragmented> of the hits are split into two neighbouring pieces, as linearMerge expects from broken genes. '''
+    refNames = sorted(refLens)
+    rows = []
+    for qry, qLen in sorted(qryLens.items()) :
+        for _ in range(hitsPerQry) :
+            ref = refNames[rng.randint(len(refNames))]
+            rLen = refLens[ref]
+            qs = rng.randint(1, max(int(qLen*0.1), 2))
+            qe = qLen - rng.randint(0, max(int(qLen*0.1), 1))
+            iden = rng.uniform(0.7, 1.0)
+            rs = rng.randint(1, max(rLen - (qe-qs) - 1, 2))
+            pieces = [[qs, qe, rs]]
+            if rng.rand() < fragmented and qe - qs > 100 :
+                m = rng.randint(qs+40, qe-40)
+                pieces = [[qs, m, rs], [m+1, qe, rs + m - qs + 1 + rng.randint(0, 30)]]
+            reverse = rng.rand() < 0.5
+            for s, e, r in pieces :
+                alnLen = e - s + 1
+                if r + alnLen - 1 > rLen : continue
+                ri = [r, r+alnLen-1] if not reverse else [rLen-r+1, rLen-r-alnLen+2]
+                rows.append([qry, ref, round(iden, 3), alnLen, int(alnLen*(1-iden)), 0, s, e, ri[0], ri[1], 1e-10, \
+                             float(int(alnLen*(5*iden-3))), qLen, rLen, [[alnLen, 'M']]])
+    tab = np.empty([len(rows), 16], dtype=object)
+    for id, row in enumerate(rows) :
+        tab[id, :15] = row
+        tab[id, 15] = id
+    return tab
+
+def contigEndHits(rng, qryLens, refLens, nHit, maxGap=150) :
+    '''<nHit> genes in the legacy layout (see hitTable) broken across the ends of two contigs: the first piece
+    ends within <maxGap> of the end of one contig and the second starts within <maxGap> of the start of another,
+    each on a random strand. Half of the second pieces are broken once more on their contig.'''
+    qryNames, refNames = sorted(qryLens), sorted(refLens)
+    rows = []
+    for _ in range(nHit) :
+        qry = qryNames[rng.randint(len(qryNames))]
+        qLen = qryLens[qry]
+        if qLen < 200 : continue
+        qs, qe = rng.randint(21, 40), qLen - rng.randint(21, 40)
+        m = rng.randint(qs+40, qe-40)
+        iden = rng.uniform(0.7, 1.0)
+        r1, r2 = refNames[rng.randint(len(refNames))], refNames[rng.randint(len(refNames))]
+        for s, e, ref, atEnd in ((qs, m, r1, True), (m+1, qe, r2, False)) :
+            alnLen, rLen = e - s + 1, refLens[ref]
+            r = rLen - alnLen + 1 - rng.randint(0, maxGap) if atEnd else 1 + rng.randint(0, maxGap)
+            if r < 1 or r + alnLen - 1 > rLen : continue
+            pieces = [[s, e, r]]
+            if not atEnd and rng.rand() < 0.5 and alnLen > 100 :
+                x = rng.randint(s+40, e-40)
+                pieces = [[s, x, r], [x+1, e, r + x - s + 1 + rng.randint(0, 30)]]
+            reverse = rng.rand() < 0.5
+            for s, e, r in pieces :
+                alnLen = e - s + 1
+                if r + alnLen - 1 > rLen : continue
+                ri = [r, r+alnLen-1] if not reverse else [rLen-r+1, rLen-r-alnLen+2]
+                rows.append([qry, ref, round(iden, 3), alnLen, int(alnLen*(1-iden)), 0, s, e, ri[0], ri[1], 1e-10, \
+                             float(int(alnLen*(5*iden-3))), qLen, rLen, [[alnLen, 'M']], len(rows)])
+    tab = np.empty([len(rows), 16], dtype=object)
+    for id, row in enumerate(rows) :
+        tab[id] = row
+    return tab
+
+def gappedHits(rng, qryLens, refLens, nHit, maxLen=600, gapRate=0.02) :
+    '''<nHit> hits in the legacy layout (see hitTable) with random gapped CIGARs. The query and reference spans
+    agree with the CIGARs, but the sequences are not actually aligned; enough to compare scoring kernels.'''
+    qryNames, refNames = sorted(qryLens), sorted(refLens)
+    rows = []
+    while len(rows) < nHit :
+        qry, ref = qryNames[rng.randint(len(qryNames))], refNames[rng.randint(len(refNames))]
+        qLen, rLen = qryLens[qry], refLens[ref]
+        target = min(maxLen, qLen, rLen) - 10
+        if target < 30 : continue
+        target = rng.randint(30, target+1)
+        cigar, qSpan, rSpan = [], 0, 0
+        while qSpan < target :
+            n = min(int(rng.geometric(gapRate)), target - qSpan)
+            cigar.append([n, 'M'])
+            qSpan, rSpan = qSpan + n, rSpan + n
+            if qSpan < target - 10 :
+                n, t = rng.randint(1, 9), 'ID'[rng.randint(2)]
+                cigar.append([n, t])
+                qSpan, rSpan = qSpan + (n if t == 'I' else 0), rSpan + (n if t == 'D' else 0)
+        if qSpan > qLen or rSpan > rLen : continue
+        qs, rs = rng.randint(1, qLen-qSpan+2), rng.randint(1, rLen-rSpan+2)
+        r = [rs, rs+rSpan-1] if rng.rand() < 0.5 else [rs+rSpan-1, rs]
+        nGap = sum(1 for n, t in cigar if t != 'M')
+        rows.append([qry, ref, 0.9, sum(n for n, t in cigar), 0, nGap, qs, qs+qSpan-1, r[0], r[1], 1e-10, 100, qLen, rLen, cigar, len(rows)])
+    tab = np.empty([len(rows), 16], dtype=object)
+    for id, row in enumerate(rows) :
+        tab[id] = row
+    return tab
+
+def repeatGenome(rng, nFamily, nCopy, famLen=(300, 600), divergence=0.01, nContig=4, spacer=(50, 500)) :
+    '''a genome made of <nCopy> copies of each of <nFamily> repeat families (IS-like elements, mutated by up to
+    <divergence>, on both strands) separated by random spacers. returns the families and the genome as {name: sequence}'''
+    families = { 'repeat_{0}'.format(id+1): randomGene(rng, l) for id, l in enumerate(rng.randint(famLen[0], famLen[1], size=nFamily)) }
+    copies = [ [n, c] for n in sorted(families) for c in range(nCopy) ]
+    contigId = rng.randint(nContig, size=len(copies))
+    contigs = {}
+    for id in rng.permutation(len(copies)) :
+        s = mutateSeq(rng, families[copies[id][0]], divergence * rng.uniform(0.2, 1.0))
+        contigs.setdefault('contig_{0}'.format(contigId[id]+1), []).extend([randomSeq(rng, rng.randint(*spacer)), s if rng.rand() < 0.5 else rc(s)])
+    return families, { n: ''.join(parts) for n, parts in contigs.items() }
+
+def repeatHits(rng, nHit, depth=20, nQry=1, qLen=1500) :
+    '''<nHit> hits in the legacy layout of <nQry> queries against one reference, as a repetitive element gives them:
+    hits of 100-1000 bps, each reference position covered by about <depth> hits of the same query, both strands,
+    and integer scores with many ties.'''
+    alnLen = rng.randint(100, 1001, size=nHit)
+    rLen = max(int(nHit / nQry * 550 / depth), 2000)
+    rs = rng.randint(1, rLen - 1000, size=nHit)
+    qs = np.array([rng.randint(1, qLen - l + 2) for l in alnLen])
+    rev = rng.rand(nHit) < 0.5
+    tab = np.empty([nHit, 16], dtype=object)
+    for id in range(nHit) :
+        r = [rs[id], rs[id]+alnLen[id]-1]
+        tab[id] = ['repeat_{0}'.format(id % nQry), 'chromosome', 0.9, int(alnLen[id]), 0, 0, int(qs[id]), int(qs[id]+alnLen[id]-1), \
+                   int(r[1] if rev[id] else r[0]), int(r[0] if rev[id] else r[1]), 1e-10, int(alnLen[id]//100*50 + rng.randint(3)), \
+                   qLen, rLen, [[int(alnLen[id]), 'M']], id]
+    return tab
+
+def gff(genes, source='synthetic') :
+    lines = ['##gff-version 3']
+    for name, contig, start, end, strand in genes :
+        lines.append('{0}\t{1}\tgene\t{2}\t{3}\t.\t{4}\t.\tID={5}'.format(contig, source, start, end, strand, name))
+        lines.append('{0}\t{1}\tCDS\t{2}\t{3}\t.\t{4}\t0\tID={5}.cds;Parent={5};locus_tag={5}'.format(contig, source, start, end, strand, name))
+    return '\n'.join(lines) + '\n'
+
+
+def writeFasta(fname, seqs, width=100) :
+    with (gzip.open(fname, 'wt', compresslevel=1) if fname.endswith('.gz') else open(fname, 'wt')) as fout :
+        for n, s in seqs.items() :
+            fout.write('>{0}\n{1}\n'.format(n, '\n'.join(s[i:i+width] for i in range(0, len(s), width))))
+    return fname
+
+def writeReads(prefix, readIter) :
+    fnames = [prefix + '_R1.fastq.gz', prefix + '_R2.fastq.gz']
+    with gzip.open(fnames[0], 'wt', compresslevel=1) as f1, gzip.open(fnames[1], 'wt', compresslevel=1) as f2 :
+        for n, r1, q1, r2, q2 in readIter :
+            f1.write('@{0}/1\n{1}\n+\n{2}\n'.format(n, r1, q1))
+            f2.write('@{0}/2\n{1}\n+\n{2}\n'.format(n, r2, q2))
+    return fnames
+
+
+# default sizes at scale 1; every size is multiplied by <scale>
+defaults = dict(genome_len=200000, n_contig=4, n_gene=60, n_allele=4, n_strain=6, depth=15, read_len=150, \
+                divergence=0.01, indel_rate=0.0002, hits_per_qry=8, n_repeat_family=1000, repeat_copies=16)
+
+def dataset(outdir, scale=1.0, seed=42, **sizes) :
+    '''write a complete synthetic dataset into <outdir> and return the {key: filename} map.
+    an existing dataset with identical parameters is reused. '''
+    params = dict(defaults, **sizes)
+    params.update(scale=scale, seed=seed)
+    manifest = os.path.join(outdir, 'dataset.json')
+    if os.path.isfile(manifest) :
+        with open(manifest) as fin :
+            data = json.load(fin)
+        if data['params'] == params and all(os.path.isfile(f) for f in data['files'].values()) :
+            return data['files']
+    if not os.path.isdir(outdir) :
+        os.makedirs(outdir)
+    rng = np.random.RandomState(seed)
+    gLen, nGene = int(params['genome_len']*scale), max(int(params['n_gene']*scale), 1)
+    ref, genes = genome(rng, gLen, params['n_contig'], nGene)
+    files = dict(reference=writeFasta(os.path.join(outdir, 'reference.fasta'), ref), \
+                 reference_gz=writeFasta(os.path.join(outdir, 'reference.fasta.gz'), ref))
+    with open(os.path.join(outdir, 'reference.gff'), 'wt') as fout :
+        fout.write(gff(genes))
+    files['gff'] = fout.name
+
+    qrys = strains(rng, ref, max(int(params['n_strain']*scale), 4), params['divergence'], params['indel_rate'])
+    for id, (n, s) in enumerate(sorted(qrys.items())) :
+        files['strain_{0}'.format(id+1)] = writeFasta(os.path.join(outdir, '{0}.fasta'.format(n)), s)
+    files['query'] = files['strain_1']
+
+    allele = alleles(rng, ref, genes, params['n_allele'], params['divergence'])
+    files['alleles'] = writeFasta(os.path.join(outdir, 'alleles.fasta'), allele)
+    files['references'] = writeFasta(os.path.join(outdir, 'references.fasta'), {n: s for n, s in allele.items() if n.endswith('_1')})
+
+    files['reads_1'], files['reads_2'] = writeReads(os.path.join(outdir, 'reads'), \
+        reads(rng, qrys['strain_1'], params['depth'], params['read_len']))
+
+    # strains without indels share the coordinates of the reference, so a plain stack is a valid alignment
+    aln = {'reference': ''.join(s for n, s in sorted(ref.items()))}
+    for id in range(max(int(params['n_strain']*scale), 4)) :
+        aln['strain_{0}'.format(id+1)] = ''.join(mutateSeq(rng, s, params['divergence']) for n, s in sorted(ref.items()))
+    files['alignment'] = writeFasta(os.path.join(outdir, 'alignment.fasta'), aln)
+
+    tab = hitTable(rng, {n: len(s) for n, s in allele.items()}, {n: len(s) for n, s in qrys['strain_1'].items()}, params['hits_per_qry'])
+    files['hits'] = os.path.join(outdir, 'hits.npy')
+    np.save(files['hits'], tab, allow_pickle=True)
+
+    # a repeat-rich genome, in which every query (repeat family) has <repeat_copies> hits
+    families, repeatRef = repeatGenome(rng, max(int(params['n_repeat_family']*scale), 1), params['repeat_copies'], divergence=params['divergence'])
+    files['repeat_families'] = writeFasta(os.path.join(outdir, 'repeat_families.fasta'), families)
+    files['repeat_genome'] = writeFasta(os.path.join(outdir, 'repeat_genome.fasta'), repeatRef)
+
+    with open(manifest, 'w') as fout :
+        json.dump(dict(params=params, files=files), fout, indent=1, sort_keys=True)
+    return files
+
+
+def synthetic(args) :
+    parser = argparse.ArgumentParser(description='Generate the synthetic dataset used by the benchmark suite.')
+    parser.add_argument('-o', '--outdir', help='[DEFAULT: {0}] output folder'.format(dataDir), default=dataDir)
+    parser.add_argument('-s', '--scale', help='[DEFAULT: 1.0] multiply all sizes', type=float, default=1.0)
+    parser.add_argument('--seed', help='[DEFAULT: 42] random seed', type=int, default=42)
+    for k, v in sorted(defaults.items()) :
+        parser.add_argument('--' + k, help='[DEFAULT: {0}] at scale 1'.format(v), type=type(v), default=v)
+    args = parser.parse_args(args).__dict__
+    outdir, scale, seed = args.pop('outdir'), args.pop('scale'), args.pop('seed')
+    files = dataset(outdir, scale, seed, **args)
+    for k, v in sorted(files.items()) :
+        sys.stdout.write('{0}\t{1}\n'.format(k, v))
+    return files
+
+
+if __name__ == '__main__' :
+    synthetic(sys.argv[1:])
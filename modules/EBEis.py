@@ -1,8 +1,8 @@
-import sys, subprocess, os, shlex, json
+import sys, os, shlex, json
 try:
-    from .configure import externals, logger, readFasta, xrange
+    from .configure import externals, logger, readFasta, xrange, run_external
 except :
-    from configure import externals, logger, readFasta, xrange
+    from configure import externals, logger, readFasta, xrange, run_external
 
 def parse_bsn(save) :
     region = []
@@ -25,7 +25,7 @@ def parse_bsn(save) :
     return value / float(save[0][-1])
 
 def run_prediction(prefix, assembly, db) :
-    subprocess.Popen('{0} -in {1} -dbtype nucl -out {2}'.format(externals['makeblastdb'], assembly, prefix).split(), stdout=subprocess.PIPE).communicate()
+    run_external('{0} -in {1} -dbtype nucl -out {2}'.format(externals['makeblastdb'], assembly, prefix).split(), stderr=None)
     antigen_genes = {'H':{}, 'O':{}}
     with open(db) as fin :
         for line in fin :
@@ -38,7 +38,7 @@ def run_prediction(prefix, assembly, db) :
                 else :
                     antigen_genes[category][antigen][gene] = -1.
     
-    subprocess.Popen(shlex.split('{0} -task blastn -db {2} -query {1} -outfmt "6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue score qlen" -reward 1 -penalty -3 -out {2}.bsn'.format(externals['blastn'], db, prefix))).communicate()
+    run_external(shlex.split('{0} -task blastn -db {2} -query {1} -outfmt "6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue score qlen" -reward 1 -penalty -3 -out {2}.bsn'.format(externals['blastn'], db, prefix)), stdout=None, stderr=None)
     
     save = []
     with open('{0}.bsn'.format(prefix)) as fin :
@@ -1,65 +1,24 @@
-import os, sys, shutil, pandas as pd
+import os, sys, shutil
 try :
-    from configure import externals, logger, uopen, xrange, StringIO, get_md5, readFasta
-    from uberBlast import uberBlast
+    from configure import externals, logger, uopen, xrange, StringIO, get_md5, readFasta, lazyImport
+    from uberBlast import blastSeqs, blastParams
     from clust import clust
 except :
-    from .configure import externals, logger, uopen, xrange, StringIO, get_md5, readFasta
-    from .uberBlast import uberBlast
+    from .configure import externals, logger, uopen, xrange, StringIO, get_md5, readFasta, lazyImport
+    from .uberBlast import blastSeqs, blastParams
     from .clust import clust
-import subprocess, tempfile, time
+pd = lazyImport('pandas')
+import tempfile, time
 
 mmseqs = externals['mmseqs']
-minimap2 = externals['minimap2']
-
-def minimapFilter(sourceFna, targetFna, targetFiltFna, max_iden, min_iden, coverage, paralog, relaxEnd, orderedLoci) :
-    p = subprocess.Popen('{0} -ct8 -k13 -w5 -A2 -B4 -O8,16 -E2,1 -r50 -p.2 -N500 -f2000,10000 -n1 -m19 -s40 -g200 -2K10m --heap-sort=yes --secondary=yes {1} {2}'.format(minimap2, sourceFna, targetFna).split(), stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines=True)
-    tooClose, goodCandidates, crossLoci = {}, {}, {}
-    for line in p.stdout :
-        part = line.strip().split('\t')
-        q, r = part[0], part[5]
-        qLoc, rLoc = q.rsplit('_', 1)[0], r.rsplit('_', 1)[0]
-        if q == r :
-            goodCandidates[r] = 1.
-            continue
-        elif rLoc == qLoc :
-            if part[4] == '-' :
-                continue
-            tl, ts, te = [int(p) for p in part[1:4]]
-            rl, rs, re, ri = [int(p) for p in part[6:10]]
-            if relaxEnd or (ts != rs or tl-te != rl - re) :
-                continue
-            iden, cov = float(ri)/(re-rs), float(re-rs)/rl
-            if cov > coverage :
-                if iden >= max_iden :
-                    tooClose[part[0]] = 1
-                elif iden >= min_iden :
-                    goodCandidates[part[0]] = max(goodCandidates.get(part[0], 0), iden)
-        elif orderedLoci[qLoc] > orderedLoci[rLoc] :
-            rl, rs, re, ri = [int(p) for p in part[6:10]]
-            iden, cov = float(ri)/(re-rs), float(re-rs)/rl
-            if cov > coverage and iden >= min_iden and crossLoci.get(part[0], 0) < iden :
-                crossLoci[part[0]] = iden
-    with open(targetFna) as fin, open(targetFiltFna+'.fas', 'w') as fout :
-        writable = False
-        for line in fin :
-            if line.startswith('>') :
-                name = line[1:].strip().split()[0]
-                writable = False if (name in tooClose or crossLoci.get(name, 0) > 1. - paralog) else True
-            if writable :
-                fout.write(line)
-    return targetFiltFna, goodCandidates, crossLoci
 
 def buildReference(alleles, references, max_iden=0.9,  min_iden=0.6, coverage=0.7, paralog=0.1, relaxEnd=False) :
     orderedLoci = { t['fieldname']:i for i, t in reversed(list(enumerate(references))) }
     with tempfile.TemporaryDirectory(prefix='NS_', dir='.') as dirPath :
         sourceFna = os.path.join(dirPath, 'sourceFna')
         clsFna = os.path.join(dirPath, 'clsFna')
-        targetFna = os.path.join(dirPath, 'targetFna')
         with open(sourceFna, 'w') as fout :
             fout.write('\n'.join(['>{fieldname}_{value_id}\n{value}'.format(**s) for s in alleles]))
-        with open(targetFna, 'w') as fout :
-            fout.write('\n'.join(['>{fieldname}_{value_id}\n{value}'.format(**t) for t in references]))
 
         if 1-paralog > max_iden :
             exampler, cluster = clust('-i {0} -p {1} -d {2} -c 1 -t 8'.format( \
@@ -88,8 +47,8 @@ def buildReference(alleles, references, max_iden=0.9,  min_iden=0.6, coverage=0.
                         crossSites[part[1]] = crossSites.get(part[1], [])+[locus[0]]
                 
         # compare with references
-        blastab = uberBlast('-r {0} -q {1} -f --blastn --diamondSELF --min_id {2} --min_ratio {3} -t 8 -p -s 1 -e 0,3'.format(\
-            targetFna, exampler, min_iden, coverage ).split())
+        blastab = blastSeqs({'{fieldname}_{value_id}'.format(**t):t['value'].upper() for t in references}, exampler, blastParams(filter=True, blastn=True, diamondSELF=True, \
+            min_id=min_iden, min_ratio=coverage, n_thread=8, process=True, re_score=1, fix_end=[0, 3], dedup=True))
         #blastab = blastab[blastab.T[0] != blastab.T[1]]
 
     for tab in blastab :
@@ -1,10 +1,10 @@
 import os, sys, numpy as np, tempfile, shutil, re, gzip
-from subprocess import Popen, PIPE
 from operator import itemgetter
+from multiprocessing.pool import ThreadPool
 try:
-    from configure import externals, rc, uopen, xrange, get_md5
+    from configure import externals, rc, uopen, xrange, get_md5, iterFasta, iterFastq, loadSeqStore, run_external
 except :
-    from .configure import externals, rc, uopen, xrange, get_md5
+    from .configure import externals, rc, uopen, xrange, get_md5, iterFasta, iterFastq, loadSeqStore, run_external
 
 usearch = externals['usearch']
 makeblastdb = externals['makeblastdb']
@@ -48,38 +48,15 @@ def transeq(seq, frames=[1,2,3,4,5,6]) :
 
 class dualBlast(object) :
     def readFasta(self, fasta) :
-        sequence = {}
-        with open(fasta) as fin :
-            for line in fin :
-                if line.startswith('>') :
-                    name = line[1:].strip().split()[0]
-                    sequence[name] = []
-                elif len(line) > 0 :
-                    sequence[name].extend(line.strip().split())
-        for s in sequence :
-            sequence[s] = (''.join(sequence[s])).upper()
-        return sequence
+        return dict(iterFasta(fasta))
     
     def readFastq(self, fastq) :
-        sequence, qual = {}, {}
-        with open(fastq) as fin :
-            line = fin.readline()
-            if line.startswith('>') :
-                sequence = self.readFasta(fastq)
-                return sequence, None
         with open(fastq) as fin :
-            for lineId, line in enumerate(fin) :
-                if lineId % 4 == 0 :
-                    name = line[1:].strip().split()[0]
-                    sequence[name] = []
-                    qual[name] = []
-                elif lineId % 4 == 1 :
-                    sequence[name].extend(line.strip().split())
-                elif lineId % 4 == 3 :
-                    qual[name].extend(line.strip().split())
-        for s in sequence :
-            sequence[s] = (''.join(sequence[s])).upper()
-            qual[s] = ''.join(qual[s])
+            if fin.read(1) == '>' :
+                return self.readFasta(fastq), None
+        sequence, qual = {}, {}
+        for n, s, q in iterFastq(fastq) :
+            sequence[n], qual[n] = s, q
         return sequence, qual
     
     def getCIGAR(self, ref, qry) :
@@ -149,9 +126,11 @@ class dualBlast(object) :
             for n,s in qrySeq.items() :
                 fout.write('>{0}\n{1}\n'.format(n, s))
         
-        Popen('{makeblastdb} -dbtype nucl -in {qry}'.format(makeblastdb=makeblastdb, qry=qryNA).split(), stderr=PIPE, stdout=PIPE).communicate()
+        run_external('{makeblastdb} -dbtype nucl -in {qry}'.format(makeblastdb=makeblastdb, qry=qryNA).split(), \
+                     cache=dict(inputs=[qryNA], outputs=[qryNA + '*'], scratch=[dirPath]))
 
         refs = [ [os.path.join(dirPath, 'ref.{0}'.format(id)), os.path.join(dirPath, 'ref.{0}.out'.format(id)), []] for id in range(n_thread)]
+        pool = ThreadPool(n_thread)
         
         refSeq2 = sorted(list(refSeq.items()), key=lambda s:-len(s[1]))
         for id, (r, o, p) in enumerate(refs) :
@@ -160,7 +139,7 @@ class dualBlast(object) :
                     fout.write('>{0}\n{1}\n'.format(n, s))
             blast_cmd = '{blastn} -db {qry} -query {ref} -out {out} -outfmt "6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue score qlen slen qseq sseq" -task blastn -evalue 1e-3 -dbsize 5000000 -reward 2 -penalty -2 -gapopen 6 -gapextend 2'.format(
                 blastn=blastn, qry=qryNA, ref=r, out=o)
-            p.append(Popen(blast_cmd, stdout=PIPE, shell=True))
+            p.append(pool.apply_async(run_external, (blast_cmd, ), dict(cache=dict(inputs=[qryNA, r], outputs=[o], scratch=[dirPath]))))
         
         refAASeq = transeq(refSeq, frames=[1,2,3])
         with open(refAA, 'w') as fout :
@@ -175,13 +154,13 @@ class dualBlast(object) :
                     fout.write('>{0}:{1}\n{2}\n'.format(n, id+1, s))
         with open(naMatch, 'w') as fout :
             for r, o, p in refs :
-                p[0].communicate()
+                p[0].get()
                 fout.write(open(o).read())
                 os.unlink(o)
+        pool.close()
         ublast_cmd = '{usearch} -threads {n_thread} -db {qryAA} -ublast {refAA} -evalue 1e-3 -accel 0.9 -maxhits 6 -userout {aaMatch} -ka_dbsize 5000000 -userfields query+target+id+alnlen+mism+opens+qlo+qhi+tlo+thi+evalue+raw+ql+tl+qrow+trow+qstrand'.format(
             usearch=usearch, qryAA=qryAA, refAA=refAA, aaMatch=aaMatch, n_thread=n_thread)
-        pp = Popen(ublast_cmd.split(), stderr=PIPE, stdout=PIPE)
-        pp.communicate()
+        run_external(ublast_cmd.split(), n_thread=n_thread, cache=dict(inputs=[qryAA, refAA], outputs=[aaMatch], scratch=[dirPath]))
         
         blastab = self.parseBlast(open(naMatch), min_iden, min_len)
         blastab.extend(self.parseUBlast(open(aaMatch), qrySeq, refSeq, min_iden, min_len))
@@ -617,7 +596,9 @@ def nomenclature(genome, refAllele, parameters) :
         regions = blasttab_parser.intergenic(regions, parameters.get('intergenic',[30,600]))
     
         # submission
-        qrySeq, qryQual = dualBlast().readFastq(qry)
+        qrySeq, qryQual = loadSeqStore(parameters.get('genome')), None
+        if qrySeq is None :
+            qrySeq, qryQual = dualBlast().readFastq(qry)
         alleles = blasttab_parser.form_alleles(regions, qrySeq, qryQual, parameters['unique_key'], not parameters['query_only'], parameters)
         for field, allele in alleles.items() :
             allele['id'] = allele['value_md5'] if allele['accepted'] < 8 else '-'+allele['value_md5']
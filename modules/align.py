@@ -4,9 +4,9 @@
 import os, sys, numpy as np, argparse, subprocess, re, gzip, _collections
 from multiprocessing import Pool
 try :
-    from .configure import readFastq, readFasta, xrange
+    from .configure import readFastq, readFasta, iterFastq, xrange, logger, loadSeqStore, SeqBatch, stage, run_external, reportTask, mergeReport
 except :
-    from configure import readFastq, readFasta, xrange
+    from configure import readFastq, readFasta, iterFastq, xrange, logger, loadSeqStore, SeqBatch, stage, run_external, reportTask, mergeReport
 
 def parseArgs(argv) :
     parser = argparse.ArgumentParser(description='''Align multiple genomes onto a single reference. ''')
@@ -36,18 +36,14 @@ class last_package(object) :
     @staticmethod
     def run_lastal( refdb, query, output, lastal ) :
         cmd = '{0} -j4 -r1 -q2 -a7 -b1 {1} {2}'.format( lastal, refdb, query )
-        lastal_run = subprocess.Popen( cmd.split(), stdout=subprocess.PIPE, universal_newlines=True )
-        with open(output, 'w') as fout:
-            fout.write(lastal_run.communicate()[0])
+        lastal_run = run_external(cmd.split(), n_thread=4, stdout=output, stderr=None)
         if lastal_run.returncode != 0 :
             fastq = readFastq(query)
             with open(output+'.qry', 'w') as fout :
                 for n, (s, q) in fastq.items() :
                     fout.write('@{0}\n{1}\n+\n{2}\n'.format(n, s, re.sub(r'[!"#$%&\']', '(', q)))
             cmd = '{0} -Q1 -j4 -r1 -q2 -a7 -b1 {1} {2}'.format( lastal, refdb, output + '.qry' )
-            lastal_run = subprocess.Popen( cmd.split(), stdout=subprocess.PIPE )
-            with open(output, 'w') as fout:
-                fout.write(lastal_run.communicate()[0])
+            run_external(cmd.split(), n_thread=4, stdout=output, stderr=None)
             os.unlink(output + '.qry')
         return output
     @staticmethod
@@ -489,36 +485,44 @@ def lastAgainst(qry_tag, qry_file, refdb, prefix, ref_file, lastal) :
     return [qry_tag, outfile]
 
 
+def readFastqSubset(fastq, names) :
+    seq, qual = {}, {}
+    for n, s, q in iterFastq(fastq) :
+        if n in names :
+            seq[n], qual[n] = s, q
+    return seq, qual
+
+
 def alignAgainst(data) :
     prefix, aligner, db, (rtag, reference), (tag, query) = data
     if isinstance(aligner, list) :
         return lastAgainst(tag, query, db, prefix, reference, aligner[1])
     try :
-        qrySeq, qryQual = readFastq(query)
+        for _ in iterFastq(query) :
+            break
     except :
         return [tag, query]
     if os.path.isfile( '{0}.gff.gz'.format(prefix) ) :
         return [tag, prefix + '.gff.gz']
-    refSeq, refQual = readFastq(reference)
     
     if not divergent :
-        proc = subprocess.Popen('{0} -k13 -w5 -c -t1 --frag=yes -A1 -B14 -O24,60 -E2,1 -r100 -g1000 -P -N5000 -f1000,5000 -n2 -m50 -s200 -z200 -2K10m --heap-sort=yes --secondary=yes {1} {2}'.format(
-                                    aligner, db, query).split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        cmd = '{0} -k13 -w5 -c -t1 --frag=yes -A1 -B14 -O24,60 -E2,1 -r100 -g1000 -P -N5000 -f1000,5000 -n2 -m50 -s200 -z200 -2K10m --heap-sort=yes --secondary=yes {1} {2}'.format(
+                                    aligner, db, query)
     else :
 #        print('diver')
-        proc = subprocess.Popen('{0} -k13 -w5 -c -t1 --frag=yes -A1 -B4 -O8,16 -E2,1 -r20k,40k --rmq -g10k -P -N5000 -f1000,5000 -n2 -m50 -s100 -z200 -2K10m --heap-sort=yes --secondary=yes {1} {2}'.format(
-                                    aligner, db, query).split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        cmd = '{0} -k13 -w5 -c -t1 --frag=yes -A1 -B4 -O8,16 -E2,1 -r20k,40k --rmq -g10k -P -N5000 -f1000,5000 -n2 -m50 -s100 -z200 -2K10m --heap-sort=yes --secondary=yes {1} {2}'.format(
+                                    aligner, db, query)
 
     alignments = []
-    for lineId, line in enumerate(proc.stdout) :
+    def addAlignment(line) :
         part = line.strip().split('\t')
         part[1:4] = [int(p) for p in part[1:4]]
         part[6:11] = [int(p) for p in part[6:11]]
         part[11] = float(part[13][5:])
-        part[12], part[13] = lineId, part[11]/part[10]
+        part[12], part[13] = len(alignments), part[11]/part[10]
         part[14:17] = [[], [], []]
         alignments.append(part)
-    proc.wait()
+    run_external(cmd.split(), onLine=addAlignment)
     
     deleteChain = {}
     nItem = len(alignments)
@@ -560,6 +564,8 @@ def alignAgainst(data) :
                     deleted[id] = 1
                     break
     alignments = [p for p in alignments if p[12] not in deleted]
+    qrySeq, qryQual = readFastqSubset(query, {p[0] for p in alignments})
+    refSeq, refQual = readFastqSubset(reference, {p[5] for p in alignments})
     
     # repeats in qry
     nItem = len(alignments)
@@ -812,7 +818,9 @@ def readGFF(fname) :
 
 def getMatrix(prefix, reference, alignments, lowq_aligns, core, matrixOut, alignmentOut, gff, gcode) :
     genes = readGFF(gff) if gff else {}
-    refSeq, refQual = readFastq(reference[1])
+    refSeq = loadSeqStore(reference[1])
+    if refSeq is None :
+        refSeq = readFastq(reference[1])[0]
     coreSites = { n:np.zeros(len(refSeq[n]), dtype=int) for n in refSeq }
     matSites = { n:np.zeros(len(refSeq[n]), dtype=int) for n in refSeq }
     alnId = { aln[0]:id for id, aln in enumerate(alignments+lowq_aligns) }
@@ -880,6 +888,7 @@ def getMatrix(prefix, reference, alignments, lowq_aligns, core, matrixOut, align
     coreBases = {'A':0, 'C':0, 'G':0, 'T':0}
     for n in sorted(coreSites) :
         sites = coreSites[n]
+        contig = refSeq[n][:]
         for site, num in enumerate(sites) :
             cSite = (n, site+1)
             if num < coreNum :
@@ -894,7 +903,7 @@ def getMatrix(prefix, reference, alignments, lowq_aligns, core, matrixOut, align
                 else :
                     missings[-1][2] = cSite[1]
             else :
-                b = refSeq[n][cSite[1]-1]
+                b = contig[cSite[1]-1]
                 if cSite in matrix and len(matrix[cSite][0]) :
                     matrix[cSite][0] = [ (b if s == '.' else s) for s in matrix[cSite][0]]
                     t = np.unique(matrix[cSite][0])
@@ -927,30 +936,38 @@ def getMatrix(prefix, reference, alignments, lowq_aligns, core, matrixOut, align
         outputs['alignment'] = prefix + '.fasta.gz'
         sequences = []
         low_seq = []
+        # one contiguous uint8 buffer per genome, laid out like the reference batch
+        refBatch = SeqBatch.fromItems(refSeq.items())
+        gap = ord('-')
         for sequence, aln, r in ((sequences, alignments, res), (low_seq, lowq_aligns, low_res)) :
             for (mTag, mFile), (presences, absences, mutations) in zip(aln, r) :
                 j = alnId[mTag]
-                seq = { n:['-']*len(s) for n, s in refSeq.items() } if j > 0 else { n:list(s) for n, s in refSeq.items() }
+                seq = np.full(refBatch.buffer.size, gap, dtype=np.uint8) if j > 0 else refBatch.buffer.copy()
                 if j :
                     for n, s, e in presences :
-                        seq[n][s-1:e] = refSeq[n][s-1:e]
+                        o = refBatch.offset(n)
+                        seq[o+s-1:o+e] = refBatch.buffer[o+s-1:o+e]
                     for n, s, e, c in absences :
-                        seq[n][s-1:e] = '-' * (e-s+1)
+                        o = refBatch.offset(n)
+                        seq[o+s-1:o+e] = gap
                     for n, s, e in missings :
-                        seq[n][s - 1:e] = '-' * (e - s + 1)
+                        o = refBatch.offset(n)
+                        seq[o+s-1:o+e] = gap
                 for site in matrix :
                     bases = matrix[site]
                     if len(bases[0]) :
-                        seq[site[0]][site[1]-1] = bases[0][j]
+                        seq[refBatch.offset(site[0])+site[1]-1] = ord(bases[0][j])
                 sequence.append(seq)
         with uopen(prefix + '.fasta.gz', 'w') as fout :
             for id, n in enumerate(sorted(refSeq)) :
                 if id :
                     fout.write('\n')
+                i = refBatch.index[n]
+                s, e = refBatch.offsets[i:i+2]
                 for (mTag, mFile), seq in zip(alignments, sequences) :
-                    fout.write('>{0}:{1}\n{2}\n'.format(mTag, n, ''.join(seq[n])))
+                    fout.write('>{0}:{1}\n{2}\n'.format(mTag, n, seq[s:e].tobytes().decode('ascii')))
                 for (mTag, mFile), seq in zip(lowq_aligns, low_seq) :
-                    fout.write('>{0}:{1}\n{2}\n'.format(mTag, n, ''.join(seq[n])))
+                    fout.write('>{0}:{1}\n{2}\n'.format(mTag, n, seq[s:e].tobytes().decode('ascii')))
     return outputs
 
 
@@ -1022,7 +1039,7 @@ def get_dNdS(refSeq, cont, s, e, d, site, mut, gcode) :
 
 def runAlignment(prefix, reference, queries, core, aligner) :
     #alignments = list(map(alignAgainst, [[prefix +'.' + query[0].rsplit('.', 1)[0] + '.' + str(id+1), aligner, prefix + '.mmi', reference, query] for id, query in enumerate(queries)]))
-    alignments = pool.map(alignAgainst, [[prefix +'.' + query[0].rsplit('.', 1)[0] + '.' + str(id+1), aligner, prefix + '.mmi', reference, query] for id, query in enumerate(queries)])
+    alignments = list(map(mergeReport, pool.map(reportTask(alignAgainst), [[prefix +'.' + query[0].rsplit('.', 1)[0] + '.' + str(id+1), aligner, prefix + '.mmi', reference, query] for id, query in enumerate(queries)])))
 
     try :
         os.unlink(reference + '.mmi')
@@ -1034,20 +1051,19 @@ def runAlignment(prefix, reference, queries, core, aligner) :
 def prepReference(prefix, ref_tag, reference, aligner, pilercr, trf, **args) :
     def mask_tandem(fasta_file) :
         cmd = '{0} {1} 2 4 7 80 10 60 2000 -d -h -ngs'.format(trf, fasta_file)
-        trf_run = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE, universal_newlines=True)
-    
-        region = []
-        for line in iter(trf_run.stdout.readline, r'') :
+        region, cont_name = [], [None]
+        def addRepeat(line) :
             if line[0] == '@' :
-                cont_name = line[1:].strip().split()[0]
+                cont_name[0] = line[1:].strip().split()[0]
             else :
                 part = line.split(' ',2)[:2]
-                region.append([cont_name, int(part[0])-2, int(part[1])+2])
+                region.append([cont_name[0], int(part[0])-2, int(part[1])+2])
+        run_external(cmd.split(), stderr=None, onLine=addRepeat)
         return region
     
     def mask_crispr(fasta_file, prefix) :
         cmd = '{0} -in {1} -out {2}.crispr'.format(pilercr, fasta_file, prefix)
-        subprocess.Popen(cmd.split(), stderr=subprocess.PIPE).communicate()
+        run_external(cmd.split(), stdout=None)
         summary_trigger = 0
     
         region = []
@@ -1066,9 +1082,11 @@ def prepReference(prefix, ref_tag, reference, aligner, pilercr, trf, **args) :
     # prepare reference
     if reference :
         if not isinstance(aligner, list) :
-            subprocess.Popen('{0} -k15 -w5 -d {2}.mmi {1}'.format(aligner, reference, prefix).split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+            run_external('{0} -k15 -w5 -d {2}.mmi {1}'.format(aligner, reference, prefix).split(), \
+                         cache=dict(inputs=[reference], outputs=['{0}.mmi'.format(prefix)]))
         else :
-            subprocess.Popen('{0} -cR01 {2}.mmi {1}'.format(aligner[0], reference, prefix).split()).communicate()
+            run_external('{0} -cR01 {2}.mmi {1}'.format(aligner[0], reference, prefix).split(), stdout=None, stderr=None, \
+                         cache=dict(inputs=[reference], outputs=['{0}.mmi*'.format(prefix)]))
         import tempfile
         with tempfile.NamedTemporaryFile(dir='.') as tf :
             seq, _ = readFastq(reference)
@@ -1100,16 +1118,18 @@ def align(argv) :
                 queries.append(line.strip().split()[0])
     queries = sorted([ [qt, qf] for qt, qf in [ qry.split(':', 1) if qry.find(':')>0 else [os.path.basename(qry), qry] for qry in queries ] if qt != args.reference[0] ])
 
-
     global pool
     pool = Pool(args.n_proc)
-    refMask = prepReference(args.prefix, args.reference[0], args.reference[1], args.aligner, **externals)
-    alignments = runAlignment(args.prefix, args.reference, queries, args.core, args.aligner)
-    lowq_aligns = runAlignment(args.prefix, args.reference, args.lowq, args.core, args.aligner)
+    with stage('prepReference') :
+        refMask = prepReference(args.prefix, args.reference[0], args.reference[1], args.aligner, **externals)
+    with stage('runAlignment') :
+        alignments = runAlignment(args.prefix, args.reference, queries, args.core, args.aligner)
+        lowq_aligns = runAlignment(args.prefix, args.reference, args.lowq, args.core, args.aligner)
     alignments = [refMask] + alignments
     outputs = {'mappings': dict(alignments), 'low_qual_map': dict(lowq_aligns)}
     if args.matrix or args.alignment :
-        outputs.update(getMatrix(args.prefix, args.reference, alignments, lowq_aligns, args.core, args.matrix, args.alignment, args.gff, args.gcode))
+        with stage('getMatrix') :
+            outputs.update(getMatrix(args.prefix, args.reference, alignments, lowq_aligns, args.core, args.matrix, args.alignment, args.gff, args.gcode))
     import json
     sys.stdout.write(json.dumps(outputs, indent=2, sort_keys=True))
     return outputs
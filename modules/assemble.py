@@ -1,11 +1,11 @@
-import os, sys, re, shutil, numpy as np, pandas as pd
+import os, sys, re, shutil, numpy as np
 from collections import OrderedDict
 from time import sleep
-from subprocess import Popen, PIPE
 try:
-    from .configure import externals, logger, readFasta, xrange, uopen, ETOKI
+    from .configure import externals, logger, readFasta, xrange, uopen, ETOKI, run_external, lazyImport, StringIO
 except :
-    from configure import externals, logger, readFasta, xrange, uopen, ETOKI
+    from configure import externals, logger, readFasta, xrange, uopen, ETOKI, run_external, lazyImport, StringIO
+pd = lazyImport('pandas')
 
 # mainprocess
 class mainprocess(object) :
@@ -65,7 +65,7 @@ class mainprocess(object) :
         for lib_id, lib in enumerate(reads) :
             rl = [0, 0]
             for rname in lib :
-                p = Popen("{pigz} -cd {0}|head -30000000|awk 'NR%4 == 2'|wc".format(rname, **parameters), shell=True, stdout=PIPE, stderr=PIPE, universal_newlines=True).communicate()[0].split()
+                p = run_external("{pigz} -cd {0}|head -30000000|awk 'NR%4 == 2'|wc".format(rname, **parameters)).stdout.split()
                 rl[0] += int(p[0])
                 rl[1] += int(p[2]) - int(p[0])
             read_len = max(rl[1]/float(rl[0]), read_len) if float(rl[0]) > 0 else read_len
@@ -74,7 +74,8 @@ class mainprocess(object) :
     
     def __run_minimap(self, prefix, reference, reads, clean=True) :
         if not os.path.isfile(reference+'.mmi') or (os.path.getmtime(reference+'.mmi') < os.path.getmtime(reference)) :
-            Popen('{minimap2} -k13 -w5 -d {0}.mmi {0}'.format(reference, **parameters).split(), stdout=PIPE, stderr=PIPE, universal_newlines=True).communicate()
+            run_external('{minimap2} -k13 -w5 -d {0}.mmi {0}'.format(reference, **parameters).split(), \
+                         cache=dict(inputs=[reference], outputs=[reference + '.mmi']))
         else :
             sleep(1)
     
@@ -89,21 +90,22 @@ class mainprocess(object) :
                     if clean :
                         cmd = '{minimap2} -t{n_cpu} -ax sr --sr --frag=yes -A2 -B4 -O8,16 -E2,1 -r50 -p.6 -N 1 -f2000,10000 -Y -n1 -m19 -s40 -g200 -2K10m --heap-sort=yes --secondary=yes {reference}.mmi {r} |{enbler_filter} {max_diff} {excluded} | {samtools} fixmate -m -@{n_cpu} - - | {samtools} sort -m 1G -@ {n_cpu} -O bam -l 0 -T {prefix} - | {samtools} markdup -r -@ {n_cpu} -O BAM - {o}'.format(
                                 r = r, o = o, reference = reference, **parameters)
-                        st_run = Popen( cmd, shell=True, stdout=PIPE, stderr=PIPE, universal_newlines=True ).communicate()
-                        for line in st_run[1].split('\n') :
+                        st_run = run_external(cmd, n_thread=parameters['n_cpu'])
+                        for line in st_run.stderr.split('\n') :
                             logger(line.rstrip())
                         outputs.append(o) #self.__markDuplicates(o1, o))
-                        Popen('{samtools} index {o}'.format(o=o, **parameters).split(), stdout=PIPE).communicate()
+                        run_external('{samtools} index {o}'.format(o=o, **parameters).split(), stderr=None)
                     else :
                         cmd = '''{minimap2} -t{n_cpu} -ax sr --sr --frag=yes -A2 -B4 -O8,16 -E2,1 -r50 -p.6 -N 1 -f2000,10000 -Y -n1 -m19 -s40 -g200 -2K10m --heap-sort=yes --secondary=yes {reference}.mmi {r} | {enbler_filter} -1 | {samtools} view -bo {o} -'''.format(
                                 r = r, o = o, reference = reference, **parameters)
-                        st_run = Popen( cmd, shell=True, stdout=PIPE, stderr=PIPE, universal_newlines=True ).communicate()
+                        st_run = run_external(cmd, n_thread=parameters['n_cpu'])
                         outputs.append(o)
         return outputs
 
     def __run_bowtie(self, prefix, reference, reads, clean=True) :
         if not os.path.isfile(reference + '.4.bt2') or (os.path.getmtime(reference + '.4.bt2') < os.path.getmtime(reference)) :
-            Popen('{bowtie2build} {reference} {reference}'.format(reference=reference, bowtie2build=parameters['bowtie2build']).split(), stdout=PIPE, stderr=PIPE, universal_newlines=True ).communicate()
+            run_external('{bowtie2build} {reference} {reference}'.format(reference=reference, bowtie2build=parameters['bowtie2build']).split(), \
+                         cache=dict(inputs=[reference], outputs=[reference + '.*']))
         else :
             sleep(1)
 
@@ -117,22 +119,23 @@ class mainprocess(object) :
                     if clean :
                         cmd= '{bowtie2} -p {n_cpu} --no-unal --mp 4,4 --np 4 --sensitive-local -q -I 25 -X 800 -x {reference} {r} | {enbler_filter} {max_diff} {excluded} | {samtools} fixmate -m -@{n_cpu} - - | {samtools} sort -m 4G -@{n_cpu} -O bam -l 0 -T {prefix} - | {samtools} markdup -r -@{n_cpu} -O BAM - {o}'.format(
                             r=r, o=o, reference=reference, **parameters)
-                        st_run = Popen( cmd, shell=True, stdout=PIPE, stderr=PIPE, universal_newlines=True ).communicate()
-                        for line in st_run[1].split('\n') :
+                        st_run = run_external(cmd, n_thread=parameters['n_cpu'])
+                        for line in st_run.stderr.split('\n') :
                             logger(line.rstrip())
                         outputs.append(o)#self.__markDuplicates(o1, o))
-                        Popen('{samtools} index {o}'.format(o=o, **parameters).split(), stdout=PIPE).communicate()
+                        run_external('{samtools} index {o}'.format(o=o, **parameters).split(), stderr=None)
                     else :
                         cmd = '''{bowtie2} -p {n_cpu} --no-unal --mp 4,4 --np 4 --sensitive-local -q -I 25 -X 800 -x {reference} {r} | awk '$2 %8 < 4'| {samtools} view -bo {o} -'''.format(
                                 r = r, o = o, reference = reference, **parameters)
-                        st_run = Popen( cmd, shell=True, stdout=PIPE, stderr=PIPE, universal_newlines=True ).communicate()
+                        st_run = run_external(cmd, n_thread=parameters['n_cpu'])
                         outputs.append(o)
 
         return outputs
 
     def __run_bwa(self, prefix, reference, reads, clean=True) :
         if not os.path.isfile(reference + '.bwt') or (os.path.getmtime(reference + '.bwt') < os.path.getmtime(reference)) :
-            Popen('{bwa} index {reference}'.format(reference=reference, bwa=parameters['bwa']).split(), stdout=PIPE, stderr=PIPE, universal_newlines=True ).communicate()
+            run_external('{bwa} index {reference}'.format(reference=reference, bwa=parameters['bwa']).split(), \
+                         cache=dict(inputs=[reference], outputs=[reference + '.*']))
         else :
             sleep(1)
 
@@ -146,15 +149,15 @@ class mainprocess(object) :
                     if clean :
                         cmd= '{bwa} mem -A 2 -B 4 -T 40 -t {n_cpu} -m 40 {reference} {r} | {enbler_filter} {max_diff} {excluded} | | {samtools} fixmate -m -@{n_cpu} - - | {samtools} sort -m 4G -@{n_cpu} -O bam -l 0 -T {prefix} - | {samtools} markdup -r -@{n_cpu} -O BAM - {o}'.format(
                             r=r, o=o, reference=reference, **parameters)
-                        st_run = Popen( cmd, shell=True, stdout=PIPE, stderr=PIPE, universal_newlines=True ).communicate()
-                        for line in st_run[1].split('\n') :
+                        st_run = run_external(cmd, n_thread=parameters['n_cpu'])
+                        for line in st_run.stderr.split('\n') :
                             logger(line.rstrip())
                         outputs.append(o) #self.__markDuplicates(o1, o))
-                        Popen('{samtools} index {o}'.format(o=o, **parameters).split(), stdout=PIPE).communicate()
+                        run_external('{samtools} index {o}'.format(o=o, **parameters).split(), stderr=None)
                     else :
                         cmd = '''{bwa} mem -A 2 -B 4 -T 40 -t {n_cpu} -m 40 {reference} {r} | awk '$2 %8 < 4'| {samtools} view -bo {o} -'''.format(
                                 r = r, o = o, reference = reference, **parameters)
-                        st_run = Popen( cmd, shell=True, stdout=PIPE, stderr=PIPE, universal_newlines=True ).communicate()
+                        st_run = run_external(cmd, n_thread=parameters['n_cpu'])
                         outputs.append(o)
 
         return outputs
@@ -182,8 +185,7 @@ class mainprocess(object) :
             read_input = '-r {2}'.format(','.join(read_input[0]), ','.join(read_input[1]), ','.join(read_input[2]))
         cmd = '{megahit} {read_input} --k-min 21 --k-max 201 --k-step 18 -t {n_cpu} -m 0.9 -o {outdir}'.format(
               read_input=read_input, outdir=outdir, **parameters)
-        run = Popen( cmd.split(), stdout=PIPE, bufsize=0, universal_newlines=True )
-        run.communicate()
+        run = run_external(cmd.split(), n_thread=parameters['n_cpu'], stderr=None)
         if run.returncode != 0 :
             sys.exit(7351685)
         shutil.copyfile( '{outdir}/final.contigs.fa'.format(outdir=outdir), output_file )
@@ -201,10 +203,10 @@ class mainprocess(object) :
                     if part[3] in ('+', 'Y') :
                         circular[part[0]] = 1
         cmd = '{makeblastdb} -dbtype nucl -in {0}'.format(input_name, **parameters)
-        Popen(cmd, shell=True).communicate()
+        run_external(cmd, stdout=None, stderr=None)
         cmd = '{blastn} -num_threads {n_cpu} -db {0} -query {0} -outfmt "6 qacc sacc pident length mismatch gapopen qstart qend sstart send evalue score qlen slen"'.format(input_name, **parameters)
-        p = Popen(cmd, shell=True, universal_newlines=True, stdout=PIPE)
-        matches = pd.read_csv(p.stdout, sep='\t', header=None).values
+        p = run_external(cmd, n_thread=parameters['n_cpu'], stderr=None)
+        matches = pd.read_csv(StringIO(p.stdout), sep='\t', header=None).values
         matches = matches[(matches.T[2] >= 98.5) & (matches.T[3] >= 1000)]
         matches = matches[(matches.T[0] != matches.T[1]) | (matches.T[6] != matches.T[8]) | (matches.T[7] != matches.T[9])]
         matches.T[12] = np.min([matches.T[12] - matches.T[7], matches.T[6] - 1], 0)
@@ -286,8 +288,7 @@ class mainprocess(object) :
                         read_input=read_inputs[1], outdir=outdir, isMetagenome=isMetagenome, **parameters) ]
                 finished = True
                 for cmd in cmds :
-                    flye_run = Popen( cmd.split(), stdout=PIPE, bufsize=0, universal_newlines=True )
-                    flye_run.communicate()
+                    flye_run = run_external(cmd.split(), n_thread=parameters['n_cpu'], stderr=None)
                     if flye_run.returncode != 0:
                         finished = False
                         break
@@ -300,8 +301,7 @@ class mainprocess(object) :
                 cmd = '{flye} -t {n_cpu} -g 5m --plasmids {read_input} {isMetagenome} -o {outdir}'.format(
                       read_input=read_input, outdir=outdir, isMetagenome=isMetagenome, **parameters)
     
-                flye_run = Popen( cmd.split(), stdout=PIPE, bufsize=0, universal_newlines=True )
-                flye_run.communicate()
+                flye_run = run_external(cmd.split(), n_thread=parameters['n_cpu'], stderr=None)
                 if flye_run.returncode == 0 :
                     finished = True
             if finished :
@@ -332,8 +332,7 @@ class mainprocess(object) :
             cmd = '{flye} -t {n_cpu} -g 5m --plasmids --subassemblies {asm} -o {outdir}'.format(
                   asm=' '.join([contigs, asm1, asm2]), outdir=outdir2, **parameters)
 
-            flye_run = Popen( cmd.split(), stdout=PIPE, bufsize=0, universal_newlines=True)
-            flye_run.communicate()
+            flye_run = run_external(cmd.split(), n_thread=parameters['n_cpu'], stderr=None)
             if flye_run.returncode != 0 :
                 sys.exit(20123)
             asm2 = self._flye_dedup('{outdir2}/assembly.fasta'.format(outdir2=outdir2), '{outdir2}/assembly.dedup.fasta'.format(outdir2=outdir2), '{outdir2}/assembly_info.txt'.format(outdir2=outdir2))
@@ -370,8 +369,7 @@ class mainprocess(object) :
             
             cmd = '{flye} -t {n_cpu} -g 5m --plasmids --subassemblies {asm} --polish-target {asm1} -o {outdir3}'.format(
                   asm=' '.join([contigs, asm1, asm2, asm3]), asm1=asm1, outdir3=outdir3, **parameters)
-            flye_run = Popen( cmd.split(), stdout=PIPE, bufsize=0, universal_newlines=True)
-            flye_run.communicate()
+            flye_run = run_external(cmd.split(), n_thread=parameters['n_cpu'], stderr=None)
             if flye_run.returncode != 0 :
                 sys.exit(20123)
             flye_file = '{outdir3}/polished_1.fasta'.format(outdir3=outdir3)
@@ -400,8 +398,7 @@ class mainprocess(object) :
         if nohammer :
             cmd += ' --only-assembler'
         print(cmd)
-        spades_run = Popen( cmd.split(' '), stdout=PIPE, bufsize=0, universal_newlines=True)
-        spades_run.communicate()
+        spades_run = run_external(cmd.split(' '), n_thread=parameters['n_cpu'], stderr=None)
         if spades_run.returncode != 0 :
             sys.exit(20123)
         try :
@@ -451,7 +448,7 @@ class mainprocess(object) :
         inRef, outRef = 'etoki.inRef', 'etoki.outRef'
         
         if len(outgroups) :
-            Popen('cat {0} > {1}'.format(' '.join(outgroups), outRef), shell=True).communicate()
+            run_external('cat {0} > {1}'.format(' '.join(outgroups), outRef), stdout=None, stderr=None)
             if parameters['mapper'] == 'minimap2' :
                 bams = self.__run_minimap('etoki', outRef, reads, clean=False )
                 os.unlink(outRef+'.mmi')
@@ -460,18 +457,18 @@ class mainprocess(object) :
             else :
                 bams = self.__run_bwa('etoki', outRef, reads, clean=False )
             os.unlink(outRef) 
+            def outgroupHit(line) :
+                try :
+                    rname, score = line.split('\t', 1)[0] , int(re.findall('AS:i:(\d+)', line)[0])
+                    if rname not in excludedReads or score > excludedReads[rname] :
+                        excludedReads[rname] = score
+                except :
+                    pass
             for bam in bams :
-                p = Popen('{samtools} view {0}'.format(bam, **parameters).split(), stdout=PIPE, universal_newlines=True)
-                for line in p.stdout :
-                    try :
-                        rname, score = line.split('\t', 1)[0] , int(re.findall('AS:i:(\d+)', line)[0])
-                        if rname not in excludedReads or score > excludedReads[rname] :
-                            excludedReads[rname] = score
-                    except :
-                        continue
+                run_external('{samtools} view {0}'.format(bam, **parameters).split(), stderr=None, onLine=outgroupHit)
         
             if len(ingroups) :
-                Popen('cat {0} > {1}'.format(' '.join(ingroups), inRef), shell=True).communicate()
+                run_external('cat {0} > {1}'.format(' '.join(ingroups), inRef), stdout=None, stderr=None)
                 if parameters['mapper'] == 'minimap2' :
                     bams = self.__run_minimap('etoki', inRef, reads, clean=False)
                     os.unlink(inRef+'.mmi')
@@ -480,17 +477,17 @@ class mainprocess(object) :
                 else :
                     bams = self.__run_bwa('etoki', inRef, reads, clean=False )
                 os.unlink(inRef)
+                def ingroupHit(line) :
+                    rname = line.split('\t', 1)[0]
+                    if rname in excludedReads:
+                        try :
+                            score = int(re.findall('AS:i:(\d+)', line)[0])
+                            if score >= excludedReads[rname] :
+                                excludedReads.pop(rname, None)
+                        except :
+                            pass
                 for bam in bams :
-                    p = Popen('{samtools} view {0}'.format(bam, **parameters).split(), stdout=PIPE, universal_newlines=True)
-                    for line in p.stdout :
-                        rname = line.split('\t', 1)[0]
-                        if rname in excludedReads:
-                            try :
-                                score = int(re.findall('AS:i:(\d+)', line)[0])
-                                if score >= excludedReads[rname] :
-                                    excludedReads.pop(rname, None)
-                            except :
-                                continue
+                    run_external('{samtools} view {0}'.format(bam, **parameters).split(), stderr=None, onLine=ingroupHit)
         
         if os.path.isfile(excluded) :
             excludedReads.update({ r:9999999999 for r in pd.read_csv(excluded, sep='\t').values.T[0]})
@@ -521,24 +518,22 @@ class mainprocess(object) :
                 bams = self.__run_bwa('etoki', reference, reads)
 
             merged_bam = 'etoki.mapping.merged.bam'
-            Popen('{samtools} merge -f {merged_bam} {bams}'.format(
+            run_external('{samtools} merge -f {merged_bam} {bams}'.format(
                 merged_bam=merged_bam, bams=' '.join(bams), **parameters
-            ).split(), stdout=PIPE, universal_newlines=True).communicate()
-            Popen('{samtools} index {bam}'.format(bam=merged_bam, **parameters).split()).communicate()
+            ).split(), stderr=None)
+            run_external('{samtools} index {bam}'.format(bam=merged_bam, **parameters).split(), stdout=None, stderr=None)
 
-            Popen('{samtools} faidx {0}'.format(reference, **parameters).split()).communicate()
+            run_external('{samtools} faidx {0}'.format(reference, **parameters).split(), stdout=None, stderr=None)
 
             my_env = os.environ.copy()
             my_env["PATH"] = ETOKI+'/externals' + ':' + my_env["PATH"]
-            out, err = Popen('{hapog} -g {0} -u -t {n_cpu} -b {bam} -o etoki.hapog'.format(reference,
-                bam=merged_bam, **parameters).split(),
-                  universal_newlines=True, stdout=PIPE, stderr=PIPE, env=my_env).communicate()
+            err = run_external('{hapog} -g {0} -u -t {n_cpu} -b {bam} -o etoki.hapog'.format(reference,
+                bam=merged_bam, **parameters).split(), n_thread=parameters['n_cpu'], env=my_env).stderr
             if len(err):
                 logger(err)
             changes = 0
             try :
-                n = Popen('grep read etoki.hapog/hapog_results/hapog.changes'.split(), stdout=PIPE,
-                          universal_newlines=True).communicate()
+                n = [run_external('grep read etoki.hapog/hapog_results/hapog.changes'.split(), stderr=None).stdout]
                 # Hapog is designed to produce a new assembly with both major and minor alleles
                 # we just want an updated assembly which is consistent with the major allele, so update
                 # assembly using the changes file which records where there were specific nucleotides
@@ -611,12 +606,12 @@ class mainprocess(object) :
             bams = self.__run_bwa('etoki', reference, reads, )
 
         merged_bam = 'etoki.mapping.merged.bam'
-        Popen('{samtools} merge -f {merged_bam} {bams}'.format(
+        run_external('{samtools} merge -f {merged_bam} {bams}'.format(
             merged_bam=merged_bam, bams=' '.join(bams), **parameters
-        ).split(), stdout=PIPE, universal_newlines=True).communicate()
-        Popen('{samtools} index {bam}'.format(bam=merged_bam, **parameters).split()).communicate()
+        ).split(), stderr=None)
+        run_external('{samtools} index {bam}'.format(bam=merged_bam, **parameters).split(), stdout=None, stderr=None)
 
-        Popen('{samtools} faidx {0}'.format(reference, **parameters).split()).communicate()
+        run_external('{samtools} faidx {0}'.format(reference, **parameters).split(), stdout=None, stderr=None)
 
         sequence = readFasta(reference)
         for n, s in sequence.items() :
@@ -624,11 +619,11 @@ class mainprocess(object) :
             sequence[n] = [s, q]
 
         sites = { n:np.array([0 for _ in s[1] ]) for n, s in sequence.items() }
-        depth = Popen('{samtools} depth -aa -q 0 -Q 0 {bam}'.format(bam=merged_bam, **parameters).split(), stdout=PIPE, universal_newlines=True)
-        for line in depth.stdout :
+        def siteDepth(line) :
             part = line.strip().split()
             if len(part) > 2 and float(part[2]) > 0 :
                 sites[part[0]][int(part[1]) - 1] = float(part[2])
+        run_external('{samtools} depth -aa -q 0 -Q 0 {bam}'.format(bam=merged_bam, **parameters).split(), stderr=None, onLine=siteDepth)
 
         sites, ave_depth = self.get_ave_depth(sites, parameters['accurate_depth'], parameters['metagenome'])
         cont_depth = [float(d)*ave_depth for d in parameters['cont_depth'].split(',')]
@@ -638,8 +633,7 @@ class mainprocess(object) :
             s[2] = s[1]/ave_depth
 
         cmd = '{samtools} mpileup -ABf {0} {1}'.format(reference, merged_bam, **parameters)
-        q = Popen( cmd.split(), stdout=PIPE, universal_newlines=True )
-        for line in q.stdout:
+        def siteQual(line) :
             p = line.strip().split()
             depth = int(p[3])
             n_ref = p[4].count('.') + p[4].count(',')
@@ -648,6 +642,7 @@ class mainprocess(object) :
                 n_ref -= depth - cont_depth[1]
             q = self.__calc_qual(n_ref, n_alt)
             sequence[p[0]][1][int(p[1])-1] = chr( min(q, 40) + 33 )
+        run_external(cmd.split(), stderr=None, onLine=siteQual)
 
 
         with open('etoki.result.fastq', 'w') as fout :
@@ -712,7 +707,7 @@ class postprocess(object) :
             assembly=assembly, **parameters
         )
             
-        Popen(cmd, stderr=PIPE, stdout=PIPE, shell=True, universal_newlines=True).communicate()
+        run_external(cmd, n_thread=parameters['n_cpu'])
         species = {}
         with open('{0}.kraken'.format(assembly)) as fin :
             for line in fin :
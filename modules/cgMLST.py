@@ -1,15 +1,12 @@
 import sys, csv, numpy as np, os
 import tempfile
 from multiprocessing import Pool
-import pandas as pd
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import RBF, WhiteKernel
-from numba import njit, jit
 
 try:
-    from configure import transeq, uopen, asc2int
+    from configure import transeq, transeqBatch, SeqBatch, uopen, asc2int, iterFasta, lazyImport
 except :
-    from .configure import transeq, uopen, asc2int
+    from .configure import transeq, transeqBatch, SeqBatch, uopen, asc2int, iterFasta, lazyImport
+pd = lazyImport('pandas')
 
 try :
     import ujson as json
@@ -17,50 +14,35 @@ except :
     import json
 
 def readFasta(fasta, filter=None) :
-    sequence = {}
-    with uopen(fasta) as fin :
-        for line in fin :
-            if line.startswith('>') :
-                name = line[1:].strip().split()[0]
-                if not filter or name in filter :
-                    sequence[name] = []
-            elif len(line) > 0 and not line.startswith('#') and name in sequence :
-                sequence[name].extend(line.strip().split())
-    for n, s in sequence.items() :
-        sequence[n] = (''.join(s)).upper()
-    return sequence
-
-@njit
-def seq_status(seq, aa_seq) :
-    if len(seq) % 3 > 0 :
-        return 2
-    stop = len(seq)
-    for i in range( int(len(seq)/3)-1, -1, -1 ) :
-        aa_seq[i] = seq[3*i]*676 + seq[3*i+1]*26 + seq[3*i+2]
-        if aa_seq[i] in (12844, 12850, 13000) :
-            stop = i
-    if stop < int(len(seq)/3)-1 :
-        return 3
-    if aa_seq[0] not in (500, 4556, 13344) :
-        return 4
-    if stop == len(seq) :
-        return 5
-    else :
-        return 6
+    return { n:s for n, s in iterFasta(fasta) if not filter or n in filter }
+
+def seq_status(alleles) :
+    '''CDS status of every allele, from a single batched translation in frame 1:
+    2: length not a multiple of 3; 3: internal stop; 4: no start codon; 5: no stop codon; 6: intact'''
+    batch = SeqBatch.fromItems(alleles)
+    aa, stops = transeqBatch(batch, '1', markStarts=True, ambiguous='?', stops=True)
+    lengths = batch.lengths
+    nCodon = lengths // 3
+    entry = np.searchsorted(aa.offsets, stops, 'right') - 1
+    firstStop = nCodon.copy()
+    np.minimum.at(firstStop, entry, stops - aa.offsets[entry])
+    start = np.zeros(lengths.size, dtype=bool)
+    start[nCodon > 0] = aa.buffer[aa.offsets[:-1][nCodon > 0]] == ord('M')
+
+    status = np.repeat(6, lengths.size)
+    status[firstStop == nCodon] = 5
+    status[~start] = 4
+    status[firstStop < nCodon - 1] = 3
+    status[lengths % 3 > 0] = 2
+    return status
 
 def get_allele_info(allele_npz) :
     alleles = json.load(open(allele_npz, 'rt'))
     #alleles = np.load(allele_npz)['alleles']
     output = []
-    for n, s in alleles :
+    for (n, s), pseudo in zip(alleles, seq_status(alleles)) :
         locus, allele_id = n.rsplit('_', 1)
-        if len(s) % 3 > 0:
-            pseudo = 2
-        else:
-            aa_seq = np.zeros(int(len(s) / 3), dtype=int)
-            seq = np.array(list(s)).astype(bytes).view(np.uint8) - 65
-            pseudo = seq_status(seq, aa_seq)
-        output.append([locus, allele_id, int(allele_id)*1000000 + len(s)*10 + pseudo])
+        output.append([locus, allele_id, int(allele_id)*1000000 + len(s)*10 + int(pseudo)])
     np.savez_compressed(allele_npz, alleles=np.array(output, dtype=object), allow_pickle=True)
     return allele_npz
 
@@ -141,6 +123,8 @@ def cgMLST(args) :
             x0, y0 = x[p], y[p]
             #x1, y1 = x[colPresence == ite], y[colPresence == ite]
             
+            from sklearn.gaussian_process import GaussianProcessRegressor
+            from sklearn.gaussian_process.kernels import RBF, WhiteKernel
             kernel = 100.*RBF(length_scale=10.0, length_scale_bounds=(1e-3, 1e3)) + 1.0*WhiteKernel(1e-1, noise_level_bounds=(1e-5, 1e2))
             gp = GaussianProcessRegressor(kernel=kernel, n_restarts_optimizer=9)
             gp.fit(x0[:, np.newaxis], y0)
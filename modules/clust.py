@@ -1,8 +1,8 @@
-import argparse, tempfile, glob, os, subprocess, sys, shutil
+import argparse, tempfile, glob, os, sys, shutil
 try:
-    from configure import externals, uopen, xrange, logger, transeq
+    from configure import externals, uopen, xrange, logger, transeq, run_external, cachedCall
 except :
-    from .configure import externals, uopen, xrange, logger, transeq
+    from .configure import externals, uopen, xrange, logger, transeq, run_external, cachedCall
 
 def readFasta(fasta) :
     sequence = []
@@ -59,11 +59,17 @@ def getClust(prefix, genes, params) :
                 list(map(os.unlink, glob.glob(seqDb + '*')))
             if os.path.isfile(lcDb) :
                 list(map(os.unlink, glob.glob(lcDb + '*')))
-            subprocess.Popen('{0} createdb {2} {1} -v 0'.format(externals['mmseqs'], seqDb, geneFile).split()).communicate()
-            subprocess.Popen('{0} linclust {1} {2} {3} --min-seq-id {4} -c {5} --threads {6} -v 0'.format( \
-                externals['mmseqs'], seqDb, lcDb, tmpDb, params['identity'], params['coverage'], params['n_thread']).split(), stdout=subprocess.PIPE).communicate()
-            subprocess.Popen('{0} createtsv {1} {1} {2} {3}'.format(\
-                externals['mmseqs'], seqDb, lcDb, tabFile).split(), stdout = subprocess.PIPE).communicate()
+            cmds = ['{0} createdb {2} {1} -v 0'.format(externals['mmseqs'], seqDb, geneFile),
+                    '{0} linclust {1} {2} {3} --min-seq-id {4} -c {5} --threads {6} -v 0'.format( \
+                        externals['mmseqs'], seqDb, lcDb, tmpDb, params['identity'], params['coverage'], params['n_thread']),
+                    '{0} createtsv {1} {1} {2} {3}'.format(externals['mmseqs'], seqDb, lcDb, tabFile)]
+            # only the cluster table is used afterwards, so it is all that is cached for the three steps
+            call = cachedCall(cmds, inputs=[geneFile], outputs=[tabFile], scratch=[dirPath])
+            if not call.restore() :
+                run_external(cmds[0].split(), stdout=None, stderr=None)
+                run_external(cmds[1].split(), n_thread=params['n_thread'], stderr=None)
+                run_external(cmds[2].split(), stderr=None)
+                call.store()
             with open(tabFile) as fin :
                 for line in fin :
                     part = line.strip().split()
@@ -1,18 +1,80 @@
-import os, sys, subprocess, numpy as np, pandas as pd, argparse, shutil, gzip, io, re
+import os, sys, subprocess, numpy as np, argparse, shutil, gzip, io, re, zlib, json, time, threading, atexit, importlib, functools, glob
 from datetime import datetime
+from itertools import chain
 
 if sys.version_info[0] < 3:
-    from collections import OrderedDict
+    from collections import OrderedDict, Mapping
     xrange = xrange
     from cStringIO import StringIO
     asc2int = np.uint8
 else :
     from _collections import OrderedDict
+    from collections.abc import Mapping
     from io import StringIO
     xrange = range
     asc2int = np.uint32
 
-import hashlib, uuid
+import hashlib, uuid, multiprocessing
+try :
+    import resource
+except :
+    resource = None
+
+
+class lazyImport(object) :
+    '''Stand-in for a heavy module that is only imported on first attribute access, e.g.  pd = lazyImport('pandas')
+    Keeps commands such as MLSType or "EToKi.py <cmd> -h" from paying for pandas/numba/ete3 they do not use.'''
+    def __init__(self, name) :
+        self.__dict__['_name'], self.__dict__['_module'] = name, None
+    def __getattr__(self, attr) :
+        if self._module is None :
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+pd = lazyImport('pandas')
+
+jitPackage = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+def lazyJit(*args, **options) :
+    '''numba.jit(nopython=True, cache=True), applied on the first call instead of at import:
+        @lazyJit                        or    @lazyJit('i8[:](u1[:])')
+    Compiled kernels are cached on disk, so later runs only load them. A lazyJit function cannot be
+    called from another numba function; use numba directly there.
+    The cache refers to the kernels by module name, so it is only used when they are imported from the
+    package (modules.uberBlast), not as top-level modules (uberBlast) that would read it under another name.
+    The first call compiles under a lock and the kernel is shared with other threads only after that call passed.'''
+    def wrap(func, signature=None) :
+        compiled, lock = [], threading.Lock()
+        def build(cache) :
+            from numba import jit
+            opts = dict(nopython=True, cache=cache)
+            opts.update(options)
+            opts['cache'] = opts['cache'] and cache
+            try :
+                return jit(signature, **opts)(func) if signature else jit(**opts)(func)
+            except RuntimeError :
+                # no writable cache location
+                opts['cache'] = False
+                return jit(signature, **opts)(func) if signature else jit(**opts)(func)
+        @functools.wraps(func)
+        def kernel(*a) :
+            if not compiled :
+                with lock :
+                    if not compiled :
+                        dispatcher = build(func.__module__.split('.')[0] == jitPackage)
+                        try :
+                            res = dispatcher(*a)
+                        except ImportError :
+                            # a cache entry that cannot be loaded in this process
+                            dispatcher = build(False)
+                            res = dispatcher(*a)
+                        compiled.append(dispatcher)
+                        return res
+            return compiled[0](*a)
+        kernel.py_func = func
+        return kernel
+    if len(args) == 1 and callable(args[0]) :
+        return wrap(args[0])
+    return lambda func : wrap(func, args[0] if args else None)
 def get_md5(value, dtype=str) :
     m = hashlib.md5(str(value).encode()).hexdigest()
     if dtype == str :
@@ -63,22 +125,117 @@ blosum62 = np.array([  4., -2.,  0., -2., -1., -2.,  0., -2., -1.,  0., -1., -1.
                        0.,  0.,  0.,  0.,  0.,  0.,  0.,  0.,  0.,  0.,  0., 0.,  0.,  0.,  0.,  0.,  0.,  0.,  0.,  0.,  0.,  0.])
 
 
+gzThreads, _gzPool = max(1, min(8, os.cpu_count() or 1)), None
+def gzPool() :
+    global _gzPool
+    if _gzPool is None :
+        from concurrent.futures import ThreadPoolExecutor
+        _gzPool = ThreadPoolExecutor(gzThreads, thread_name_prefix='uopen')
+    return _gzPool
+
+def _resetGzPool() :
+    # a forked child inherits the pool but not its threads; it starts its own on first use
+    global _gzPool
+    _gzPool = None
+if hasattr(os, 'register_at_fork') :
+    os.register_at_fork(after_in_child=_resetGzPool)
+
+
+class gzReader(io.RawIOBase) :
+    '''Decompress (multi-member) gzip streams in-process. The next block is read and inflated by the
+    shared pool while the caller consumes the current one; zlib releases the GIL during inflation.'''
+    def __init__(self, fileobj, blockSize=1<<20) :
+        self.fin, self.blockSize = fileobj, blockSize
+        self.decomp = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        self.buf, self.pos = b'', 0
+        self.next = gzPool().submit(self._inflate)
+    def _inflate(self) :
+        data = self.fin.read(self.blockSize)
+        if not data :
+            return None
+        out = [self.decomp.decompress(data)]
+        while self.decomp.eof and self.decomp.unused_data :
+            data = self.decomp.unused_data
+            self.decomp = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            out.append(self.decomp.decompress(data))
+        return b''.join(out)
+    def readable(self) :
+        return True
+    def readinto(self, b) :
+        while self.pos >= len(self.buf) :
+            if self.next is None :
+                return 0
+            self.buf, self.pos = self.next.result(), 0
+            if self.buf is None :
+                self.next, self.buf = None, b''
+                return 0
+            self.next = gzPool().submit(self._inflate)
+        n = min(len(b), len(self.buf) - self.pos)
+        b[:n] = self.buf[self.pos:self.pos+n]
+        self.pos += n
+        return n
+    def close(self) :
+        if not self.closed :
+            if self.next is not None :
+                self.next.result()
+                self.next = None
+            self.fin.close()
+        super(gzReader, self).close()
+
+
+class gzWriter(io.RawIOBase) :
+    '''Compress a stream as independent gzip members of <blockSize> bytes, deflated in parallel by the
+    shared pool and written in order. The concatenation is a valid gzip file for gzip, pigz and zlib.'''
+    def __init__(self, fileobj, blockSize=1<<22, level=6) :
+        self.fout, self.blockSize, self.level = fileobj, blockSize, level
+        self.buf, self.jobs = bytearray(), []
+    def writable(self) :
+        return True
+    def write(self, b) :
+        self.buf.extend(b)
+        if len(self.buf) >= self.blockSize :
+            self._submit()
+        return len(b)
+    def _submit(self) :
+        self.jobs.append(gzPool().submit(gzip.compress, bytes(self.buf), self.level))
+        self.buf = bytearray()
+        while len(self.jobs) > 2 * gzThreads :
+            self.fout.write(self.jobs.pop(0).result())
+    def close(self) :
+        if not self.closed :
+            if len(self.buf) :
+                self._submit()
+            for job in self.jobs :
+                self.fout.write(job.result())
+            self.jobs = []
+            self.fout.close()
+        super(gzWriter, self).close()
+
+
 class uopen(object) :
-    def __init__(self, fname, label='r') :
+    def __init__(self, fname, label='r', pigz=False) :
         self.fout = None
+        if pigz :
+            self._pigz(fname, label)
+        elif label.find('r')>=0 :
+            fin = open(fname, 'rb')
+            if fin.peek(2)[:2] == b'\x1f\x8b' :
+                fin = io.BufferedReader(gzReader(fin))
+            self.fstream = io.TextIOWrapper(fin, encoding='utf-8')
+        elif label.find('w') >= 0 :
+            self.fstream = io.TextIOWrapper(io.BufferedWriter(gzWriter(open(fname, 'wb'))), encoding='utf-8')
+        elif label.find('a') >= 0 :
+            self.fstream = io.TextIOWrapper(io.BufferedWriter(gzWriter(open(fname, 'ab'))), encoding='utf-8')
+    def _pigz(self, fname, label) :
         if label.find('r')>=0 :
             self.fstream = subprocess.Popen([externals['pigz'], '-cd', fname], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True).stdout if fname.lower().endswith('gz') else open(fname)
         elif label.find('w') >= 0 :
             self.fout = open(fname, 'wb')
             p = subprocess.Popen([externals['pigz']], stdin=subprocess.PIPE, stdout=self.fout, universal_newlines=True)
             self.fstream = p.stdin
-            
         elif label.find('a') >= 0 :
-            if sys.version.startswith('3') :
-                self.fout = gzip.open(fname, 'ab')
-                self.fstream = io.TextIOWrapper(self.fout, encoding='utf-8')
-            else :
-                self.fstream = gzip.open(fname, 'ab')
+            self.fout = gzip.open(fname, 'ab')
+            self.fstream = io.TextIOWrapper(self.fout, encoding='utf-8')
     def __enter__(self) :
         return self.fstream
     def __exit__(self, type, value, traceback) :
@@ -92,41 +249,237 @@ class uopen(object) :
         return self.fstream
 
 
-def readFasta(fasta, headOnly=False) :
-    sequence = OrderedDict()
+def _iterFastaLines(lines, headOnly=False) :
+    name, seq = None, []
+    for line in lines :
+        if line.startswith('>') :
+            if name is not None :
+                yield name, (''.join(seq)).upper()
+            name = line[1:].strip().split()[0]
+            seq = []
+        elif len(line) > 0 and not line.startswith('#') and not headOnly :
+            seq.extend(line.strip().split())
+    if name is not None :
+        yield name, (''.join(seq)).upper()
+
+def iterFasta(fasta, headOnly=False) :
+    store = loadSeqStore(fasta)
+    if store is not None :
+        for name in store :
+            yield name, ('' if headOnly else str(store[name]))
+        return
     with uopen(fasta) as fin :
-        for line in fin :
-            if line.startswith('>') :
-                name = line[1:].strip().split()[0]
-                sequence[name] = []
-            elif len(line) > 0 and not line.startswith('#') and not headOnly :
-                sequence[name].extend(line.strip().split())
-    for s in sequence :
-        sequence[s] = (''.join(sequence[s])).upper()
-    return sequence
+        for name, seq in _iterFastaLines(fin, headOnly) :
+            yield name, seq
 
-def readFastq(fastq) :
-    sequence, qual = OrderedDict(), OrderedDict()
+def iterFastq(fastq) :
+    if loadSeqStore(fastq) is not None :
+        for name, seq in iterFasta(fastq) :
+            yield name, seq, re.sub(r'[^!]', 'I', re.sub(r'[^ACGTacgt]', '!', seq))
+        return
     with uopen(fastq) as fin :
         line = fin.readline()
         if not line.startswith('@') :
-            sequence = readFasta(fastq)
-            return sequence, OrderedDict( [n, re.sub(r'[^!]', 'I', re.sub(r'[^ACGTacgt]', '!', s))] for n, s in sequence.items() )
-    with uopen(fastq) as fin :
-        for lineId, line in enumerate(fin) :
-            if lineId % 4 == 0 :
-                name = line[1:].strip().split()[0]
-                sequence[name] = []
-                qual[name] = []
-            elif lineId % 4 == 1 :
-                sequence[name].extend(line.strip().split())
-            elif lineId % 4 == 3 :
-                qual[name].extend(line.strip().split())
-    for s in sequence :
-        sequence[s] = (''.join(sequence[s])).upper()
-        qual[s] = ''.join(qual[s])
+            for name, seq in _iterFastaLines(chain([line], fin)) :
+                yield name, seq, re.sub(r'[^!]', 'I', re.sub(r'[^ACGTacgt]', '!', seq))
+            return
+        while line :
+            if not line.strip() :
+                line = fin.readline()
+                continue
+            name = line[1:].strip().split()[0]
+            seq, _, qual = fin.readline(), fin.readline(), fin.readline()
+            yield name, (''.join(seq.strip().split())).upper(), ''.join(qual.strip().split())
+            line = fin.readline()
+
+def readFasta(fasta, headOnly=False) :
+    return OrderedDict(iterFasta(fasta, headOnly))
+
+def readFastq(fastq) :
+    sequence, qual = OrderedDict(), OrderedDict()
+    for name, s, q in iterFastq(fastq) :
+        sequence[name], qual[name] = s, q
     return sequence, qual
 
+_b2a = np.frombuffer(b'ACGT', dtype=np.uint8)
+_a2b = np.repeat(np.uint8(255), 256)
+_a2b[_b2a] = np.arange(4, dtype=np.uint8)
+class StoredSeq(object) :
+    '''A read-only view of one sequence in a SeqStore. Only the sliced window is unpacked.'''
+    def __init__(self, store, id, encoder=None) :
+        self.store, self.id, self.encoder = store, id, encoder
+    def __len__(self) :
+        return int(self.store.lengths[self.id])
+    def __getitem__(self, key) :
+        if isinstance(key, slice) :
+            s, e, step = key.indices(len(self))
+            codes = self.store.ascii(self.id, s, max(s, e))
+            if step != 1 :
+                codes = codes[::step] if step > 0 else self.store.ascii(self.id, e+1, s+1)[::step]
+        else :
+            key = key + len(self) if key < 0 else key
+            if not 0 <= key < len(self) :
+                raise IndexError('sequence index out of range')
+            codes = self.store.ascii(self.id, key, key+1)
+        if self.encoder is not None :
+            return self.encoder[codes]
+        return codes.tobytes().decode('ascii')
+    def __str__(self) :
+        return self[:]
+    def __iter__(self) :
+        return iter(self[:])
+
+
+class SeqStore(Mapping) :
+    '''2-bit packed, memory-mapped sequences of a FASTA file, saved next to it as <fasta>.2bit.npy and
+    <fasta>.2bit.idx.npz. Non-ACGT characters are kept as (start, length, char) runs in the mask.'''
+    def __init__(self, prefix) :
+        self.packed = np.load(prefix + '.2bit.npy', mmap_mode='r')
+        idx = np.load(prefix + '.2bit.idx.npz')
+        self.names, self.offsets, self.lengths = idx['names'].tolist(), idx['offsets'], idx['lengths']
+        self.maskStart, self.maskLen, self.maskChar = idx['mask_start'], idx['mask_len'], idx['mask_char']
+        self.maskEnd = self.maskStart + self.maskLen
+        self.source = idx['source']
+        self.index = { n:i for i, n in enumerate(self.names) }
+    def __getitem__(self, name) :
+        return StoredSeq(self, self.index[name])
+    def __iter__(self) :
+        return iter(self.names)
+    def __len__(self) :
+        return len(self.names)
+    def encoded(self, encoder) :
+        return { n:StoredSeq(self, i, encoder) for i, n in enumerate(self.names) }
+    def ascii(self, id, s, e) :
+        g0, g1 = self.offsets[id] + s, self.offsets[id] + e
+        block = self.packed[g0 >> 2:(g1+3) >> 2]
+        codes = ((block[:, np.newaxis] >> np.array([6, 4, 2, 0], dtype=np.uint8)) & 3).ravel()
+        codes = _b2a[codes[g0 & 3:g0 + e - s - (g0 & ~3)]]
+        for m in xrange(np.searchsorted(self.maskEnd, g0, 'right'), np.searchsorted(self.maskStart, g1, 'left')) :
+            codes[max(self.maskStart[m], g0)-g0:min(self.maskEnd[m], g1)-g0] = self.maskChar[m]
+        return codes
+
+
+def _sourceStat(fasta) :
+    stat = os.stat(fasta)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+def _isFastq(fname) :
+    '''True if the first record of <fname> is a FASTQ one'''
+    with uopen(fname) as fin :
+        for line in fin :
+            if line.strip() :
+                return line.startswith('@')
+    return False
+
+def buildSeqStore(fasta, prefix=None) :
+    '''Build the SeqStore of a FASTA file. A store keeps no qualities, so FASTQ files are refused.'''
+    if _isFastq(fasta) :
+        raise ValueError('{0} is a FASTQ file; sequence stores are only built from FASTA'.format(fasta))
+    prefix = prefix or fasta
+    names, offsets, lengths, packed, masks = [], [], [], [], []
+    offset = 0
+    for name, seq in iterFasta(fasta) :
+        codes = np.frombuffer(seq.encode('ascii'), dtype=np.uint8)
+        bits = _a2b[codes]
+        mask = np.flatnonzero(bits == 255)
+        if mask.size :
+            brk = np.flatnonzero((np.diff(mask) != 1) | (codes[mask[1:]] != codes[mask[:-1]])) + 1
+            starts, ends = mask[np.concatenate([[0], brk])], mask[np.concatenate([brk-1, [mask.size-1]])] + 1
+            masks.append(np.vstack([starts + offset, ends - starts, codes[starts]]).T)
+            bits[mask] = 0
+        if bits.size % 4 :
+            bits = np.concatenate([bits, np.zeros(4 - bits.size % 4, dtype=np.uint8)])
+        bits = bits.reshape(-1, 4)
+        packed.append((bits.T[0] << 6) | (bits.T[1] << 4) | (bits.T[2] << 2) | bits.T[3])
+        names.append(name)
+        offsets.append(offset)
+        lengths.append(codes.size)
+        offset += bits.size
+    masks = np.vstack(masks) if len(masks) else np.zeros([0, 3], dtype=np.int64)
+    np.save(prefix + '.2bit.npy', np.concatenate(packed) if len(packed) else np.zeros(0, dtype=np.uint8))
+    np.savez(prefix + '.2bit.idx.npz', names=np.array(names, dtype=str), offsets=np.array(offsets, dtype=np.int64), \
+             lengths=np.array(lengths, dtype=np.int64), mask_start=masks.T[0].astype(np.int64), \
+             mask_len=masks.T[1].astype(np.int64), mask_char=masks.T[2].astype(np.uint8), source=_sourceStat(fasta))
+    logger('Built 2-bit sequence store for {0}: {1} sequences, {2} bases'.format(fasta, len(names), int(np.sum(lengths))))
+    return SeqStore(prefix)
+
+def loadSeqStore(fasta) :
+    '''Return the SeqStore of <fasta> if an up-to-date companion index exists, otherwise None. Stores next to
+    FASTQ files are ignored: they would drop the qualities.'''
+    if not isinstance(fasta, str) or not os.path.isfile(fasta + '.2bit.idx.npz') or not os.path.isfile(fasta + '.2bit.npy') :
+        return None
+    try :
+        store = SeqStore(fasta)
+    except Exception :
+        return None
+    if os.path.isfile(fasta) and (not np.array_equal(store.source, _sourceStat(fasta)) or _isFastq(fasta)) :
+        return None
+    return store
+
+
+_complement = np.frombuffer(b'N'*256, dtype=np.uint8).copy()
+_complement[np.frombuffer(b'ACGTNacgtn', dtype=np.uint8)] = np.frombuffer(b'TGCANTGCAN', dtype=np.uint8)
+class SeqBatch(object) :
+    '''Many sequences held in one contiguous buffer (ASCII uint8, or encoded by a lookup table), with an
+    offsets array of size n+1 and a name index. batch[name] returns a zero-copy view of that record.'''
+    def __init__(self, names, buffer, offsets) :
+        self.names, self.buffer, self.offsets = list(names), buffer, np.asarray(offsets, dtype=np.int64)
+        self.index = { n:i for i, n in enumerate(self.names) }
+    @classmethod
+    def fromItems(cls, items) :
+        names, seqs = [], []
+        for n, s in items :
+            names.append(n)
+            seqs.append(s if isinstance(s, str) else str(s))
+        lengths = np.fromiter(map(len, seqs), dtype=np.int64, count=len(seqs))
+        buffer = np.frombuffer(''.join(seqs).encode('ascii'), dtype=np.uint8)
+        return cls(names, buffer, np.concatenate([[0], np.cumsum(lengths)]))
+    @classmethod
+    def fromDict(cls, seqs) :
+        return cls.fromItems(seqs.items())
+    @classmethod
+    def fromFasta(cls, fasta) :
+        return cls.fromItems(iterFasta(fasta))
+    def toDict(self) :
+        return OrderedDict( (n, self.buffer[self.offsets[i]:self.offsets[i+1]].tobytes().decode('ascii')) for i, n in enumerate(self.names) )
+    def __len__(self) :
+        return len(self.names)
+    def __iter__(self) :
+        return iter(self.names)
+    def __contains__(self, name) :
+        return name in self.index
+    def __getitem__(self, name) :
+        i = self.index[name]
+        return self.buffer[self.offsets[i]:self.offsets[i+1]]
+    def items(self) :
+        return ( (n, self.buffer[self.offsets[i]:self.offsets[i+1]]) for i, n in enumerate(self.names) )
+    @property
+    def lengths(self) :
+        return np.diff(self.offsets)
+    def offset(self, name) :
+        return self.offsets[self.index[name]]
+    def fetch(self, name, start, end, reverse=False) :
+        '''ASCII codes of [start, end) of a record; a view for the forward strand, reverse-complemented otherwise.'''
+        o = self.offsets[self.index[name]]
+        seq = self.buffer[o+start:o+end]
+        return _complement[seq[::-1]] if reverse else seq
+    def encode(self, encoder) :
+        return SeqBatch(self.names, encoder[self.buffer], self.offsets)
+    def rc(self) :
+        lengths = self.lengths
+        rec = np.repeat(np.arange(lengths.size), lengths)
+        idx = self.offsets[rec] + self.offsets[rec+1] - 1 - np.arange(self.buffer.size)
+        return SeqBatch(self.names, _complement[self.buffer[idx]], self.offsets)
+    def slices(self, names, starts, ends) :
+        '''Gather [start, end) of the named records into a new batch, in a single vectorised copy.'''
+        starts, ends = np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+        o = self.offsets[[self.index[n] for n in names]]
+        lengths = ends - starts
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        idx = np.arange(offsets[-1]) - np.repeat(offsets[:-1] - o - starts, lengths)
+        return SeqBatch(['{0}:{1}-{2}'.format(n, s+1, e) for n, s, e in zip(names, starts, ends)], self.buffer[idx], offsets)
+
+
 complement = {'A':'T', 'T':'A', 'G':'C', 'C':'G', 'N':'N'}
 def rc(seq, missingValue='N') :
     return ''.join([complement.get(s, missingValue) for s in reversed(seq.upper())])
@@ -143,42 +496,75 @@ def rev_transeq(s, transl_table=11) :
         rev_seq[aa] = ''.join([na[int(codon/16)], na[int((codon%16)/4)], na[codon%4]])
     return ''.join([ rev_seq.get(x, '---') for x in s ])
 
-baseConv = np.repeat(-100, 255)
-baseConv[(np.array(['-', 'A', 'C', 'G', 'T']).view(asc2int),)] = (-100000, 0, 1, 2, 3)
-def transeq(seq, frame=7, transl_table=None, markStarts=False) :
+_transeqCode = np.repeat(4, 256).astype(np.int8)
+_transeqCode[np.frombuffer(b'ACGTacgt-', dtype=np.uint8)] = (0, 1, 2, 3, 0, 1, 2, 3, 5)
+@lazyJit
+def _transeqKernel(codes, offsets, frames, gtable, outOffsets, out) :
+    nFrame = frames.size
+    for i in range(offsets.size - 1) :
+        s, e = offsets[i], offsets[i+1]
+        for j in range(nFrame) :
+            f = frames[j]
+            shift = f - 1 if f <= 3 else f - 4
+            o, p = outOffsets[i*nFrame + j], outOffsets[i*nFrame + j + 1]
+            for k in range(p - o) :
+                c, gap, ambiguous = 0, False, False
+                for m in range(3) :
+                    x = shift + 3*k + m
+                    if x >= e - s :
+                        b = 4
+                    elif f <= 3 :
+                        b = codes[s + x]
+                    else :
+                        b = codes[e - 1 - x]
+                        if b < 4 :
+                            b = 3 - b
+                    if b == 5 :
+                        gap = True
+                    elif b == 4 :
+                        ambiguous = True
+                    else :
+                        c = (c << 2) + b
+                out[o+k] = gtable[64] if gap else (gtable[65] if ambiguous else gtable[c])
+
+def transeqFrames(frame) :
+    if isinstance(frame, (list, tuple, np.ndarray)) :
+        return [int(f) for f in frame]
     frames = {'F': [1,2,3],
               'R': [4,5,6],
               '7': [1,2,3,4,5,6]}.get( str(frame).upper() , None)
     if frames is None :
         frames = [int(f) for f in str(frame).split(',')]
-    
+    return frames
+
+def transeqBatch(batch, frame=7, transl_table=None, markStarts=False, ambiguous='X', stops=False) :
+    '''Translate every record of a SeqBatch (ASCII) in all requested frames with one compiled pass.
+    Returns a SeqBatch of amino acids named (name, frame); record i, frame j is entry i*nFrame+j.
+    Codons with gaps become '-', codons with other bases become <ambiguous>.
+    With stops=True, also returns the buffer positions of all 'X' (stop codons) in the output.'''
+    frames = np.array(transeqFrames(frame), dtype=np.int64)
     if transl_table == 4 :
-        gtable = np.array(list('KNKNTTTTRSRSIIMIQHQHPPPPRRRRLLLLEDEDAAAAGGGGVVVVXYXYSSSSWCWCLFLF-'))
+        gtable = 'KNKNTTTTRSRSIIMIQHQHPPPPRRRRLLLLEDEDAAAAGGGGVVVVXYXYSSSSWCWCLFLF-'
     else :
-        gtable = np.array(list('KNKNTTTTRSRSIIMIQHQHPPPPRRRRLLLLEDEDAAAAGGGGVVVVXYXYSSSSXCWCLFLF-'))
+        gtable = 'KNKNTTTTRSRSIIMIQHQHPPPPRRRRLLLLEDEDAAAAGGGGVVVVXYXYSSSSXCWCLFLF-'
+    gtable = np.frombuffer((gtable + ambiguous).encode('ascii'), dtype=np.uint8).copy()
     if markStarts :
-        gtable[(np.array([46, 62]),)] = 'M'
-
-    seqs = seq.items() if isinstance(seq, dict) else seq
-    nFrame = (max(frames) > 3)
-    trans_seq = []
-    for n,s in seqs :
-        s = baseConv[np.array(list(s.upper())).view(asc2int)]
-        if nFrame :
-            rs = (3 - s)[::-1]
-            rs[rs >= 100] *= -1            
-        sf = s.size % 3
-        tseq = []
-        for f in frames :
-            codons = s[f-1:] if f <= 3 else rs[f-4:]
-            if codons.size % 3 :
-                codons = np.concatenate([codons, [-100]*(3 - codons.size % 3)])
-            codons = codons.reshape(-1, 3)
-            codon2 = np.sum(codons << [4, 2, 0], 1)
-            codon2[codon2 < -50000] = 64
-            codon2[codon2 < 0] = 50
-            tseq.append(''.join(gtable[codon2].tolist()))
-        trans_seq.append([n, tseq])
+        gtable[(np.array([46, 62]),)] = ord('M')
+
+    shifts = np.where(frames <= 3, frames - 1, frames - 4)
+    aaLen = (np.maximum(batch.lengths[:, np.newaxis] - shifts[np.newaxis, :], 0) + 2) // 3
+    outOffsets = np.concatenate([[0], np.cumsum(aaLen.flatten())]).astype(np.int64)
+    out = np.empty(outOffsets[-1], dtype=np.uint8)
+    _transeqKernel(_transeqCode[batch.buffer], batch.offsets, frames, gtable, outOffsets, out)
+    aa = SeqBatch([(n, f) for n in batch.names for f in frames.tolist()], out, outOffsets)
+    return (aa, np.flatnonzero(out == ord('X'))) if stops else aa
+
+def transeq(seq, frame=7, transl_table=None, markStarts=False) :
+    frames = transeqFrames(frame)
+    seqs = list(seq.items()) if isinstance(seq, dict) else list(seq)
+    aa = transeqBatch(SeqBatch.fromItems(seqs), frames, transl_table, markStarts)
+    aaSeq, o, nFrame = aa.buffer.tobytes().decode('ascii'), aa.offsets.tolist(), len(frames)
+    trans_seq = [ [n, [ aaSeq[o[i*nFrame+j]:o[i*nFrame+j+1]] for j in xrange(nFrame) ]] for i, (n, s) in enumerate(seqs) ]
     return dict(trans_seq) if isinstance(seq, dict) else trans_seq
 
 
@@ -187,13 +573,517 @@ def logger(log, pipe=sys.stderr) :
     pipe.flush()
 
 
+def memUsage() :
+    '''current resident memory in MB (peak RSS where /proc is not available)'''
+    try :
+        with open('/proc/self/statm') as fin :
+            return int(fin.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1048576.
+    except :
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024. if resource else 0.
+
+def _ioBytes() :
+    try :
+        with open('/proc/self/io') as fin :
+            stat = dict(line.split(': ') for line in fin.read().strip().split('\n'))
+        return int(stat['rchar']), int(stat['wchar'])
+    except :
+        return 0, 0
+
+def _cpuTimes() :
+    if not resource :
+        return time.process_time()
+    s = resource.getrusage(resource.RUSAGE_SELF)
+    return s.ru_utime + s.ru_stime
+
+_stages, _stageLock, _stageSampler = [], threading.Lock(), None
+def _sampleMemory(interval=0.2) :
+    while True :
+        time.sleep(interval)
+        rss = memUsage()
+        with _stageLock :
+            for span in _stages :
+                span['peak_rss_mb'] = max(span['peak_rss_mb'], rss)
+
+class stage(object) :
+    '''A nested timing span for the resource report:
+        with stage('blastn') :
+            ...
+    records wall and CPU time, CPU time of child processes, peak RSS, bytes read/written and event counts
+    (countEvent) of everything within. Spans are kept only while a report is running (startReport).
+    The CPU time of children is that of the programs run by run_external, and of the tasks of process Pools
+    wrapped in reportTask (with the programs they run), added when each of them finishes.'''
+    def __init__(self, name) :
+        self.name = name
+    def __enter__(self) :
+        global _stageSampler
+        cpu = _cpuTimes()
+        rchar, wchar = _ioBytes()
+        self.span = {'name':self.name, 'wall_s':time.time(), 'cpu_s':cpu, 'child_cpu_s':0., \
+                     'peak_rss_mb':memUsage(), 'read_bytes':rchar, 'write_bytes':wchar, 'counts':{}, 'stages':[]}
+        with _stageLock :
+            if _stages :
+                _stages[-1]['stages'].append(self.span)
+            _stages.append(self.span)
+        if _stageSampler is None :
+            _stageSampler = threading.Thread(target=_sampleMemory)
+            _stageSampler.daemon = True
+            _stageSampler.start()
+        return self.span
+    def __exit__(self, exc_type, exc_value, traceback) :
+        cpu = _cpuTimes()
+        rchar, wchar = _ioBytes()
+        span, rss = self.span, memUsage()
+        with _stageLock :
+            span['wall_s'] = round(time.time() - span['wall_s'], 3)
+            span['cpu_s'] = round(cpu - span['cpu_s'], 3)
+            span['child_cpu_s'] = round(span['child_cpu_s'], 3)
+            span['peak_rss_mb'] = round(max(span['peak_rss_mb'], rss), 1)
+            span['read_bytes'], span['write_bytes'] = rchar - span['read_bytes'], wchar - span['write_bytes']
+            if exc_type is not None :
+                span['error'] = '{0}: {1}'.format(exc_type.__name__, exc_value)
+            if span in _stages :
+                _stages.remove(span)
+        return False
+
+def countEvent(key, value=1) :
+    '''add <value> to counter <key> of every open stage'''
+    with _stageLock :
+        for span in _stages :
+            span['counts'][key] = span['counts'].get(key, 0) + value
+
+def addChildCpu(seconds) :
+    '''add the CPU time of a finished child process to every open stage'''
+    with _stageLock :
+        for span in _stages :
+            span['child_cpu_s'] += seconds
+
+class taskReport(object) :
+    '''the result of a reportTask call, with the counters and CPU time of a Pool worker (None in-process)'''
+    def __init__(self, result, counts=None, cpu=0.) :
+        self.result, self.counts, self.cpu = result, counts, cpu
+
+class reportTask(object) :
+    '''Wrap a function run by a process Pool, so that the counters (countEvent) and CPU time of each call,
+    including that of the programs it runs, reach the open stages of the parent:
+        results = list(map(mergeReport, pool.map(reportTask(func), tasks)))
+    In the process that created it (e.g. with a ThreadPool), the function is simply called.'''
+    def __init__(self, func) :
+        self.func, self.pid = func, os.getpid()
+    def __call__(self, args) :
+        if os.getpid() == self.pid :
+            return taskReport(self.func(args))
+        # the stages inherited from the parent are copies; collect into a span of this task instead
+        span, cpu = {'counts':{}, 'child_cpu_s':0., 'peak_rss_mb':0., 'stages':[]}, _cpuTimes()
+        with _stageLock :
+            inherited = _stages[:]
+            _stages[:] = [span]
+        try :
+            res = self.func(args)
+        finally :
+            with _stageLock :
+                _stages[:] = inherited
+        return taskReport(res, span['counts'], _cpuTimes() - cpu + span['child_cpu_s'])
+
+def mergeReport(report) :
+    '''add the counters and CPU time of a reportTask call to the open stages; returns its result'''
+    if report.counts is not None :
+        for key, value in report.counts.items() :
+            countEvent(key, value)
+        addChildCpu(report.cpu)
+    return report.result
+
+class countedPopen(subprocess.Popen) :
+    '''subprocess.Popen that counts the external processes it starts, in total and per program'''
+    def __init__(self, args, *a, **kw) :
+        cmd = args.split()[0] if isinstance(args, str) else args[0]
+        countEvent('processes')
+        countEvent('process:' + os.path.basename(str(cmd)).strip('"\''))
+        super(countedPopen, self).__init__(args, *a, **kw)
+
+_report = {}
+def startReport(command, argv=None) :
+    '''Open the root stage of a subcommand. The JSON report is written at exit, to the file named
+    by ${ETOKI_REPORT} if set, or to stderr otherwise.'''
+    if _report :
+        return
+    subprocess.Popen = countedPopen
+    _report.update({'command':command, 'argv':list(argv or []), 'start':str(datetime.now()), 'pid':os.getpid()})
+    _report['root'] = stage(command)
+    _report['stages'] = _report['root'].__enter__()
+    atexit.register(stopReport)
+
+def stopReport(error=None) :
+    '''Close the root stage and write the report; <error> is the exception that ended the subcommand, if any.'''
+    if 'root' not in _report :
+        return
+    root = _report.pop('root')
+    if isinstance(error, SystemExit) and error.code in (None, 0) :
+        error = None
+    root.__exit__(type(error) if error is not None else None, error, None)
+    _report['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024., 1) if resource else None
+    _report['status'] = 'ok' if 'error' not in _report['stages'] else 'error'
+    fname = os.environ.get('ETOKI_REPORT', '')
+    if fname :
+        with open(fname, 'w') as fout :
+            json.dump(_report, fout, indent=1)
+    else :
+        logger('EToKi report: ' + json.dumps(_report))
+    return _report
+
+
+class threadBudget(object) :
+    '''A global budget of CPU threads shared by all external programs. It is created when configure is
+    imported, so Pool workers forked later draw from the same budget. Size: ${ETOKI_THREADS} or the CPU count.'''
+    def __init__(self, size) :
+        self.size = max(1, int(size))
+        self.tokens, self.lock = multiprocessing.Semaphore(self.size), multiprocessing.Lock()
+    def acquire(self, n) :
+        n = min(max(1, int(n)), self.size)
+        with self.lock :
+            for _ in xrange(n) :
+                self.tokens.acquire()
+        return n
+    def release(self, n) :
+        for _ in xrange(n) :
+            self.tokens.release()
+
+externalThreads = threadBudget(os.environ.get('ETOKI_THREADS', multiprocessing.cpu_count()))
+
+class ExternalRun(object) :
+    '''outcome of run_external: returncode, captured stdout/stderr, wall/cpu seconds, peak RSS (MB) and number of tries'''
+    def __init__(self, cmd) :
+        self.cmd, self.returncode, self.stdout, self.stderr = cmd, None, None, None
+        self.wall, self.cpu, self.max_rss_mb, self.tries = 0., 0., 0., 0
+
+def _killTree(p) :
+    try :
+        import psutil
+        for child in psutil.Process(p.pid).children(recursive=True) :
+            child.terminate()
+    except :
+        pass
+    try :
+        p.terminate()
+    except :
+        pass
+
+def _sizeOf(value) :
+    '''"10G", "500M" or a plain number of bytes'''
+    value = str(value).strip().upper().rstrip('B')
+    unit = {'K':1<<10, 'M':1<<20, 'G':1<<30, 'T':1<<40}.get(value[-1:], 1)
+    return int(float(value.rstrip('KMGT')) * unit)
+
+_digests = {}
+def fileDigest(fname) :
+    '''sha1 of a file, or of all files that start with <prefix> for "<prefix>*"; memoised on path, size and mtime'''
+    if fname.endswith('*') :
+        names = sorted(glob.glob(glob.escape(fname[:-1]) + '*'))
+        return hashlib.sha1(' '.join(n[len(fname)-1:] + ':' + fileDigest(n) for n in names if os.path.isfile(n)).encode()).hexdigest()
+    st = os.stat(fname)
+    key = (os.path.abspath(fname), st.st_size, st.st_mtime_ns)
+    if key not in _digests :
+        m = hashlib.sha1()
+        with open(fname, 'rb') as fin :
+            for block in iter(lambda : fin.read(1<<20), b'') :
+                m.update(block)
+        _digests[key] = m.hexdigest()
+    return _digests[key]
+
+_cacheStats = {'hit':0, 'miss':0, 'stored_bytes':0, 'restored_bytes':0}
+def _cacheSummary() :
+    logger('Tool cache: {hit} hits, {miss} misses, {0:.1f} MB restored, {1:.1f} MB stored'.format( \
+        _cacheStats['restored_bytes']/1048576., _cacheStats['stored_bytes']/1048576., **_cacheStats))
+
+class cachedCall(object) :
+    '''An entry of the opt-in cache of external tool results, enabled by naming a folder in ${ETOKI_CACHE}
+    (size limit ${ETOKI_CACHE_SIZE}, default 10G; least recently used entries are evicted).
+        call = cachedCall([cmd1, cmd2], inputs=[fasta], outputs=[dbPrefix + '*'], scratch=[tmpDir])
+        if not call.restore() :
+            ... run cmd1 and cmd2 ...
+            call.store()
+    cmds:     the commands (each a string or a list of arguments) that together produce the outputs
+    inputs:   files whose contents define the result; "<prefix>*" stands for all files starting with prefix
+    outputs:  files written by the commands; "<prefix>*" stores all files created or changed under prefix
+    scratch:  paths named in the commands that do not identify the result (temporary folders, indices
+              derived from the inputs)
+    The key is the content of the inputs, the tool binaries and the commands with all these paths replaced
+    by placeholders, so the same call from another folder or run hits the cache. Use run_external(cache=...)
+    for single commands.'''
+    folder = os.environ.get('ETOKI_CACHE', '')
+    maxSize = _sizeOf(os.environ.get('ETOKI_CACHE_SIZE', '10G'))
+    # size of the cache as last scanned by evict() plus what this process stored since; None before the first scan
+    cacheSize = None
+    def __init__(self, cmds, inputs=(), outputs=(), scratch=()) :
+        self.cmds = list(cmds)
+        self.inputs, self.outputs, self.scratch = list(inputs), list(outputs), list(scratch)
+        self.prog = os.path.basename(self.command(self.cmds[0]).split()[0]) if self.cmds else ''
+        self.key, self.entry, self.before = None, None, {}
+        self.stdoutFile, self.streamed = None, None
+    @staticmethod
+    def command(cmd) :
+        return ' '.join(cmd) if isinstance(cmd, (list, tuple)) else ' '.join(cmd.split())
+    def enabled(self) :
+        return bool(self.folder)
+    def makeKey(self) :
+        paths = [[p.rstrip('*'), '{{in{0}}}'.format(i)] for i, p in enumerate(self.inputs)] + \
+                [[p.rstrip('*'), '{{out{0}}}'.format(i)] for i, p in enumerate(self.outputs)] + \
+                [[p.rstrip('*'), '{{tmp{0}}}'.format(i)] for i, p in enumerate(self.scratch)]
+        paths = sorted([[v, k] for p, k in paths for v in {p, os.path.abspath(p)} if v], key=lambda x:-len(x[0]))
+        cmds, tools = [], []
+        for cmd in self.cmds :
+            cmd = self.command(cmd)
+            exe = cmd.split()[0].strip('"\'')
+            if os.path.isfile(exe) :
+                st = os.stat(exe)
+                tools.append([os.path.basename(exe), st.st_size, st.st_mtime_ns])
+            for p, k in paths :
+                cmd = cmd.replace(p, k)
+            cmds.append(cmd)
+        key = json.dumps([cmds, tools, [fileDigest(i) for i in self.inputs], [o.endswith('*') for o in self.outputs]])
+        return hashlib.sha1(key.encode()).hexdigest()
+    def outputFiles(self, output) :
+        if output.endswith('*') :
+            inputs = {os.path.abspath(i) for i in self.inputs}
+            return [n for n in sorted(glob.glob(glob.escape(output[:-1]) + '*')) if os.path.isfile(n) and os.path.abspath(n) not in inputs]
+        return [output] if os.path.isfile(output) else []
+    def restore(self) :
+        '''copy a cached result into the outputs. Returns False on a miss (or if the cache is off),
+        or the cached stdout (True if there is none) on a hit. A stdout that was streamed into the
+        cache (see streamStdout) is opened as self.stdoutFile instead.
+        An entry that disappears while it is restored (evicted by another process) is a miss.'''
+        if not self.enabled() :
+            return False
+        try :
+            self.key = self.makeKey()
+        except (IOError, OSError) :
+            return False
+        self.entry = os.path.join(self.folder, self.key[:2], self.key)
+        if not _cacheStats['hit'] + _cacheStats['miss'] :
+            atexit.register(_cacheSummary)
+        try :
+            with open(os.path.join(self.entry, 'meta.json')) as fin :
+                meta = json.load(fin)
+            if meta.get('stdout_file') :
+                self.stdoutFile = open(os.path.join(self.entry, 'stdout'))
+            for id, (output, files) in enumerate(zip(self.outputs, meta['files'])) :
+                for suffix in files :
+                    src = os.path.join(self.entry, 'out{0}'.format(id), suffix) if output.endswith('*') else os.path.join(self.entry, 'out{0}'.format(id))
+                    shutil.copyfile(src, output[:-1] + suffix if output.endswith('*') else output)
+            os.utime(self.entry, None)
+        except (IOError, OSError, ValueError, KeyError) :
+            if self.stdoutFile :
+                self.stdoutFile.close()
+                self.stdoutFile = None
+            _cacheStats['miss'] += 1
+            countEvent('cache_miss')
+            logger('Tool cache miss for {0} [{1}]'.format(self.prog, self.key[:12]))
+            self.before = {o: {n: os.stat(n).st_mtime_ns for n in self.outputFiles(o)} for o in self.outputs if o.endswith('*')}
+            return False
+        _cacheStats['hit'] += 1
+        _cacheStats['restored_bytes'] += meta['bytes']
+        countEvent('cache_hit')
+        countEvent('cache_hit:' + self.prog)
+        logger('Tool cache hit for {0} [{1}]: {2} files restored'.format(self.prog, self.key[:12], sum(len(f) for f in meta['files'])))
+        return meta.get('stdout', True)
+    def streamStdout(self) :
+        '''a file in the cache folder to write the stdout of the run to, line by line; store() keeps it in the entry'''
+        if not os.path.isdir(self.folder) :
+            os.makedirs(self.folder, exist_ok=True)
+        self.streamed = open(os.path.join(self.folder, 'tmp.{0}.{1}.stdout'.format(os.getpid(), uuid.uuid4().hex[:8])), 'w')
+        return self.streamed
+    def discard(self) :
+        '''remove the streamed stdout of a run that is not stored'''
+        if self.streamed is not None :
+            self.streamed.close()
+            try :
+                os.unlink(self.streamed.name)
+            except OSError :
+                pass
+            self.streamed = None
+    def store(self, stdout=None) :
+        '''save the outputs of a successful run under the key computed by restore()'''
+        if not self.enabled() or self.key is None or os.path.isdir(self.entry) :
+            self.discard()
+            return
+        tmpDir = os.path.join(self.folder, 'tmp.{0}.{1}'.format(os.getpid(), uuid.uuid4().hex[:8]))
+        try :
+            os.makedirs(tmpDir)
+            files, size = [], 0
+            for id, output in enumerate(self.outputs) :
+                if output.endswith('*') :
+                    before = self.before.get(output, {})
+                    names = [n for n in self.outputFiles(output) if before.get(n) != os.stat(n).st_mtime_ns]
+                    os.makedirs(os.path.join(tmpDir, 'out{0}'.format(id)))
+                    for n in names :
+                        shutil.copyfile(n, os.path.join(tmpDir, 'out{0}'.format(id), n[len(output)-1:]))
+                    files.append([n[len(output)-1:] for n in names])
+                    size += sum(os.path.getsize(n) for n in names)
+                else :
+                    shutil.copyfile(output, os.path.join(tmpDir, 'out{0}'.format(id)))
+                    files.append([''])
+                    size += os.path.getsize(output)
+            meta = dict(cmds=[self.command(c) for c in self.cmds], inputs=self.inputs, outputs=self.outputs, files=files, \
+                        bytes=size + len(stdout or ''), created=str(datetime.now()))
+            if self.streamed is not None :
+                self.streamed.close()
+                os.rename(self.streamed.name, os.path.join(tmpDir, 'stdout'))
+                meta['stdout_file'] = True
+                meta['bytes'] += os.path.getsize(os.path.join(tmpDir, 'stdout'))
+            elif stdout is not None :
+                meta['stdout'] = stdout
+            with open(os.path.join(tmpDir, 'meta.json'), 'w') as fout :
+                json.dump(meta, fout)
+            if not os.path.isdir(os.path.dirname(self.entry)) :
+                os.makedirs(os.path.dirname(self.entry), exist_ok=True)
+            os.rename(tmpDir, self.entry)
+            _cacheStats['stored_bytes'] += meta['bytes']
+            if cachedCall.cacheSize is not None :
+                cachedCall.cacheSize += meta['bytes']
+        except (IOError, OSError) as e :
+            logger('Tool cache: cannot store {0} [{1}]: {2}'.format(self.prog, self.key[:12], e))
+        finally :
+            shutil.rmtree(tmpDir, ignore_errors=True)
+            self.discard()
+        # the entries are only scanned once per process, and again when the running size passes the limit
+        if cachedCall.cacheSize is None or cachedCall.cacheSize > self.maxSize :
+            self.evict()
+    def evict(self) :
+        '''remove least recently used entries until the cache fits in maxSize'''
+        entries = []
+        for meta in glob.glob(os.path.join(self.folder, '??', '*', 'meta.json')) :
+            try :
+                with open(meta) as fin :
+                    size = json.load(fin)['bytes']
+                entries.append([os.path.getmtime(os.path.dirname(meta)), size, os.path.dirname(meta)])
+            except (IOError, OSError, ValueError, KeyError) :
+                pass
+        total = sum(e[1] for e in entries)
+        for mtime, size, entry in sorted(entries) :
+            if total <= self.maxSize :
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            logger('Tool cache: evicted [{0}] ({1:.1f} MB)'.format(os.path.basename(entry)[:12], size/1048576.))
+        cachedCall.cacheSize = total
+
+def run_external(cmd, n_thread=1, stdout='capture', stderr='capture', onLine=None, retries=0, check=False, timeout=None, cache=None, **kwargs) :
+    '''Run an external program, drawing <n_thread> threads from the global budget for its lifetime.
+    cmd:      a list of arguments, or a string that is run through the shell
+    stdout:   'capture' (returned as text), None (inherited), or a filename / file object to write to
+    stderr:   'capture' or None
+    onLine:   a function called with each line of stdout as it is produced; stdout is not kept
+    retries:  number of re-runs after a non-zero exit; check: raise RuntimeError if it still fails
+    timeout:  seconds before the program and its children are terminated
+    cache:    dict(inputs=..., outputs=..., scratch=...) to reuse the result of an identical earlier call
+              if ${ETOKI_CACHE} is set (see cachedCall). A file given as <stdout> is an output by itself.
+    Wall, CPU and RSS of each call are added to the stage counters (see stage) under the program name.'''
+    shell = not isinstance(cmd, (list, tuple))
+    prog = os.path.basename((cmd.split() if shell else cmd)[0]).strip('"\'')
+    res, cacheOut = ExternalRun(cmd), None
+    if cache is not None and cachedCall.folder :
+        outputs = list(cache.get('outputs', [])) + ([stdout] if isinstance(stdout, str) and stdout != 'capture' else [])
+        cache = cachedCall([cmd], cache.get('inputs', []), outputs, cache.get('scratch', []))
+        cached = cache.restore()
+        if cached is not False :
+            res.returncode = 0
+            if cache.stdoutFile is not None :
+                with cache.stdoutFile as fin :
+                    if onLine :
+                        for line in fin :
+                            onLine(line)
+                    elif stdout == 'capture' :
+                        res.stdout = fin.read()
+                return res
+            res.stdout = cached if stdout == 'capture' and not onLine and cached is not True else None
+            if onLine and cached is not True :
+                for line in cached.splitlines(True) :
+                    onLine(line)
+            return res
+        if onLine :
+            # the streamed lines go to a file of the cache entry as they come, so that they are not kept in memory
+            try :
+                cacheOut, streamed = cache.streamStdout(), onLine
+                onLine = lambda line : (cacheOut.write(line), streamed(line))
+            except (IOError, OSError) :
+                cache = None
+    else :
+        cache = None
+    n_thread, p = externalThreads.acquire(n_thread), None
+    try :
+        while True :
+            res.tries += 1
+            if cacheOut is not None :
+                cacheOut.seek(0)
+                cacheOut.truncate()
+            fout = open(stdout, 'w') if isinstance(stdout, str) and stdout != 'capture' else None
+            t0 = time.time()
+            p = subprocess.Popen(cmd, shell=shell, universal_newlines=True, \
+                                 stdout=subprocess.PIPE if stdout == 'capture' or onLine else (fout or stdout), \
+                                 stderr=subprocess.PIPE if stderr == 'capture' else stderr, **kwargs)
+            timer = threading.Timer(timeout, _killTree, [p]) if timeout else None
+            if timer :
+                timer.start()
+            errs, outs = [], []
+            if p.stderr :
+                errReader = threading.Thread(target=lambda : errs.append(p.stderr.read()))
+                errReader.daemon = True
+                errReader.start()
+            if p.stdout :
+                for line in p.stdout :
+                    if onLine :
+                        onLine(line)
+                    else :
+                        outs.append(line)
+            if p.stderr :
+                errReader.join()
+            ru = None
+            try :
+                _, status, ru = os.wait4(p.pid, 0)
+                p.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+            except (AttributeError, ChildProcessError) :
+                p.wait()
+            if timer :
+                timer.cancel()
+            if fout :
+                fout.close()
+            res.returncode, res.wall = p.returncode, res.wall + time.time() - t0
+            res.stdout = ''.join(outs) if stdout == 'capture' and not onLine else None
+            res.stderr = ''.join(errs) if stderr == 'capture' else None
+            if ru is not None :
+                res.cpu += ru.ru_utime + ru.ru_stime
+                res.max_rss_mb = max(res.max_rss_mb, ru.ru_maxrss/1024.)
+            if res.returncode == 0 or res.tries > retries :
+                break
+            logger('{0} exited with {1}. Retry {2}/{3}'.format(prog, res.returncode, res.tries, retries))
+    finally :
+        # an exception (e.g. raised by onLine) leaves the program running; stop and reap it
+        if p is not None and p.poll() is None :
+            _killTree(p)
+            for pipe in (p.stdout, p.stderr) :
+                if pipe :
+                    pipe.close()
+            p.wait()
+        externalThreads.release(n_thread)
+        if cache is not None and res.returncode != 0 :
+            cache.discard()
+    countEvent('wall_s:' + prog, round(res.wall, 3))
+    countEvent('cpu_s:' + prog, round(res.cpu, 3))
+    addChildCpu(res.cpu)
+    if cache is not None and res.returncode == 0 :
+        cache.store(res.stdout)
+    if check and res.returncode != 0 :
+        raise RuntimeError('{0} failed with exit code {1}: {2}'.format(prog, res.returncode, (res.stderr or '').strip()[-1000:]))
+    return res
+
+
+def check_sys_path(cmd) :
+    for path in [''] + os.environ["PATH"].split(os.pathsep):
+        exe_file = os.path.join(path, cmd)
+        if os.path.exists(exe_file):
+            return exe_file
+    return None
+
 def getExecutable(commands) :
-    def check_sys_path(cmd) :
-        for path in [''] + os.environ["PATH"].split(os.pathsep):
-            exe_file = os.path.join(path, cmd)
-            if os.path.exists(exe_file):
-                return exe_file
-        return None
     try :
         cmd = check_sys_path(commands[-1])
         if not cmd  :
@@ -496,8 +1386,12 @@ def configure(args) :
     configs = load_configure()
     args = add_args(args)
 
+    if args.seqstore :
+        for fasta in args.seqstore :
+            buildSeqStore(fasta)
+        return
     for key, value in args.__dict__.items() :
-        if value is not None :
+        if value is not None and key != 'seqstore' :
             configs[configs.T[0] == key, 1] = value
     externals = prepare_externals(conf=configs)
     if args.install :
@@ -526,7 +1420,8 @@ def prepare_externals(conf=None) :
     externals = {k.strip():v.split('#')[0].strip().format(ETOKI=ETOKI) for k,v in conf.tolist()}
     externals['treetime'] = sys.executable + ' ' + externals.get('treetime', '')
     externals['enbler_filter'] = sys.executable + ' {ETOKI}/modules/_EnFlt.py'.format(ETOKI=ETOKI)
-    externals['pigz'] = getExecutable(['pigz'])[0] if getExecutable(['pigz']) else getExecutable(['gzip'])[0]
+    # resolved from PATH only: running the program here would cost every command a few subprocesses at import
+    externals['pigz'] = check_sys_path('pigz') or check_sys_path('gzip')
     return externals
 
 def add_args(a) :
@@ -535,6 +1430,7 @@ def add_args(a) :
     parser.add_argument('--usearch', dest='usearch', help='usearch is required for ortho and MLSType. A 32-bit version of usearch can be downloaded from https://www.drive5.com/usearch/', default=None)
     parser.add_argument('--download_krakenDB', help='When specified, miniKraken2 (8GB) will be downloaded into the EToKi folder. You can also use --link_krakenDB to use a pre-installed kraken2 database.', default=False, action='store_true')
     parser.add_argument('--link_krakenDB', dest='kraken_database', help='Kraken is optional in the assemble module. You can specify your own database here', default=None)
+    parser.add_argument('--seqstore', help='Build a memory-mapped 2-bit sequence store next to a FASTA file, which is then used by EToKi in place of the FASTA. This parameter can be specified multiple times', default=[], action='append')
     parser.add_argument('--path', '-p', help='Specify path to the 3rd party programs manually. Format: <program>=<path>. This parameter can be specified multiple times', default=[], action='append')
     args = parser.parse_args(a)
     for ps in args.path :
@@ -546,7 +1442,8 @@ def add_args(a) :
 def load_configure() :
     EnConf_file = os.path.realpath(__file__).rsplit('.', 1)[0] + '.ini'
     try :
-        return pd.read_csv(EnConf_file, sep='=', header=None).values
+        with open(EnConf_file, 'rt') as fin :
+            return np.array([ line.rstrip('\n').split('=', 1) for line in fin if line.strip() ], dtype=object).reshape(-1, 2)
     except :
         return np.array([0, 2], dtype=str)
     
@@ -1,8 +1,9 @@
-import sys, os, subprocess, re, pandas as pd, numpy as np
+import sys, os, re, numpy as np
 try :
-    from configure import externals
+    from configure import externals, lazyImport, run_external, StringIO
 except :
-    from .configure import externals
+    from .configure import externals, lazyImport, run_external, StringIO
+pd = lazyImport('pandas')
     
 crispolDB = os.path.join(os.path.dirname(__file__), 'CRISPOL.db')
 
@@ -111,13 +112,13 @@ def getCRISPOL(refs, regions) :
 
 def blast2region(qry, method='blastn', minIdentity=92, minCover=19) :
     if method in ('blastn', 'tblastn') :
-        subprocess.Popen('{makeblastdb} -dbtype nucl -in {0}'.format(qry, **externals).split(), stdout = subprocess.PIPE, stderr = subprocess.PIPE).communicate()
+        run_external('{makeblastdb} -dbtype nucl -in {0}'.format(qry, **externals).split())
     else :
-        subprocess.Popen('{makeblastdb} -dbtype prot -in {0}'.format(qry, **externals).split(), stdout = subprocess.PIPE, stderr = subprocess.PIPE).communicate()
-    blast = subprocess.Popen([externals[method], '-task', 'blastn', '-db', qry, '-query', crispolDB, '-outfmt', "6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue score qlen slen", \
-                              '-evalue', '0.1'], stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines=True)
+        run_external('{makeblastdb} -dbtype prot -in {0}'.format(qry, **externals).split())
+    blast = run_external([externals[method], '-task', 'blastn', '-db', qry, '-query', crispolDB, '-outfmt', "6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue score qlen slen", \
+                              '-evalue', '0.1'])
     
-    outputs = pd.read_csv(blast.stdout, sep='\t', header=None).values
+    outputs = pd.read_csv(StringIO(blast.stdout), sep='\t', header=None).values
     outputs = outputs[(outputs.T[2]>=minIdentity) & (outputs.T[7]-outputs.T[6]+1 >= minCover)]
     outputs[outputs.T[8]>outputs.T[9], 8:10] = -outputs[outputs.T[8]>outputs.T[9], 8:10]
     if method == 'tblastn' :
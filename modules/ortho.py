@@ -1,18 +1,19 @@
-import os, re, sys, shlex, ete3, tempfile, hashlib
+import os, re, sys, shlex, tempfile, hashlib
 from time import time
-import subprocess, numpy as np, pandas as pd, numba as nb
+import subprocess, numpy as np
 from operator import itemgetter
 import zipfile, io
 from copy import deepcopy
 from multiprocessing import Pool, Manager, Process
 try:
-    from configure import externals, logger, rc, transeq, readFasta, uopen, xrange, asc2int
+    from configure import externals, logger, rc, transeq, readFasta, uopen, xrange, asc2int, SeqBatch, lazyImport, lazyJit, run_external
     from clust import getClust
-    from uberBlast import uberBlast
+    from uberBlast import blastSeqs, blastParams
 except :
-    from .configure import externals, logger, rc, transeq, readFasta, uopen, xrange, asc2int
+    from .configure import externals, logger, rc, transeq, readFasta, uopen, xrange, asc2int, SeqBatch, lazyImport, lazyJit, run_external
     from .clust import getClust
-    from .uberBlast import uberBlast
+    from .uberBlast import blastSeqs, blastParams
+pd, ete3 = lazyImport('pandas'), lazyImport('ete3')
 
 params = dict(
     ml = '{fasttree} {0} -nt -gtr -pseudo', 
@@ -67,7 +68,7 @@ class MapBsn(object) :
         if gene in self.namelist :
             self.namelist -= set([gene])
             self.conn.close()
-            subprocess.Popen(['zip', '-d', self.fname, gene]).wait()
+            run_external(['zip', '-d', self.fname, gene], stdout=None, stderr=None)
             self.conn = zipfile.ZipFile(self.fname, mode='w', compression=zipfile.ZIP_DEFLATED,allowZip64=True)
         
     def pop(self, gene, default=None) :
@@ -226,12 +227,10 @@ def get_similar_pairs(prefix, clust, priorities, params) :
                     s_i += s
                 else :
                     s_j += s
-    if params['noDiamond'] :
-        self_bsn = uberBlast('-r {0} -q {0} --blastn --min_id {1} --min_cov {2} -t {3} --min_ratio {4} -e 3,3 -p --gtable {5}'.format(\
-            clust, params['match_identity'] - 0.1, params['match_frag_len']-10, params['n_thread'], params['match_frag_prop']-0.1, params['gtable']).split(), pool)
-    else :
-        self_bsn = uberBlast('-r {0} -q {0} --blastn --diamondSELF -s 1 --min_id {1} --min_cov {2} -t {3} --min_ratio {4} -e 3,3 -p --gtable {5}'.format(\
-            clust, params['match_identity'] - 0.1, params['match_frag_len']-10, params['n_thread'], params['match_frag_prop']-0.1, params['gtable']).split(), pool)
+    clustSeq = readFasta(clust)
+    self_bsn = blastSeqs(clustSeq, clustSeq, blastParams(blastn=True, diamondSELF=not params['noDiamond'], re_score=2 if params['noDiamond'] else 1, \
+        min_id=params['match_identity'] - 0.1, min_cov=params['match_frag_len']-10, n_thread=params['n_thread'], min_ratio=params['match_frag_prop']-0.1, \
+        fix_end=[3, 3], process=True, gtable=params['gtable']), pool)
     self_bsn.T[:2] = self_bsn.T[:2].astype(int)
     presence, ortho_pairs = {}, {}
     save = []
@@ -287,7 +286,7 @@ def get_similar_pairs(prefix, clust, priorities, params) :
         np.save(params['clust'].rsplit('.',1)[0] + '.npy', clu)
     return np.array([[k[0], k[1], v] for k, v in ortho_pairs.items()], dtype=int)
 
-@nb.jit('i8[:,:,:](u1[:,:], i8[:,:,:])', nopython=True)
+@lazyJit('i8[:,:,:](u1[:,:], i8[:,:,:])')
 def compare_seq(seqs, diff) :
     for id in np.arange(seqs.shape[0]) :
         s = seqs[id]
@@ -299,7 +298,7 @@ def compare_seq(seqs, diff) :
         diff[id, id+1:, 1] = n_comparable
     return diff
 
-@nb.jit('i8[:,:,:](u1[:,:], i8[:,:,:])', nopython=True)
+@lazyJit('i8[:,:,:](u1[:,:], i8[:,:,:])')
 def compare_seqX(seqs, diff) :
     for id in (0, seqs.shape[0]-1) :
         s = seqs[id]
@@ -402,8 +401,8 @@ def filt_per_group(data) :
                     tmpFile.write('>X{0}\n{1}\n{2}'.format(n, s, '\n'*ite).encode('utf-8'))
                 tmpFile.close()
                 cmd = params[params['orthology']].format(tmpFile.name, **params) if len(tags) < 500 else params['nj'].format(tmpFile.name, **params)
-                phy_run = subprocess.Popen(shlex.split(cmd), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-                gene_phy = ete3.Tree(phy_run.communicate()[0].replace("'", ''))
+                phy_run = run_external(shlex.split(cmd), stdin=subprocess.DEVNULL)
+                gene_phy = ete3.Tree(phy_run.stdout.replace("'", ''))
                 break
             except :
                 if ite == 2 :
@@ -721,18 +720,10 @@ def writeGenomes(fname, seqs) :
 
 def iter_map_bsn(data) :
     prefix, clust, id, taxon, seq, orthoGroup, old_prediction, params = data
-    gfile, out_prefix = '{0}.{1}.genome'.format(prefix, id), '{0}.{1}'.format(prefix, id)
-    with open(gfile, 'w') as fout :
-        for n, s in seq :
-            fout.write('>{0}\n{1}\n'.format(n, s) )
-
-    if params['noDiamond'] :
-        blastab, overlap = uberBlast('-r {0} -q {1} -f -m -O --blastn --min_id {2} --min_cov {3} --min_ratio {4} --merge_gap {5} --merge_diff {6} -t 2 -e 0,3 --gtable {7}'.format(\
-            gfile, clust, params['match_identity']-0.1, params['match_frag_len'], params['match_frag_prop'], params['link_gap'], params['link_diff'], params['gtable'] ).split())
-    else :
-        blastab, overlap = uberBlast('-r {0} -q {1} -f -m -O --blastn --diamond --min_id {2} --min_cov {3} --min_ratio {4} --merge_gap {5} --merge_diff {6} -t 2 -s 1 -e 0,3 --gtable {7}'.format(\
-            gfile, clust, params['match_identity']-0.1, params['match_frag_len'], params['match_frag_prop'], params['link_gap'], params['link_diff'], params['gtable'] ).split())
-    os.unlink(gfile)
+    out_prefix = '{0}.{1}'.format(prefix, id)
+    blastab, overlap = blastSeqs(dict(seq), clust, blastParams(filter=True, linear_merge=True, return_overlap=True, blastn=True, diamond=not params['noDiamond'], \
+        re_score=2 if params['noDiamond'] else 1, min_id=params['match_identity']-0.1, min_cov=params['match_frag_len'], min_ratio=params['match_frag_prop'], \
+        merge_gap=params['link_gap'], merge_diff=params['link_diff'], n_thread=2, fix_end=[0, 3], gtable=params['gtable'], dedup=True))
     blastab.T[:2] = blastab.T[:2].astype(int)
     
     # compare with old predictions
@@ -762,7 +753,7 @@ def iter_map_bsn(data) :
     groups.extend(list(groups2.values()))
     overlap = overlap[ids[overlap.T[0]] & ids[overlap.T[1]], :2]
     convA, convB = np.tile(-1, np.max(blastab.T[15])+1), np.tile(-1, np.max(blastab.T[15])+1)
-    seq = dict(seq)
+    seq = SeqBatch.fromItems(seq)
     for id, group in enumerate(groups) :
         group[4] = np.zeros(group[6][0][12], dtype=np.uint8)
         group[4].fill(0)
@@ -774,7 +765,7 @@ def iter_map_bsn(data) :
             convB[group[6].T[15].astype(int)] = id
         max_sc = []
         for tab in group[6] :
-            matchedSeq = seq[tab[1]][tab[8]-1:tab[9]] if tab[8] < tab[9] else rc(seq[tab[1]][tab[9]-1:tab[8]])
+            matchedSeq = seq.fetch(tab[1], tab[8]-1, tab[9]) if tab[8] < tab[9] else seq.fetch(tab[1], tab[9]-1, tab[8], reverse=True)
             ms, i, f, sc = [], 0, 0, [0, 0, 0]
             for s, t in re.findall(r'(\d+)([A-Z])', tab[14]) :
                 s = int(s)
@@ -786,9 +777,9 @@ def iter_map_bsn(data) :
                     i += s
                     f = (f-s)%3
                 else :
-                    ms.append('-'*s)
+                    ms.append(np.zeros(s, dtype=np.uint8))
                     f = (f+s)%3
-            x = baseConv[np.array(list(''.join(ms))).view(asc2int)]
+            x = baseConv[np.concatenate(ms)] if len(ms) else np.zeros(0, dtype=np.uint8)
             group[4][tab[6]-1:tab[6]+len(x)-1] = x
             sc = np.max(sc)
             r = 2./(1./(float(sc)/tab[12]) + 1./tab[10]) if float(sc)/tab[12] > tab[10] else float(sc)/tab[12]
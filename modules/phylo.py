@@ -1,20 +1,17 @@
 import shutil, gzip
-import subprocess
 
-from ete3 import Tree
-import sys, numpy as np, os, glob, re, argparse, resource
-from subprocess import Popen, PIPE
+import sys, numpy as np, os, glob, re, argparse
 from multiprocessing import Pool
 from time import sleep
 import random
-import pandas as pd
 
 rint = random.randint(0, 262144)
 
 try :
-    from configure import externals, uopen, asc2int, logger, readFasta
+    from configure import externals, uopen, asc2int, logger, readFasta, stage, memUsage, run_external, lazyImport
 except :
-    from .configure import externals, uopen, asc2int, logger, readFasta
+    from .configure import externals, uopen, asc2int, logger, readFasta, stage, memUsage, run_external, lazyImport
+pd, ete3 = lazyImport('pandas'), lazyImport('ete3')
 
 raxml = externals['raxml']
 
@@ -221,10 +218,9 @@ def run_rescale(prefix, tree, data, n_proc=5):
         else:
             cmd = '{0} -m ASC_GTR{5} -n {1} -t {8} -f e -D -s {2} -a {3} -T {6} -p {7} --asc-corr stamatakis --no-bfgs -q {4}'.format(
                     raxml, prefix, phy, weights, asc, 'GAMMA', n_proc, rint, tree)
-        run = Popen(cmd.split())
-        run.communicate()
+        run_external(cmd.split(), n_thread=n_proc, stdout=None, stderr=None)
 
-        tre = Tree('RAxML_result.{0}'.format(prefix), format=0)
+        tre = ete3.Tree('RAxML_result.{0}'.format(prefix), format=0)
         with open(phy+'.subtree', 'w') as fout :
             fout.write(tre.write(format=0)+'\n')
         for node in tre.get_descendants('postorder'):
@@ -244,7 +240,7 @@ def run_rescale(prefix, tree, data, n_proc=5):
             except:
                 pass
 
-    tre = Tree(tree, format=1)
+    tre = ete3.Tree(tree, format=1)
     leaves = set(tre.get_leaf_names())
     for node in tre.get_descendants('postorder'):
         if node.is_leaf():
@@ -280,16 +276,15 @@ def run_raxml(prefix, phy, weights, asc, model='CAT', n_proc=5, invariants=None)
             cmd = '{0} -m ASC_GTR{5} -n {1} -f D -D --no-bfgs -V -s {2} -a {3} -T {6} -p {7} --asc-corr=stamatakis -q {4}'.format(raxml, prefix, phy, weights, asc, model, n_proc, rint)
         else :
             cmd = '{0} -m ASC_GTR{5} -n {1} -f D -D --no-bfgs -s {2} -a {3} -T {6} -p {7} --asc-corr=stamatakis -q {4}'.format(raxml, prefix, phy, weights, asc, model, n_proc, rint)
-    run = Popen(cmd.split())
-    run.communicate()
+    run_external(cmd.split(), n_thread=n_proc, stdout=None, stderr=None)
     if model == 'CAT' and not os.path.isfile('RAxML_bestTree.{0}'.format(prefix)) :
         return run_raxml(prefix, phy, weights, asc, 'GAMMA', n_proc, invariants)
     
     cnt = sum(invariants.values())
     cmd = '{0} -m GTRCAT -n 2.{1} -f b -z RAxML_rellBootstrap.{1} -t RAxML_bestTree.{1}'.format(raxml, prefix)
-    Popen(cmd.split()).communicate()
+    run_external(cmd.split(), stdout=None, stderr=None)
     fname = '{0}.unrooted.nwk'.format(prefix)
-    tre = Tree('RAxML_bipartitions.2.{0}'.format(prefix), format=0)
+    tre = ete3.Tree('RAxML_bipartitions.2.{0}'.format(prefix), format=0)
     
     for node in tre.traverse() :
         if -0.5 < node.dist * cnt < 0.5 :
@@ -304,7 +299,7 @@ def run_raxml(prefix, phy, weights, asc, model='CAT', n_proc=5, invariants=None)
     return fname
 
 def get_root(prefix, tree_file) :
-    tree = Tree(tree_file, format=1)
+    tree = ete3.Tree(tree_file, format=1)
     for node in tree.traverse() :
         if node.dist == 0 and node.up and not node.is_leaf() :
             for c in node.get_children() :
@@ -353,7 +348,7 @@ def read_matrix(fname) :
             mat = mat.values
             logger('{0}\t{1}\t{2}\t{3}'.format(\
                 mat[0, 0], mat[0, 1], \
-                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, len(sites) ))
+                int(memUsage()), len(sites) ))
 
             for m in mat :
                 btype, bidx = np.unique(['-'] + m[cols].tolist(), return_inverse=True)
@@ -583,7 +578,7 @@ def remove_short_branch(tree) :
     return tree
 
 def infer_ancestral(prefix, tree, names, snps) :
-    tree = Tree(tree, format=1)
+    tree = ete3.Tree(tree, format=1)
     tree = remove_short_branch(tree)
 
     node_names = {}
@@ -608,9 +603,8 @@ def infer_ancestral(prefix, tree, names, snps) :
     tree.write(format=1, outfile=prefix + '.labelled.nwk')
     fastafile, invariants = write_fasta(prefix+'.anc', names, snps, writeIndel=True)
     if fastafile :
-        p = subprocess.Popen('{treetime} ancestral --aln {0} --tree {1}.labelled.nwk --outdir {1}.treetime --aa --reconstruct-tip-states'.format(
-            fastafile, prefix, **externals).split(), stdout=subprocess.PIPE)
-        p.communicate()
+        run_external('{treetime} ancestral --aln {0} --tree {1}.labelled.nwk --outdir {1}.treetime --aa --reconstruct-tip-states'.format(
+            fastafile, prefix, **externals).split(), stderr=None)
         if os.path.isfile(os.path.join('{0}.treetime'.format(prefix), 'ancestral_sequences.fasta')) :
             indels = readFasta(os.path.join('{0}.treetime'.format(prefix), 'ancestral_sequences.fasta'))
         elif os.path.isfile(os.path.join('{0}.treetime'.format(prefix), 'ancestral_sequences{}.fasta')) :
@@ -620,9 +614,8 @@ def infer_ancestral(prefix, tree, names, snps) :
 
     fastafile, invariants = write_fasta(prefix+'.anc', names, snps)
     if fastafile :
-        p = subprocess.Popen('{treetime} ancestral --aln {0} --tree {1}.labelled.nwk --outdir {1}.treetime --reconstruct-tip-states'.format(
-            fastafile, prefix, **externals).split(), stdout=subprocess.PIPE)
-        p.communicate()
+        run_external('{treetime} ancestral --aln {0} --tree {1}.labelled.nwk --outdir {1}.treetime --reconstruct-tip-states'.format(
+            fastafile, prefix, **externals).split(), stderr=None)
         if os.path.isfile(os.path.join('{0}.treetime'.format(prefix), 'ancestral_sequences.fasta')) :
             seqs = readFasta(os.path.join('{0}.treetime'.format(prefix), 'ancestral_sequences.fasta'))
         elif os.path.isfile(os.path.join('{0}.treetime'.format(prefix), 'ancestral_sequences{}.fasta')) :
@@ -718,7 +711,7 @@ def infer_ancestral3(tree, names, snps, sites, infer='margin', rescale=1.0) :
     if not pool :
         pool = Pool(5)
 
-    tree = Tree(tree, format=1)
+    tree = ete3.Tree(tree, format=1)
     node_names = {}
     for id, branch in enumerate(tree.traverse('postorder')) :
         digit = ''
@@ -788,9 +781,8 @@ def run_rapidnj(prefix, fastafile, invariants) :
     cnt = sum(invariants.values())
     ratio = invariants[-1]/cnt
     cmd = '{rapidnj} -i fa {0}'.format(fastafile, **externals)
-    run = Popen(cmd.split(), stdout=PIPE, universal_newlines=True)
-    tree = run.communicate()[0]
-    tre = Tree(tree, format=0)
+    tree = run_external(cmd.split(), stderr=None).stdout
+    tre = ete3.Tree(tree, format=0)
     
     fname = '{0}.unrooted.nwk'.format(prefix)
     for node in tre.traverse() :
@@ -807,9 +799,8 @@ def run_raxml_ng(prefix, fastafile, invariants, n_start) :
     inv = [invariants[65], invariants[67], invariants[71], invariants[84], ]
     cmd = '{raxml_ng} --thread 8 --redo --force --msa {0} --precision 8 --model GTR+G+ASC_STAM{{{1}}} --blmin 1e-8 --site-repeats on --tree pars{{{2}}}'.format(
         fastafile, '/'.join([str(int(x+0.5)) for x in inv]), n_start, **externals)
-    run = Popen(cmd.split(), universal_newlines=True)
-    run.communicate()
-    tre = Tree(fastafile+'.raxml.bestTree', format=0)
+    run_external(cmd.split(), n_thread=8, stdout=None, stderr=None)
+    tre = ete3.Tree(fastafile+'.raxml.bestTree', format=0)
     
     fname = '{0}.unrooted.nwk'.format(prefix)
     for node in tre.traverse() :
@@ -824,9 +815,8 @@ def run_iqtree(prefix, fastafile, invariants, n_proc):
     cnt = sum(invariants.values())
     inv = [str(int(invariants[65]+0.5)), str(int(invariants[67]+0.5)), str(int(invariants[71]+0.5)), str(int(invariants[84]+0.5)), ]
     cmd='{iqtree} -redo -fast --polytomy --runs 3 -fconst {2} -nt {1} -s {0} -m GTR+G '.format(fastafile, n_proc, ','.join(inv), **externals)
-    run = Popen(cmd.split(), universal_newlines=True)
-    run.communicate()
-    tre = Tree(fastafile + '.treefile', format=0)
+    run_external(cmd.split(), n_thread=n_proc, stdout=None, stderr=None)
+    tre = ete3.Tree(fastafile + '.treefile', format=0)
 
     fname = '{0}.unrooted.nwk'.format(prefix)
     for node in tre.traverse():
@@ -845,54 +835,60 @@ def phylo(args) :
     
     if 'matrix' in args.tasks :
         assert os.path.isfile( args.alignment )
-        args.snp = xFasta2Matrix( args.prefix, args.alignment, args.core )
+        with stage('matrix') :
+            args.snp = xFasta2Matrix( args.prefix, args.alignment, args.core )
         sleep(1)
     if 'rescale' in args.tasks or 'phylogeny' in args.tasks or 'ancestral' in args.tasks or 'ancestral_proportion' in args.tasks or 'mutation' in args.tasks :
         assert os.path.isfile( args.snp )
-        names, sites, snps, seqLens, missing = read_matrix(args.snp)
+        with stage('read_matrix') :
+            names, sites, snps, seqLens, missing = read_matrix(args.snp)
         if len(names) < 4 :
             raise ValueError('Taxa too few.')
 
     # build tree
     if 'phylogeny' in args.tasks :
-        args.tree = args.prefix+'.tre'
-        if not args.nj and args.raxml :
-            phy, weights, asc, invariants = write_phylip(args.tree, names, snps)
-            if phy != '' :
-                args.tree = run_raxml(args.tree, phy, weights, asc, 'CAT', args.n_proc, invariants)
+        with stage('phylogeny') :
+            args.tree = args.prefix+'.tre'
+            if not args.nj and args.raxml :
+                phy, weights, asc, invariants = write_phylip(args.tree, names, snps)
+                if phy != '' :
+                    args.tree = run_raxml(args.tree, phy, weights, asc, 'CAT', args.n_proc, invariants)
+                else :
+                    with open(args.tree, 'w') as fout :
+                        fout.write('({0}:0.0);'.format(':0.0,'.join(names)))
             else :
-                with open(args.tree, 'w') as fout :
-                    fout.write('({0}:0.0);'.format(':0.0,'.join(names)))
-        else :
-            fastafile, invariants = write_fasta(args.tree, names, snps)
-            if args.nj :
-                args.tree = run_rapidnj(args.tree, fastafile, invariants)
-            elif args.ng:
-                args.tree = run_raxml_ng(args.tree, fastafile, invariants, args.ng)
-            else:
-                args.tree = run_iqtree(args.tree, fastafile, invariants, args.n_proc)
-        args.tree = get_root(args.prefix, args.tree)
+                fastafile, invariants = write_fasta(args.tree, names, snps)
+                if args.nj :
+                    args.tree = run_rapidnj(args.tree, fastafile, invariants)
+                elif args.ng:
+                    args.tree = run_raxml_ng(args.tree, fastafile, invariants, args.ng)
+                else:
+                    args.tree = run_iqtree(args.tree, fastafile, invariants, args.n_proc)
+            args.tree = get_root(args.prefix, args.tree)
     elif 'rescale' in args.tasks or 'ancestral' in args.tasks or 'ancestral_proportion' in args.tasks :
-        tree = Tree(args.tree, format=1)
+        tree = ete3.Tree(args.tree, format=1)
 
     if 'rescale' in args.tasks :
-        args.tree, tree_in = args.prefix+'.tre', args.tree
-        data = write_phylips(args.tree, names, snps, n_split=4)
-        args.tree = run_rescale(args.tree, tree_in, data, args.n_proc)
-        args.tree = get_root(args.prefix, args.tree)
+        with stage('rescale') :
+            args.tree, tree_in = args.prefix+'.tre', args.tree
+            data = write_phylips(args.tree, names, snps, n_split=4)
+            args.tree = run_rescale(args.tree, tree_in, data, args.n_proc)
+            args.tree = get_root(args.prefix, args.tree)
 
     # map snp
     if 'ancestral' in args.tasks :
-        final_tree, node_names, states = infer_ancestral(args.prefix, args.tree, names, snps)
+        with stage('ancestral') :
+            final_tree, node_names, states = infer_ancestral(args.prefix, args.tree, names, snps)
         #final_tree, node_names, states = infer_ancestral(args.tree, names, snps, sites, infer='viterbi')
         #final_tree.write(format=1, outfile=args.prefix + '.labelled.nwk')
         write_states(args.prefix+'.ancestral_states.gz', node_names, states, sites, seqLens, missing)
     elif 'mutation' in args.tasks :
-        final_tree = Tree(args.tree, format=1)
+        final_tree = ete3.Tree(args.tree, format=1)
         node_names, states, sites = read_states(args.ancestral)
 
     if 'mutation' in args.tasks :
-        mutations = get_mut(final_tree, node_names, states, sites, args.snp)
+        with stage('mutation') :
+            mutations = get_mut(final_tree, node_names, states, sites, args.snp)
         with uopen(args.prefix + '.mutations.gz', 'w') as fout :
             for sl in seqLens :
                 fout.write('## Sequence_length: {0} {1}\n'.format(*sl))
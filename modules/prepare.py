@@ -1,26 +1,14 @@
-import os, io, sys, re, shutil, numpy as np, signal, psutil, argparse
+import os, io, sys, re, shutil, numpy as np, signal, argparse
 from glob import glob
-from subprocess import Popen, PIPE, STDOUT
 from time import sleep
-from threading import Timer
 try:
-    from .configure import externals, logger, readFasta
+    from .configure import externals, logger, readFasta, run_external
 except :
-    from configure import externals, logger, readFasta
+    from configure import externals, logger, readFasta, run_external
 
-def kill_child_proc (p) :
-    for child in psutil.Process(p.pid).children() :
-        child.terminate()
-
-def monitor_proc (p) :
-    timer = Timer(7200, kill_child_proc, [p])
-    output = None
-    try:
-        timer.start()
-        output = p.communicate()
-    finally: 
-        timer.cancel()
-    return p, output
+def monitor_proc (cmd, n_thread=1) :
+    p = run_external(cmd, n_thread=n_thread, timeout=7200)
+    return p, (p.stdout, p.stderr)
     
 
 # preprocessing
@@ -40,15 +28,14 @@ class preprocess(object) :
                 library_file = {'SE':['{0}.0.{1}.1.fastq.gz'.format(prefix, lib_id)]}
 
             if len(library_file.get('PE', [])) :
-                Popen('cat {0} > {1}'.format(' '.join([run[0] for run in library]), library_file['PE'][0]), shell=True).wait()
-                Popen('cat {0} > {1}'.format(' '.join([run[1] for run in library]), library_file['PE'][1]), shell=True).wait()
+                run_external('cat {0} > {1}'.format(' '.join([run[0] for run in library]), library_file['PE'][0]), stdout=None, stderr=None)
+                run_external('cat {0} > {1}'.format(' '.join([run[1] for run in library]), library_file['PE'][1]), stdout=None, stderr=None)
                 if 1: #parameters['repair'] :
                     library_file2 = {'PE':['{0}.1.{1}.x.fastq.gz'.format(prefix, lib_id), '{0}.1.{1}.y.fastq.gz'.format(prefix, lib_id)]}
                     reads = 'in={0} in2={1}'.format(*library_file['PE'])
                     outputs = 'out={0} out2={1}'.format(*library_file2['PE'])
                     bb_run, bb_out = monitor_proc(
-                        Popen('{repair} -Xmx{memory} overwrite=t ain=t {reads} {outputs}'.format(reads=reads, outputs=outputs, **parameters).split(), stdout=PIPE, stderr=PIPE, universal_newlines=True)
-                    )
+                        '{repair} -Xmx{memory} overwrite=t ain=t {reads} {outputs}'.format(reads=reads, outputs=outputs, **parameters).split(), parameters['n_cpu'])
                     if bb_run.returncode == 0 :
                         for fname in library_file['PE'] :
                             try:
@@ -67,9 +54,8 @@ class preprocess(object) :
                     reads = 'in={0} in2={1}'.format(*library_file['PE'])
                     outputs = 'out={0} outu1={1} outu2={2}'.format(library_file2['MP'][0], *library_file2['PE'])
                     bb_run, bb_out = monitor_proc(
-                        Popen('{bbmerge} -Xmx{memory} threads={n_cpu} ordered=t loose=t mininsert=25 mininsert0=23 qtrim2=t overwrite=t qout=33 entropy=t maxns=2 trimq={read_qual} {read} {outputs}'.format( \
-                            read=reads, outputs=outputs, **parameters).split(), stdout=PIPE, stderr=PIPE, universal_newlines=True)
-                    )
+                        '{bbmerge} -Xmx{memory} threads={n_cpu} ordered=t loose=t mininsert=25 mininsert0=23 qtrim2=t overwrite=t qout=33 entropy=t maxns=2 trimq={read_qual} {read} {outputs}'.format( \
+                            read=reads, outputs=outputs, **parameters).split(), parameters['n_cpu'])
                     if bb_run.returncode == 0 :
                         for fname in library_file['PE'] :
                             try:
@@ -91,14 +77,12 @@ class preprocess(object) :
                     outputs = 'out={1} out2={2} outs={0}'.format(library_file2['SE'][0], *library_file2['PE'])
                     if not parameters['reference'] :
                         bb_run, bb_out = monitor_proc(
-                            Popen('{bbduk} -Xmx{memory} threads={n_cpu} ordered=t ref=adapters ktrim=r overwrite=t refstats=PE.refstats qout=33 k=25 mink=13 minlength=23 tbo=t entropy=0.75 entropywindow=25 mininsert=23 maxns=2 trimq={read_qual} qtrim=rl {read} {outputs}'.format( \
-                                read=reads, outputs=outputs, **parameters).split(), stdout=PIPE, stderr=PIPE, universal_newlines=True)
-                        )
+                            '{bbduk} -Xmx{memory} threads={n_cpu} ordered=t ref=adapters ktrim=r overwrite=t refstats=PE.refstats qout=33 k=25 mink=13 minlength=23 tbo=t entropy=0.75 entropywindow=25 mininsert=23 maxns=2 trimq={read_qual} qtrim=rl {read} {outputs}'.format( \
+                                read=reads, outputs=outputs, **parameters).split(), parameters['n_cpu'])
                     else :
                         bb_run, bb_out = monitor_proc(
-                            Popen('{bbduk} -Xmx{memory} threads={n_cpu} ordered=t ktrim=r overwrite=t ref=adapters,{reference} refstats=PE.refstats qout=33 k=31 mink=13 minlength=23 tbo=t entropy=0.75 entropywindow=25 mininsert=23 maxns=2 trimq={read_qual} qtrim=rl {read} {outputs}'.format( \
-                                read=reads, outputs=outputs, **parameters).split(), stdout=PIPE, stderr=PIPE, universal_newlines=True)
-                        )
+                            '{bbduk} -Xmx{memory} threads={n_cpu} ordered=t ktrim=r overwrite=t ref=adapters,{reference} refstats=PE.refstats qout=33 k=31 mink=13 minlength=23 tbo=t entropy=0.75 entropywindow=25 mininsert=23 maxns=2 trimq={read_qual} qtrim=rl {read} {outputs}'.format( \
+                                read=reads, outputs=outputs, **parameters).split(), parameters['n_cpu'])
 
                     if bb_run.returncode == 0 :
                         with open('PE.refstats') as fin :
@@ -119,23 +103,19 @@ class preprocess(object) :
                                 pass
             if len(library_file.get('SE', [])) > 0 :
                 if len(library_file.get('PE', [])) == 0 :
-                    Popen('cat {0} > {1}'.format(' '.join([run[0] for run in library]), library_file['SE'][0]), shell=True).wait()
+                    run_external('cat {0} > {1}'.format(' '.join([run[0] for run in library]), library_file['SE'][0]), stdout=None, stderr=None)
                 if parameters['noTrim'] == False :
                     library_file2 = {'SE':['{0}.1.{1}.s.fastq.gz'.format(prefix, lib_id)]}
                 reads = 'in=' + library_file['SE'][0]
                 outputs = 'out=' + library_file2['SE'][0]
                 if not parameters['reference'] :
                     bb_run, bb_out = monitor_proc(
-                        Popen('{bbduk} -Xmx{memory} threads={n_cpu} ordered=t ref=adapters ktrim=r overwrite=t refstats=SE.refstats qout=33 k=25 mink=13 minlength=23 tbo=t entropy=0.75 entropywindow=25 mininsert=23 maxns=2 qtrim=rl trimq={read_qual} {read} {outputs}'.format( \
-                            read=reads, outputs=outputs, **parameters).split(), stdout=PIPE, stderr=PIPE, universal_newlines=True)
-                    )
+                        '{bbduk} -Xmx{memory} threads={n_cpu} ordered=t ref=adapters ktrim=r overwrite=t refstats=SE.refstats qout=33 k=25 mink=13 minlength=23 tbo=t entropy=0.75 entropywindow=25 mininsert=23 maxns=2 qtrim=rl trimq={read_qual} {read} {outputs}'.format( \
+                            read=reads, outputs=outputs, **parameters).split(), parameters['n_cpu'])
                 else :
                     bb_run, bb_out = monitor_proc(
-                        Popen(
-                            '{bbduk} -Xmx{memory} threads={n_cpu} ordered=t ktrim=r overwrite=t qout=33 k=31 ref=adapters,{reference} refstats=SE.refstats mink=13 minlength=23 tbo=t entropy=0.75 entropywindow=25 mininsert=23 maxns=2 qtrim=rl trimq={read_qual} {read} {outputs}'.format( \
-                                read=reads, outputs=outputs, **parameters).split(), stdout=PIPE, stderr=PIPE,
-                            universal_newlines=True)
-                    )
+                        '{bbduk} -Xmx{memory} threads={n_cpu} ordered=t ktrim=r overwrite=t qout=33 k=31 ref=adapters,{reference} refstats=SE.refstats mink=13 minlength=23 tbo=t entropy=0.75 entropywindow=25 mininsert=23 maxns=2 qtrim=rl trimq={read_qual} {read} {outputs}'.format( \
+                                read=reads, outputs=outputs, **parameters).split(), parameters['n_cpu'])
                 if bb_run.returncode == 0 :
                     for fname in library_file['SE'] :
                         try:
@@ -168,15 +148,15 @@ class preprocess(object) :
             for lib_type, library in libraries.items() :
                 stat[lib_type] = []
                 for fname in library :
-                    p = Popen("{pigz} -cd {0}|awk 'NR%4==2'|wc".format(fname, **externals), shell=True, stdout=PIPE, universal_newlines=True).communicate()[0].strip().split()
+                    p = run_external("{pigz} -cd {0}|awk 'NR%4==2'|wc".format(fname, **externals), stderr=None).stdout.strip().split()
                     n_base, n_read = int(p[2]) - int(p[1]), int(p[0])
                     read_information[0] += n_base
                     read_information[1] += n_read
                     bcomp = [[0, 0, 0, 0, 0] for i in range(10)]
-                    p = Popen("{pigz} -cd {0}|head -200000|awk 'NR%20==2'".format(fname, **externals), shell=True, stdout=PIPE, stderr=PIPE, universal_newlines=True)
-                    for line in p.stdout :
+                    def countBases(line) :
                         for b, bc in zip(line[:10], bcomp) :
                             bc[encode.get(b, 4)] += 1
+                    run_external("{pigz} -cd {0}|head -200000|awk 'NR%20==2'".format(fname, **externals), onLine=countBases)
                     seq_start = 0
                     for c in range(9, -1, -1) :
                         bc = bcomp[c]
@@ -221,19 +201,19 @@ class preprocess(object) :
                         if parameters['noRename'] == False :
                             if s[1] > 0 :
                                 logger('Remove potential barcode bases at the beginning {0} bps of reads in {1}'.format( s[1], lib ))
-                                Popen("{pigz} -cd {0}|awk '{{nr = int((NR-1)/4)}} {{id=(NR-1)%4}} int(nr*{2}) > int((nr-1)*{2}) {{if (id==1 || id == 3) {{print substr($0, {3}, 9999999)}} else {{if(id==0) {{print \"@{4}_{5}_\"nr}} else {{print \"+\"}} }} }}'|{pigz} > {1}".format(
-                                    lib, nlib, min(sample_freq, 1.), s[1]+1, lib_id, lib_type, **externals), shell=True).wait()
+                                run_external("{pigz} -cd {0}|awk '{{nr = int((NR-1)/4)}} {{id=(NR-1)%4}} int(nr*{2}) > int((nr-1)*{2}) {{if (id==1 || id == 3) {{print substr($0, {3}, 9999999)}} else {{if(id==0) {{print \"@{4}_{5}_\"nr}} else {{print \"+\"}} }} }}'|{pigz} > {1}".format(
+                                    lib, nlib, min(sample_freq, 1.), s[1]+1, lib_id, lib_type, **externals), stdout=None, stderr=None)
                             else :
-                                Popen("{pigz} -cd {0}|awk '{{nr = int((NR-1)/4)}} {{id=(NR-1)%4}} int(nr*{2}) > int((nr-1)*{2}) {{if (id==1 || id == 3) {{print $0}} else {{ if(id==0){{print \"@{4}_{5}_\"nr}} else {{print \"+\"}} }} }}'|{pigz} > {1}".format(
-                                    lib, nlib, min(sample_freq, 1.), s[1]+1, lib_id, lib_type, **externals), shell=True).wait()
+                                run_external("{pigz} -cd {0}|awk '{{nr = int((NR-1)/4)}} {{id=(NR-1)%4}} int(nr*{2}) > int((nr-1)*{2}) {{if (id==1 || id == 3) {{print $0}} else {{ if(id==0){{print \"@{4}_{5}_\"nr}} else {{print \"+\"}} }} }}'|{pigz} > {1}".format(
+                                    lib, nlib, min(sample_freq, 1.), s[1]+1, lib_id, lib_type, **externals), stdout=None, stderr=None)
                         else :
                             if s[1] > 0 :
                                 logger('Remove potential barcode bases at the beginning {0} bps of reads in {1}'.format( s[1], lib ))
-                                Popen("{pigz} -cd {0}|awk '{{nr = int((NR-1)/4)}} {{id=(NR-1)%4}} int(nr*{2}) > int((nr-1)*{2}) {{if (id==1 || id == 3) {{print substr($0, {3}, 9999999)}} else {{if(id==0) {{print $0}} else {{print \"+\"}} }} }}'|{pigz} > {1}".format(
-                                    lib, nlib, min(sample_freq, 1.), s[1]+1, lib_id, **externals), shell=True).wait()
+                                run_external("{pigz} -cd {0}|awk '{{nr = int((NR-1)/4)}} {{id=(NR-1)%4}} int(nr*{2}) > int((nr-1)*{2}) {{if (id==1 || id == 3) {{print substr($0, {3}, 9999999)}} else {{if(id==0) {{print $0}} else {{print \"+\"}} }} }}'|{pigz} > {1}".format(
+                                    lib, nlib, min(sample_freq, 1.), s[1]+1, lib_id, **externals), stdout=None, stderr=None)
                             else :
-                                Popen("{pigz} -cd {0}|awk '{{nr = int((NR-1)/4)}} {{id=(NR-1)%4}} int(nr*{2}) > int((nr-1)*{2}) {{if (id==1 || id == 3) {{print $0}} else {{ if(id==0){{print $0}} else {{print \"+\"}} }} }}'|{pigz} > {1}".format(
-                                    lib, nlib, min(sample_freq, 1.), s[1]+1, lib_id, **externals), shell=True).wait()
+                                run_external("{pigz} -cd {0}|awk '{{nr = int((NR-1)/4)}} {{id=(NR-1)%4}} int(nr*{2}) > int((nr-1)*{2}) {{if (id==1 || id == 3) {{print $0}} else {{ if(id==0){{print $0}} else {{print \"+\"}} }} }}'|{pigz} > {1}".format(
+                                    lib, nlib, min(sample_freq, 1.), s[1]+1, lib_id, **externals), stdout=None, stderr=None)
                 for lib in library :
                     try :
                         os.unlink(lib)
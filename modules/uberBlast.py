@@ -1,16 +1,15 @@
-import os, sys, tempfile, shutil, numpy as np, pandas as pd, re
-from numba import jit
-from subprocess import Popen, PIPE
+import os, sys, tempfile, shutil, hashlib, heapq, threading, time, zipfile, numpy as np, re
 from multiprocessing.pool import ThreadPool, Pool
-from operator import itemgetter
 try:
-    from .configure import externals, logger, xrange, readFastq, transeq, blosum62, rc, asc2int
+    from .configure import externals, logger, xrange, readFastq, iterFastq, loadSeqStore, SeqBatch, transeq, transeqBatch, transeqFrames, blosum62, rc, asc2int, stage, countEvent, run_external, cachedCall, lazyImport, lazyJit, reportTask, mergeReport
 except :
-    from configure import externals, logger, xrange, readFastq, transeq, blosum62, rc, asc2int
+    from configure import externals, logger, xrange, readFastq, iterFastq, loadSeqStore, SeqBatch, transeq, transeqBatch, transeqFrames, blosum62, rc, asc2int, stage, countEvent, run_external, cachedCall, lazyImport, lazyJit, reportTask, mergeReport
+pd = lazyImport('pandas')
 
 makeblastdb = externals['makeblastdb']
 blastn = externals['blastn']
 diamond = externals['diamond']
+minimap2 = externals['minimap2']
 
 def rev_transeq(s, transl_table=11):
     if transl_table == 4:
@@ -24,211 +23,385 @@ def rev_transeq(s, transl_table=11):
     return ''.join([rev_seq.get(x, '---') for x in s])
 
 
-def parseDiamond(data):
-    fn, refseq, qryseq, min_id, min_cov, min_ratio = data
-    blastab = []
-    if not os.path.isfile(fn) :
-        return None
-    with open(fn) as fin :
-        for line in fin:
-            if line.startswith('@'):
+def orfChunks(stops, length, size=1000) :
+    '''[start, end) of the chunks a translated frame of <length> is cut into for diamond. Each chunk runs to
+    the first stop ('X') at least <size> residues after its start; the tail shorter than that is the last chunk.'''
+    stops = np.append(stops, length)
+    chunks, start = [], 0
+    while length - start >= size :
+        end = stops[np.searchsorted(stops, start + size)] + 1
+        chunks.append([start, min(end, length)])
+        start = end
+    if start < length :
+        chunks.append([start, length])
+    return [ c for c in chunks if c[1] > c[0] ]
+
+def packedTake(starts, idx, *values) :
+    '''gather the segments <idx> of packed arrays (segment i is values[starts[i]:starts[i+1]]).
+    Returns the new starts followed by the gathered arrays.'''
+    lengths = (starts[1:] - starts[:-1])[idx]
+    newStarts = np.zeros(lengths.size+1, dtype=np.int64)
+    np.cumsum(lengths, out=newStarts[1:])
+    pos = np.repeat(starts[:-1][idx] - newStarts[:-1], lengths) + np.arange(newStarts[-1])
+    return [newStarts] + [ v[pos] for v in values ]
+
+class HitTable(object) :
+    '''uberBlast hits as a struct of arrays. Query and reference names are integer codes into the sorted
+    qryNames / refNames, so that sorting the codes sorts the names. CIGARs are packed: the operations of hit i
+    are cigarOp[cigarStart[i]:cigarStart[i+1]] (ASCII 'M', 'I', 'D') with lengths in cigarLen.
+    Hits grouped by linearMerge carry the score, identity and length of the group in grpInfo and the row ids
+    of its members in grpMembers[grpStart[i]:grpStart[i+1]].
+    toRows() gives the 16 (17 with groups) column object array that uberBlast returns.'''
+    columns = [['qry', np.int64], ['ref', np.int64], ['iden', np.float64], ['alnLen', np.int64], ['mism', np.int64], \
+               ['gapOpen', np.int64], ['qStart', np.int64], ['qEnd', np.int64], ['rStart', np.int64], ['rEnd', np.int64], \
+               ['evalue', np.float64], ['score', np.float64], ['qLen', np.int64], ['rLen', np.int64], ['rowId', np.int64]]
+    def __init__(self, qryNames, refNames, cols, cigarStart, cigarLen, cigarOp, intScore=True) :
+        self.qryNames, self.refNames = np.asarray(qryNames, dtype=object), np.asarray(refNames, dtype=object)
+        for (c, dtype), v in zip(self.columns, cols) :
+            setattr(self, c, np.asarray(v, dtype=dtype))
+        self.cigarStart, self.cigarLen, self.cigarOp = np.asarray(cigarStart, dtype=np.int64), \
+            np.asarray(cigarLen, dtype=np.int64), np.asarray(cigarOp, dtype=np.uint8)
+        # raw scores of blastn and diamond are integers; they are written as such until reScore
+        self.intScore = intScore
+        self.grpInfo = self.grpStart = self.grpMembers = None
+
+    @classmethod
+    def empty(cls) :
+        return cls([], [], [[]]*len(cls.columns), [0], [], [])
+    @classmethod
+    def fromColumns(cls, qry, ref, cols, cigarStart, cigarLen, cigarOp, intScore=True) :
+        '''build a table from query and reference names (one per hit) and the other columns in the order of
+        HitTable.columns. The rowId column may be left out.'''
+        qryNames, qryCode = np.unique(np.asarray(qry, dtype=object).astype(str), return_inverse=True)
+        refNames, refCode = np.unique(np.asarray(ref, dtype=object).astype(str), return_inverse=True)
+        cols = [qryCode, refCode] + list(cols)
+        if len(cols) < len(cls.columns) :
+            cols.append(np.arange(qryCode.size))
+        return cls(qryNames.astype(object), refNames.astype(object), cols, cigarStart, cigarLen, cigarOp, intScore)
+    @classmethod
+    def fromRows(cls, rows) :
+        '''convert a hit table in the legacy layout (object array of 15 or 16 columns; CIGARs as strings or
+        lists of [length, operation])'''
+        rows = np.asarray(rows, dtype=object)
+        if rows.shape[0] == 0 :
+            return cls.empty()
+        cigars = [ re.findall(r'(\d+)([A-Z])', c) if isinstance(c, str) else c for c in rows.T[14] ]
+        nOps = np.fromiter(map(len, cigars), dtype=np.int64, count=len(cigars))
+        cigarStart = np.concatenate([[0], np.cumsum(nOps)])
+        cigarLen = np.fromiter((int(n) for c in cigars for n, t in c), dtype=np.int64, count=cigarStart[-1])
+        cigarOp = np.frombuffer(''.join(t for c in cigars for n, t in c).encode('ascii'), dtype=np.uint8)
+        cols = [ rows.T[i].astype(dtype) for i, (c, dtype) in enumerate(cls.columns[2:14], 2) ]
+        if rows.shape[1] > 15 :
+            cols.append(rows.T[15].astype(np.int64))
+        return cls.fromColumns(rows.T[0], rows.T[1], cols, cigarStart, cigarLen, cigarOp, \
+                               intScore=all(isinstance(v, (int, np.integer)) for v in rows.T[11]))
+    @classmethod
+    def concat(cls, tables) :
+        '''merge tables, re-coding their names. Groups are not kept.'''
+        tables = [ t for t in tables if len(t) ]
+        if not tables :
+            return cls.empty()
+        qryNames = np.unique(np.concatenate([t.qryNames for t in tables]).astype(str)).astype(object)
+        refNames = np.unique(np.concatenate([t.refNames for t in tables]).astype(str)).astype(object)
+        cols = [ np.concatenate([np.searchsorted(qryNames, t.qryNames)[t.qry] for t in tables]), \
+                 np.concatenate([np.searchsorted(refNames, t.refNames)[t.ref] for t in tables]) ] + \
+               [ np.concatenate([getattr(t, c) for t in tables]) for c, dtype in cls.columns[2:] ]
+        cigarStart = np.concatenate([[0], np.cumsum(np.concatenate([np.diff(t.cigarStart) for t in tables]))])
+        return cls(qryNames, refNames, cols, cigarStart, np.concatenate([t.cigarLen for t in tables]), \
+                   np.concatenate([t.cigarOp for t in tables]), all(t.intScore for t in tables))
+
+    def __len__(self) :
+        return self.qry.size
+    def take(self, idx) :
+        '''a new table with the hits <idx> (indices or a boolean mask), in that order'''
+        idx = np.flatnonzero(idx) if np.asarray(idx).dtype == bool else np.asarray(idx, dtype=np.int64)
+        cigarStart, cigarLen, cigarOp = packedTake(self.cigarStart, idx, self.cigarLen, self.cigarOp)
+        res = HitTable(self.qryNames, self.refNames, [getattr(self, c)[idx] for c, dtype in self.columns], \
+                       cigarStart, cigarLen, cigarOp, self.intScore)
+        if self.grpInfo is not None :
+            grpStart, grpMembers = packedTake(self.grpStart, idx, self.grpMembers)
+            res.setGroups(self.grpInfo[idx], grpStart, grpMembers)
+        return res
+    def copy(self) :
+        return self.take(np.arange(len(self)))
+    def sortBy(self, *cols) :
+        '''a new table sorted by the named columns, the first being the primary key'''
+        return self.take(np.lexsort([getattr(self, c) for c in reversed(cols)]))
+    def setGroups(self, grpInfo, grpStart, grpMembers) :
+        self.grpInfo, self.grpStart, self.grpMembers = np.asarray(grpInfo, dtype=np.float64).reshape(-1, 3), \
+            np.asarray(grpStart, dtype=np.int64), np.asarray(grpMembers, dtype=np.int64)
+    def signedRef(self) :
+        '''reference coordinates with those of reverse-strand hits negated, so that they increase along the query'''
+        rev = self.rStart > self.rEnd
+        return np.where(rev, -self.rStart, self.rStart), np.where(rev, -self.rEnd, self.rEnd)
+    def cigar(self, i) :
+        '''CIGAR of hit i as a list of [length, operation]'''
+        s, e = self.cigarStart[i], self.cigarStart[i+1]
+        return [ [n, chr(t)] for n, t in zip(self.cigarLen[s:e].tolist(), self.cigarOp[s:e].tolist()) ]
+    def cigarStrings(self) :
+        lens, ops = self.cigarLen.astype(str).tolist(), self.cigarOp.tobytes().decode('ascii')
+        return [ ''.join(lens[j] + ops[j] for j in range(s, e)) for s, e in zip(self.cigarStart[:-1].tolist(), self.cigarStart[1:].tolist()) ]
+    def toRows(self) :
+        '''the legacy layout: an object array with columns qry, ref, iden, alnLen, mism, gapOpen, qStart, qEnd,
+        rStart, rEnd, evalue, score, qLen, rLen, CIGAR and rowId, plus the group of linearMerge if there is one'''
+        rows = np.empty([len(self), 16 if self.grpInfo is None else 17], dtype=object)
+        if not len(self) :
+            return rows
+        rows.T[0], rows.T[1] = self.qryNames[self.qry], self.refNames[self.ref]
+        for i, (c, dtype) in enumerate(self.columns[2:], 2) :
+            v = getattr(self, c)
+            if c == 'score' and self.intScore :
+                v = v.astype(np.int64)
+            rows.T[15 if c == 'rowId' else i] = v.tolist()
+        rows.T[14] = self.cigarStrings()
+        if self.grpInfo is not None :
+            members = self.grpMembers.tolist()
+            for i, (g, s, e) in enumerate(zip(self.grpInfo.tolist(), self.grpStart[:-1].tolist(), self.grpStart[1:].tolist())) :
+                rows[i, 16] = [int(g[0]) if self.intScore and g[0] == int(g[0]) else g[0], g[1], int(g[2])] + members[s:e] if g[0] == g[0] else []
+        return rows
+    def save(self, fname, overlap=None) :
+        '''write the table into a compressed npz: one typed array per column, the name tables and the packed
+        CIGARs and groups, plus the overlaps of returnOverlap if given. Read it back with readHits.'''
+        data = { c: getattr(self, c) for c, dtype in self.columns }
+        data.update(qryNames=self.qryNames.astype(str), refNames=self.refNames.astype(str), cigarStart=self.cigarStart, \
+                    cigarLen=self.cigarLen, cigarOp=self.cigarOp, intScore=np.array(self.intScore))
+        if self.grpInfo is not None :
+            data.update(grpInfo=self.grpInfo, grpStart=self.grpStart, grpMembers=self.grpMembers)
+        if overlap is not None :
+            data['overlap'] = np.asarray(overlap, dtype=np.int64).reshape(-1, 3)
+        # as np.savez_compressed, but with a fast compression level; np.load reads it
+        with zipfile.ZipFile(fname, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zout :
+            for key, value in data.items() :
+                with zout.open(key + '.npy', 'w', force_zip64=True) as fout :
+                    np.lib.format.write_array(fout, np.asanyarray(value), allow_pickle=False)
+    @classmethod
+    def load(cls, fname) :
+        '''a table written by save(), followed by the stored overlaps (None if there are none)'''
+        with np.load(fname) as data :
+            res = cls(data['qryNames'].astype(object), data['refNames'].astype(object), [ data[c] for c, dtype in cls.columns ], \
+                      data['cigarStart'], data['cigarLen'], data['cigarOp'], bool(data['intScore']))
+            if 'grpInfo' in data :
+                res.setGroups(data['grpInfo'], data['grpStart'], data['grpMembers'])
+            return res, (data['overlap'] if 'overlap' in data else None)
+
+
+@lazyJit
+def ovlSweep(ref, qry, rS, rE, qS, qE, score, coverage, delta, removed) :
+    '''the sweep of ovlFilter over hits sorted by reference, query, strand-signed reference start and query start.
+    Each hit is compared only with the hits that start before it ends on the same reference and query; a hit is
+    removed if another one covers <coverage> of it and scores at least <delta> more. Returns <removed>.'''
+    n = ref.size
+    toDel = np.empty(n, dtype=np.int64)
+    for i in range(n) :
+        if removed[i] :
+            continue
+        nDel = 0
+        for j in range(i+1, n) :
+            if removed[j] :
                 continue
-            part = line.strip().split('\t')
-            if part[2] == '*': continue
-            qn, qf = part[0].rsplit(':', 1)
-            rn, rf, rx = part[2].rsplit(':', 2)
-            rs = int(part[3]) + int(rx)
-            ql, rl = len(qryseq[str(qn)]), len(refseq[str(rn)])
-            qm = len(part[9])
-            if qm * 3 < min_cov: continue
-            cov_ratio = qm * 3. / ql
-            if cov_ratio < min_ratio: continue
-            cigar = [[int(n) * 3, t] for n, t in re.findall(r'(\d+)([A-Z])', part[5])]
-            cl = np.sum([c[0] for c in cigar])
-            variation = float(part[12][5:]) * 3 if part[12].startswith('NM:') else float(
-                re.findall('NM:i:(\d+)', line)[0]) * 3
-
-            iden = 1 - round(variation / cl, 3)
-            if iden < min_id: continue
-            qf, rf = int(qf), int(rf)
-            qs = int(part[18][5:]) if part[18].startswith('ZS:') else int(re.findall('ZS:i:(\d+)', line)[0])
-
-            rm = int(np.sum([c[0] for c in cigar if c[1] in {'M', 'D'}]) / 3)
-            if rf <= 3:
-                rs, r_e = rs * 3 + rf - 3, (rs + rm - 1) * 3 + rf - 1
-            else:
-                rs, r_e = rl - (rs * 3 + rf - 6) + 1, rl - ((rs + rm - 1) * 3 + rf - 4) + 1
-            if qf <= 3:
-                qs, qe = qs * 3 + qf - 3, (qs + qm - 1) * 3 + qf - 1
-            else:
-                qs, qe = ql - (qs * 3 + qf - 6) + 1, ql - ((qs + qm - 1) * 3 + qf - 4) + 1
-                qs, qe, rs, r_e = qe, qs, r_e, rs
-                cigar = list(reversed(cigar))
-
-            cd = [c[0] for c in cigar if c[1] != 'M']
-            score = int(part[14][5:]) if part[14].startswith('ZR:') else int(re.findall('ZR:i:(\d+)', line)[0])
-            blastab.append(
-                [qn, rn, iden, cl, int(variation - sum(cd)), len(cd), qs, qe, rs, r_e, 0.0, score, ql, rl, cigar])
-    try:
-        os.unlink(fn)
-    except :
-        pass
-
-    blastab = pd.DataFrame(blastab)
-    if blastab.size > 0:
-        blastab[[0, 1]] = blastab[[0, 1]].astype(str)
-        np.save(fn+'.match.npy', blastab.values, allow_pickle=True)
-        return fn + '.match.npy'
-    else :
-        return None
+            if qry[i] != qry[j] or ref[i] != ref[j] or rE[i] < rS[j] :
+                break
+            c = min(rE[i], rE[j]) - rS[j] + 1
+            if c >= coverage*(rE[i]-rS[i]+1) and score[j] - score[i] >= delta :
+                removed[i] = True
+                break
+            elif c >= coverage*(rE[j]-rS[j]+1) and score[i] - score[j] >= delta :
+                toDel[nDel] = j
+                nDel += 1
+            elif c >= (rE[i]-rS[i]+1) and c < coverage*(rE[j]-rS[j]+1) :
+                # i is nested in j on both sequences: i is kept and its scan ends here
+                c2 = min(qE[i], qE[j]) - max(qS[j], qS[i]) + 1
+                if c2 >= (qE[i]-qS[i]+1) and c2 < coverage*(qE[j]-qS[j]+1) :
+                    break
+            elif c >= (rE[j]-rS[j]+1) and c < coverage*(rE[i]-rS[i]+1) :
+                c2 = min(qE[i], qE[j]) - max(qS[j], qS[i]) + 1
+                if c2 >= (qE[j]-qS[j]+1) and c2 < coverage*(qE[i]-qS[i]+1) :
+                    toDel[nDel] = j
+                    nDel += 1
+        if not removed[i] :
+            for k in range(nDel) :
+                removed[toDel[k]] = True
+    return removed
 
 
-@jit(nopython=True)
-def tab2overlaps(tabs, ovl_l, ovl_p, nTab, overlaps) :
-    ovlId = 0
-    for i1 in xrange(overlaps[-1, 0], nTab) :
+@lazyJit(nogil=True)
+def tab2overlaps(tabs, ovl_l, ovl_p, s, e, offsets, overlaps) :
+    '''pairs of hits in <tabs> ([contig, rowId, start, end], sorted by contig, start and end) that overlap by at least
+    min(<ovl_l>, <ovl_p> of the first) or by <ovl_p> of the second, for the first hits in [s, e).
+    With <overlaps> empty, only the number of pairs of each first hit is written into <offsets>[i+1]; otherwise
+    the pairs of hit i are written as [rowId1, rowId2, overlap] into <overlaps> from <offsets>[i] on.'''
+    fill = overlaps.shape[0] > 0
+    for i1 in range(s, e) :
         t1 = tabs[i1]
         ovl_l2 = min(ovl_l, ovl_p*(t1[3]-t1[2]+1))
-        if i1 > overlaps[-1, 0] :
-            i2r = xrange(i1+1, nTab)
-        else :
-            i2r = xrange(overlaps[-1, 1], nTab)
-        for i2 in i2r :
+        k = offsets[i1] if fill else 0
+        for i2 in range(i1+1, tabs.shape[0]) :
             t2 = tabs[i2]
             if t1[0] != t2[0] or t2[2] > t1[3] : break
             ovl = min(t1[3], t2[3]) - t2[2] + 1
             if ovl >= ovl_l2 or ovl >= ovl_p*(t2[3]-t2[2]+1) :
-                overlaps[ovlId, :] = [t1[1], t2[1], ovl]
-                ovlId += 1
-                if ovlId == 1000000 :
-                    overlaps[-1, :2] = [i1, i2]
-                    break
-        if ovlId == 1000000 :
-            break
-    if ovlId < 1000000 :
-        overlaps[-1, :] = -1
-    return overlaps
-
-
-def _linearMerge(data) :
-    matches, params = data
-    grpCol = pd.Series(data= [[]] * matches.shape[0])
-    matches = np.hstack([matches, grpCol.values[:, np.newaxis]])
-    gapDist, lenDiff = params[1:]
-    gene, geneLen = matches[0][0], matches[0][12]
+                if fill :
+                    overlaps[k, 0], overlaps[k, 1], overlaps[k, 2] = t1[1], t2[1], ovl
+                k += 1
+        if not fill :
+            offsets[i1+1] = k
+    return offsets
+
+
+@lazyJit(nogil=True)
+def chainHits(qS, qE, rS, rE, ref, iden, score, qLen, rLen, starts, s, e, gapDist, lenDiff, kept, assigned, nodeFirst, nodeNext, nodeInfo, nodeSize) :
+    '''linearMerge of the query groups [s, e). Hits of the group g are [starts[g], starts[g+1]), sorted by
+    reference, strand-signed reference start (rS, rE) and query start.
+    Candidate groups are single hits, neighbouring pairs on one reference and pairs across the ends of two
+    contigs; they are taken greedily by score and chained when they share a hit. Each group is a linked list
+    of nodes (nodeFirst, nodeNext, with score, identity and length in nodeInfo and the number of members in
+    nodeSize) and <assigned> gives the node of every hit or -1. The hits to keep are written to <kept> in the
+    order of their selection, -1 marking the rest of the space of their query group.'''
     tailing = 20
-    
-    def resolve_edges(edges) :
-        grps = []
-        for id, m1 in edges[0] :
-            for jd, m2 in edges[1] :
-                if (m1[1] == m2[1] and max(abs(m1[8]), abs(m1[9])) > min(abs(m2[8]), abs(m2[9])) ) or \
-                   abs(m1[2]-m2[2]) > 0.3 or m1[6] >= m2[6] or m1[7] >= m2[7] or m2[6]-m1[7]-1 >= gapDist:
-                    continue
-                rLen = m2[7] - m1[6] + 1
-                g1 = -m1[9]-1 if m1[9] < 0 else m1[13] - m1[9]
-                g2 =  m2[8]-1 if m2[8] > 0 else m2[13] + m2[8]
-                qLen = m1[9]-m1[8]+1 + m2[9]-m2[8]+1 + g1 + g2
-                if g1+g2 >= gapDist or min(rLen, qLen)*lenDiff < max(rLen, qLen) :
+    for g in range(s, e) :
+        b0, n = starts[g], starts[g+1] - starts[g]
+        # candidate groups [score, identity, length, flag, first, second]; empty lists typed by slicing
+        gS, gI, gL, gF, gA, gB = [0.][:0], [0.][:0], [0][:0], [0][:0], [0][:0], [0][:0]
+        edge0, edge1 = [0][:0], [0][:0]
+        for i in range(b0, b0+n) :
+            rLen1 = qE[i] - qS[i] + 1
+            gS.append(score[i]); gI.append(iden[i]); gL.append(rLen1); gF.append(0); gA.append(i-b0); gB.append(-1)
+            if qS[i] > tailing and ((rS[i] > 0 and rS[i] - 1 <= gapDist) or (rS[i] < 0 and rLen[i] + rS[i] < gapDist)) :
+                edge1.append(i)
+            if qE[i] > qLen[i] - tailing :
+                continue
+            if (rS[i] > 0 and rLen[i] - rE[i] <= gapDist) or (rS[i] < 0 and -1 - rE[i] < gapDist) :
+                edge0.append(i)
+            for j in range(i+1, b0+n) :
+                # neighbouring hits on the same reference and strand, at most gapDist apart
+                if ref[i] != ref[j] or (rS[i] < 0 and rS[j] > 0) or rS[j] - rE[i] - 1 >= gapDist :
+                    break
+                l1, l2 = qE[j] - qS[i] + 1, rE[j] - rS[i] + 1
+                if abs(iden[i] - iden[j]) > 0.3 or rS[i]+3 >= rS[j] or rE[i]+3 >= rE[j] or qS[i]+3 >= qS[j] or qE[i]+3 >= qE[j] \
+                   or qS[j] - qE[i] - 1 >= gapDist or min(l1, l2)*lenDiff < max(l1, l2) :
                     continue
-                overlap = sorted([m1[7] - m2[6] + 1, -g1-g2], reverse=True)
-
-                rLen1, rLen2 = m1[7] - m1[6] + 1, m2[7] - m2[6] + 1
-                if overlap[0] > 0 :
-                    score = m1[11] + m2[11] - overlap[0] * min( float(m1[11])/rLen1, float(m2[11])/rLen2 )
-                    ident = (m1[2]*rLen1 + m2[2]*rLen2 - overlap[0] * min(m1[2], m2[2]))/(rLen1 + rLen2 - overlap[0])
+                rLen2 = qE[j] - qS[j] + 1
+                o0, o1 = max(qE[i]-qS[j]+1, rE[i]-rS[j]+1), min(qE[i]-qS[j]+1, rE[i]-rS[j]+1)
+                if o0 > 0 :
+                    sc = score[i] + score[j] - o0 * min(score[i]/rLen1, score[j]/rLen2)
+                    idn = (iden[i]*rLen1 + iden[j]*rLen2 - o0*min(iden[i], iden[j]))/(rLen1 + rLen2 - o0)
                 else :
-                    score = m1[11] + m2[11]
-                    ident = (m1[2]*rLen1 + m2[2]*rLen2)/(rLen1 + rLen2)
-                if overlap[1] < 0 :
-                    score +=  overlap[1]/3.
-                if score > m1[11] and score > m2[11] :
-                    grps.append( [ score, ident, rLen, 1, id, jd ] )
-        return grps
-    
-    groups = []
-    prev, edges = matches[0][1], [[], []]
-    nSave = len(matches)
-    
-    for id, m1 in enumerate(matches) :
-        rLen1 = m1[7] - m1[6] + 1
-        groups.append([ m1[11], m1[2], rLen1, 0, id ])
-        if m1[6] > tailing and ((m1[8] > 0 and m1[8] - 1 <= gapDist) or (m1[8] < 0 and m1[13] + m1[8] < gapDist)) :   # any hit within the last 300 bps to either end of a scaffold is a potential fragmented gene
-            edges[1].append([id, m1])
-        if m1[7] <= m1[12] - tailing :
-            if (m1[8] > 0 and m1[13]-m1[9] <= gapDist) or (m1[8] < 0 and -1-m1[9] < gapDist) :
-                edges[0].append([id, m1])
-            for jd in xrange(id+1, nSave) :
-                m2 = matches[jd]
-                if m1[1] != m2[1] or (m1[8] < 0 and m2[8] > 0) or m2[8] - m1[9] -1 >= gapDist :    # maximum 600bps between two continuous hits in the same scaffold
-                    break
-                rLen, qLen = m2[7]-m1[6]+1, m2[9]-m1[8]+1
-                if abs(m1[2]-m2[2]) > 0.3 or m1[8]+3 >= m2[8] or m1[9]+3 >= m2[9] or m1[6]+3 >= m2[6] or m1[7]+3 >= m2[7] or m2[6] - m1[7] -1 >= gapDist \
-                   or min(rLen, qLen)*lenDiff < max(rLen, qLen) :
+                    sc = score[i] + score[j]
+                    idn = (iden[i]*rLen1 + iden[j]*rLen2)/(rLen1 + rLen2)
+                if o1 < 0 :
+                    sc += o1/3.
+                if sc > score[i] and sc > score[j] :
+                    gS.append(sc); gI.append(idn); gL.append(l1); gF.append(0); gA.append(i-b0); gB.append(j-b0)
+        # a hit close to the end of one contig followed by a hit close to the start of another
+        for i in edge0 :
+            for j in edge1 :
+                if (ref[i] == ref[j] and max(abs(rS[i]), abs(rE[i])) > min(abs(rS[j]), abs(rE[j]))) or \
+                   abs(iden[i] - iden[j]) > 0.3 or qS[i] >= qS[j] or qE[i] >= qE[j] or qS[j] - qE[i] - 1 >= gapDist :
+                    continue
+                l1 = qE[j] - qS[i] + 1
+                d1 = -rE[i] - 1 if rE[i] < 0 else rLen[i] - rE[i]
+                d2 = rS[j] - 1 if rS[j] > 0 else rLen[j] + rS[j]
+                l2 = rE[i] - rS[i] + 1 + rE[j] - rS[j] + 1 + d1 + d2
+                if d1 + d2 >= gapDist or min(l1, l2)*lenDiff < max(l1, l2) :
                     continue
-                rLen2 = m2[7] - m2[6] + 1
-                overlap = sorted([m1[7]-m2[6]+1, m1[9]-m2[8]+1], reverse=True)
-                if overlap[0] > 0 :
-                    score = m1[11] + m2[11] - overlap[0] * min( float(m1[11])/rLen1, float(m2[11])/rLen2 )
-                    ident = (m1[2]*rLen1 + m2[2]*rLen2 - overlap[0]*min(m1[2], m2[2]))/(rLen1 + rLen2 - overlap[0])
+                o0, o1 = max(qE[i]-qS[j]+1, -d1-d2), min(qE[i]-qS[j]+1, -d1-d2)
+                rLen1, rLen2 = qE[i] - qS[i] + 1, qE[j] - qS[j] + 1
+                if o0 > 0 :
+                    sc = score[i] + score[j] - o0 * min(score[i]/rLen1, score[j]/rLen2)
+                    idn = (iden[i]*rLen1 + iden[j]*rLen2 - o0*min(iden[i], iden[j]))/(rLen1 + rLen2 - o0)
                 else :
-                    score = m1[11] + m2[11]
-                    ident = (m1[2]*rLen1 + m2[2]*rLen2)/(rLen1 + rLen2)
-                if overlap[1] < 0 :
-                    score +=  overlap[1]/3.
-                if score > m1[11] and score > m2[11] :
-                    groups.append( [ score, ident, rLen, 0, id, jd ] )
-    if len(edges[0]) and len(edges[1]) :
-        groups.extend(resolve_edges(edges))
-    if len(groups) > len(matches) :
-        groups.sort(reverse=True)
-        usedMatches, usedGroups = {}, []
-        for grp in groups :
-            if (grp[4], 4) in usedMatches or (grp[-1], 5) in usedMatches :
+                    sc = score[i] + score[j]
+                    idn = (iden[i]*rLen1 + iden[j]*rLen2)/(rLen1 + rLen2)
+                if o1 < 0 :
+                    sc += o1/3.
+                if sc > score[i] and sc > score[j] :
+                    gS.append(sc); gI.append(idn); gL.append(l1); gF.append(1); gA.append(i-b0); gB.append(j-b0)
+
+        nNode, k = 3*b0, b0
+        if len(gS) == n :
+            # no pairs: every hit is kept as a group of its own
+            for i in range(n) :
+                nodeFirst[nNode], nodeNext[nNode], nodeSize[nNode] = b0+i, -1, 1
+                nodeInfo[nNode, 0], nodeInfo[nNode, 1], nodeInfo[nNode, 2] = gS[i], gI[i], gL[i]
+                if gI[i] >= 0 :
+                    assigned[b0+i] = nNode
+                kept[b0+i] = i
+                nNode += 1
+            continue
+        # groups in descending order of [score, identity, length, flag, first, second]; a single hit comes after any pair it starts
+        nG = len(gS)
+        order = np.argsort(np.array(gB), kind='mergesort')
+        order = order[np.argsort(np.array(gA)[order], kind='mergesort')]
+        order = order[np.argsort(np.array(gF)[order], kind='mergesort')]
+        order = order[np.argsort(np.array(gL)[order], kind='mergesort')]
+        order = order[np.argsort(np.array(gI)[order], kind='mergesort')]
+        order = order[np.argsort(np.array(gS)[order], kind='mergesort')]
+        # a hit can end (used4) and start (used5) one group each; -1 unused, 0 skipped over, 1 used
+        used4, used5 = np.full(n, -1, dtype=np.int8), np.full(n, -1, dtype=np.int8)
+        inKept = np.zeros(n, dtype=np.bool_)
+        uNode, uFirst, uLast = np.empty(n, dtype=np.int64), np.empty(n, dtype=np.int64), np.empty(n, dtype=np.int64)
+        nU = 0
+        for x in range(nG-1, -1, -1) :
+            o = order[x]
+            a, b = gA[o], gA[o] if gB[o] < 0 else gB[o]
+            if used4[a] >= 0 or used5[b] >= 0 :
                 continue
-            if grp[3] > 0 :
-                if (grp[4], 5) in usedMatches or (grp[-1], 4) in usedMatches :
-                    continue
-            if grp[4] != grp[-1] :
-                lMat, rMat = matches[grp[4]], matches[grp[-1]]
-                il, im = sorted([grp[4], grp[-1]])
-                skp = 0
-                for i in xrange(il+1, im) :
-                    if matches[i][1] in {lMat[1], rMat[1]} :
-                        if (i, 4) in usedMatches or (i, 5) in usedMatches :
-                            skp = 1
-                            break
-                if skp :
+            if gF[o] > 0 and (used5[a] >= 0 or used4[b] >= 0) :
+                continue
+            if a != b :
+                il, im = min(a, b), max(a, b)
+                skip = False
+                for i in range(il+1, im) :
+                    if (ref[b0+i] == ref[b0+a] or ref[b0+i] == ref[b0+b]) and (used4[i] >= 0 or used5[i] >= 0) :
+                        skip = True
+                        break
+                if skip :
                     continue
-                for i in xrange(il+1, im) :
-                    if matches[i][1] in {lMat[1], rMat[1]} :
-                        usedMatches[(i, 4)] = usedMatches[(i, 5)] = 0
-            usedGroups.append(grp)
-            usedMatches[(grp[4], 4)] = usedMatches[(grp[-1], 5)] = 1
-            if grp[3] > 0 :
-                usedMatches[(grp[4], 5)] = usedMatches[(grp[-1], 4)] = 1
-
-        usedGroups.sort(key=itemgetter(4), reverse=True)
-        for gId in xrange(len(usedGroups)-1) :
-            g1, g2 = usedGroups[gId:gId+2]
-            if g1[4] == g2[-1] :
-                m = matches[g1[4]]
-                score = g1[0] + g2[0] - m[11]
-                length = g1[2] + g2[2] - (m[7]-m[6]+1)
-                iden = (g1[1]*g1[2] + g2[1]*g2[2] - min(g1[1],g2[1])*(m[7]-m[6]+1))/length
-                usedGroups[gId+1] = [score, iden, length, 0, g2[4]] + g1[4:]
-                g1[1] = -1
-    else :
-        usedGroups = groups
-        usedMatches = {(k, k): 1 for k in np.arange(matches.shape[0])}
-    for g in usedGroups :
-        if g[1] >= 0 :
-            ids = [matches[i][15] for i in g[4:]]
-            for i in g[4:] :
-                matches[i, -1] = g[:3] + ids
-    ids = { k[0] for k, v in usedMatches.items() if v == 1 }
-    matches = matches[np.array(list(ids))]
-    return matches
+                for i in range(il+1, im) :
+                    if ref[b0+i] == ref[b0+a] or ref[b0+i] == ref[b0+b] :
+                        used4[i], used5[i] = 0, 0
+            used4[a], used5[b] = 1, 1
+            if gF[o] > 0 :
+                used5[a], used4[b] = 1, 1
+            for i in (a, b) :
+                if not inKept[i] :
+                    inKept[i] = True
+                    kept[k] = i
+                    k += 1
+            nodeFirst[nNode], nodeInfo[nNode, 0], nodeInfo[nNode, 1], nodeInfo[nNode, 2] = b0+a, gS[o], gI[o], gL[o]
+            if a != b :
+                nodeNext[nNode], nodeSize[nNode] = nNode+1, 2
+                nodeFirst[nNode+1], nodeNext[nNode+1], nodeSize[nNode+1] = b0+b, -1, 1
+            else :
+                nodeNext[nNode], nodeSize[nNode] = -1, 1
+            uNode[nU], uFirst[nU], uLast[nU] = nNode, a, b
+            nU += 1
+            nNode += 1 if a == b else 2
+        for i in range(k, b0+n) :
+            kept[i] = -1
+        # chain the groups that share a hit, in descending order of their first hits
+        uOrder = np.argsort(-uFirst[:nU], kind='mergesort')
+        for x in range(nU-1) :
+            g1, g2 = uOrder[x], uOrder[x+1]
+            if uFirst[g1] == uLast[g2] :
+                n1, n2, m = uNode[g1], uNode[g2], b0 + uFirst[g1]
+                mLen = qE[m] - qS[m] + 1
+                length = nodeInfo[n1, 2] + nodeInfo[n2, 2] - mLen
+                nodeFirst[nNode], nodeNext[nNode], nodeSize[nNode] = nodeFirst[n2], n1, nodeSize[n1] + 1
+                nodeInfo[nNode, 0] = nodeInfo[n1, 0] + nodeInfo[n2, 0] - score[m]
+                nodeInfo[nNode, 1] = (nodeInfo[n1, 1]*nodeInfo[n1, 2] + nodeInfo[n2, 1]*nodeInfo[n2, 2] - min(nodeInfo[n1, 1], nodeInfo[n2, 1])*mLen)/length
+                nodeInfo[nNode, 2] = length
+                uNode[g2] = nNode
+                nodeInfo[n1, 1] = -1
+                nNode += 1
+        for x in range(nU) :
+            nd = uNode[uOrder[x]]
+            if nodeInfo[nd, 1] >= 0 :
+                i = nd
+                while i >= 0 :
+                    assigned[nodeFirst[i]] = nd
+                    i = nodeNext[i]
+    return kept
 
 
 def cigar2score(data) :
@@ -280,46 +453,530 @@ def cigar2score(data) :
             nTotal = qAA.size * 3. + bGap-mGap
             score = np.sum(blosum62[(qAA << 5) + rAA])
             return nMatch/nTotal, score - nGap*(gapOpen-gapExtend) - (bGap)*gapExtend
-nucEncoder = np.repeat(2, 255).astype(int)
+nucEncoder = np.repeat(2, 256).astype(np.int8)
 nucEncoder[(np.array(['A', 'C', 'G', 'T']).view(asc2int),)] = (0, 1, 3, 4)
 gtable = np.array(list('KNXKNTTXTTXXXXXRSXRSIIXMIQHXQHPPXPPXXXXXRRXRRLLXLLXXXXXXXXXXXXXXXXXXXXXXXXXEDXEDAAXAAXXXXXGGXGGVVXVVXYXXYSSXSSXXXXXXCXWCLFXLF')).view(asc2int).astype(int)-65
 
-def poolBlast(params) :
-    def parseBlast(fn, min_id, min_cov, min_ratio) :
-        try:
-            blastab = pd.read_csv(fn, sep='\t',header=None, dtype=str)
-        except :
-            return None
-        blastab[[2, 10]] = blastab[[2, 10]].astype(float)
-        blastab[[3, 4, 5, 6, 7, 8, 9, 11, 12, 13]] = blastab[[3, 4, 5, 6, 7, 8, 9, 11, 12, 13]].astype(int)
-        blastab[2] /= 100.
-        blastab = blastab[(blastab[2] >= min_id) & (blastab[7]-blastab[6]+1 >= min_cov) & (blastab[7]-blastab[6]+1 >= min_ratio*blastab[12]) ]
-        if blastab.shape[0] <= 0 :
-            return None
+@lazyJit(nogil=True, error_model='numpy')
+def cigarScores(s, e, cigarStart, cigarLen, cigarOp, refBuf, refPos, refLen, rev, qryBuf, qryPos, qryLen, qStart, mode, gapOpen, gapExtend, gtable, blosum, iden, score) :
+    '''compiled cigar2score for hits [s, e) of a HitTable. The reference and query windows of hit i are
+    refBuf[refPos[i]:refPos[i]+refLen[i]] (reverse-complemented if rev[i]) and qryBuf[qryPos[i]:qryPos[i]+qryLen[i]].
+    The alignment is walked once without building the aligned arrays; the arithmetic follows cigar2score
+    step by step so that both give identical results.'''
+    for i in range(s, e) :
+        c0, c1 = cigarStart[i], cigarStart[i+1]
+        frame = (qStart[i]-1) % 3
+        alnLen = 0
+        for k in range(c0, c1) :
+            if cigarOp[k] == 77 or (cigarOp[k] == 73 and mode > 1) :
+                alnLen += cigarLen[k]
+        usable = max(alnLen - frame, 0)
+        usable -= usable % 3
+        nGap, bGap, mGap = 0, 0, 0
+        nAln, nMatch, nRef, nCodon, aaMatch = 0, 0, 0, 0, 0
+        m0, m1, m2, aaScore = 0, 0, 0, 0.
+        qc, rc, bad = 0, 0, False
+        p, rId, qId = 0, 0, 0
+        for k in range(c0, c1) :
+            op, n = cigarOp[k], cigarLen[k]
+            if op != 77 and op != 68 and op != 73 :
+                continue
+            if op == 68 or op == 73 :
+                nGap += 1
+                bGap += n
+                if n > 3 :
+                    mGap += n
+                if op == 68 :
+                    rId += n
+                    continue
+                if mode == 1 :
+                    qId += n
+                    continue
+            for j in range(n) :
+                q = qryBuf[qryPos[i]+qId+j] if qId+j < qryLen[i] else 2
+                if op == 73 :
+                    r = -1
+                elif rId+j >= refLen[i] :
+                    r = 2
+                elif rev[i] :
+                    r = 4 - refBuf[refPos[i]+refLen[i]-1-rId-j]
+                else :
+                    r = refBuf[refPos[i]+rId+j]
+                if mode == 1 :
+                    nAln += 1
+                    if q == r :
+                        nMatch += 1
+                elif p >= frame and p < frame + usable :
+                    c = (p - frame) % 3
+                    if mode == 3 :
+                        if q == r :
+                            if c == 0 :
+                                m0 += 1
+                            elif c == 1 :
+                                m1 += 1
+                            else :
+                                m2 += 1
+                        if r >= 0 :
+                            nRef += 1
+                    else :
+                        if c == 0 :
+                            qc, rc, bad = 0, 0, False
+                        qc = qc*5 + q
+                        rc = rc*5 + r
+                        if r < 0 :
+                            bad = True
+                        if c == 2 and not bad :
+                            qa, ra = gtable[qc], gtable[rc]
+                            nCodon += 1
+                            if qa == ra :
+                                aaMatch += 1
+                            aaScore += blosum[(qa << 5) + ra]
+                p += 1
+            if op == 77 :
+                rId += n
+            qId += n
+        if mode == 1 :
+            nMismatch = nAln - nMatch
+            iden[i] = float(nMatch)/(nMatch + nMismatch + bGap - mGap)
+            score[i] = nMatch*3 - nMismatch*1 - nGap*(gapOpen-gapExtend) - bGap*gapExtend
+        elif mode == 3 :
+            nm = m0*(9./7.) + m1*(9./7.) + m2*(3./7.)
+            nMismatch = nRef - nm
+            iden[i] = nm/(nm + nMismatch + bGap - mGap)
+            score[i] = nm*3 - nMismatch*1 - nGap*(gapOpen-gapExtend) - bGap*gapExtend
         else :
-            blastab[14] = list(map(getCIGAR, zip(blastab[15], blastab[14])))
-        blastab = blastab.drop(columns=[15])
-        #blastab[[0, 1]] = blastab[[0, 1]].astype(str)
+            iden[i] = (aaMatch*3.)/(nCodon*3. + bGap - mGap)
+            score[i] = aaScore - nGap*(gapOpen-gapExtend) - bGap*gapExtend
+    return iden
+
+def hitWindows(seqs, names, codes, starts, ends) :
+    '''the windows [start, end) of the hits in <seqs> (an encoded SeqBatch, or a dict of encoded sequences
+    such as SeqStore.encoded), as a buffer and the position and length of each window in it.
+    <names> are the sequence names and <codes> index them for each hit.'''
+    if isinstance(seqs, SeqBatch) :
+        rec = np.array([seqs.index[n] for n in names], dtype=np.int64)[codes]
+        lengths = np.clip(np.minimum(ends, seqs.offsets[rec+1] - seqs.offsets[rec]) - starts, 0, None)
+        return seqs.buffer, seqs.offsets[rec] + starts, lengths
+    windows = [ seqs[names[c]][s:e] for c, s, e in zip(codes.tolist(), starts.tolist(), ends.tolist()) ]
+    lengths = np.fromiter(map(len, windows), dtype=np.int64, count=len(windows))
+    buf = np.concatenate(windows).astype(np.int8) if windows else np.zeros(0, dtype=np.int8)
+    return buf, np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64), lengths
+
+
+def blastCIGARs(qseqs, sseqs) :
+    '''CIGARs of a batch of blastn alignments, given their qseq and sseq columns, packed as in HitTable. All
+    alignments are scanned in one concatenated array: gaps in the query are "D" and gaps in the reference "I".'''
+    lens = np.fromiter(map(len, qseqs), dtype=int, count=len(qseqs))
+    ends = np.cumsum(lens)
+    code = (np.frombuffer(''.join(qseqs).encode('ascii'), dtype=np.uint8) == 45)*2 + \
+           (np.frombuffer(''.join(sseqs).encode('ascii'), dtype=np.uint8) == 45)
+    brk = np.ones(code.size, dtype=bool)
+    brk[1:] = code[1:] != code[:-1]
+    brk[ends[:-1]] = True
+    runStart = np.flatnonzero(brk)
+    runLen = np.diff(np.append(runStart, code.size))
+    runOp = np.frombuffer(b'MID', dtype=np.uint8)[code[runStart]]
+    return np.searchsorted(runStart, np.concatenate([[0], ends])), runLen, runOp
+
+def parseBlastChunk(lines, min_id, min_cov, min_ratio) :
+    '''convert lines of blastn tabular output (outfmt 6 with qseq and sseq) into a HitTable'''
+    cols = list(zip(*(line.rstrip('\n').split('\t') for line in lines if line.strip())))
+    if not cols :
+        return HitTable.empty()
+    iden = np.array(cols[2], dtype=float)/100.
+    coords = np.array(cols[3:10], dtype=int).T
+    qlen = np.array(cols[12], dtype=int)
+    alnLen = coords.T[4] - coords.T[3] + 1
+    keep = np.flatnonzero((iden >= min_id) & (alnLen >= min_cov) & (alnLen >= min_ratio*qlen))
+    if not keep.size :
+        return HitTable.empty()
+    cigarStart, cigarLen, cigarOp = blastCIGARs([cols[14][i] for i in keep], [cols[15][i] for i in keep])
+    return HitTable.fromColumns(np.array(cols[0], dtype=object)[keep], np.array(cols[1], dtype=object)[keep], \
+        [iden[keep]] + list(coords[keep].T) + [np.array(cols[10], dtype=float)[keep], np.array(cols[11], dtype=float)[keep], \
+         qlen[keep], np.array(cols[13], dtype=int)[keep]], cigarStart, cigarLen, cigarOp)
+
+def topHits(blastab, topK=0, scoreRatio=0.) :
+    '''keep, for each query, its <topK> best hits (all if 0) and the hits scoring >= <scoreRatio> of its best
+    one. Ties keep the earlier hit, and the kept hits stay in their order.'''
+    if not len(blastab) or (topK <= 0 and scoreRatio <= 0) :
         return blastab
-    
-    blastn, refDb, qry, min_id, min_cov, min_ratio = params
-    outfile = '{0}.bsn'.format(qry)
-    blast_cmd = '{blastn} -db {refDb} -query {qry} -word_size 17 -out {qry}.bsn -perc_identity {min_id} -outfmt "6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue score qlen slen qseq sseq" -qcov_hsp_perc {min_ratio} -num_alignments 1000 -task blastn -evalue 1e-2 -dbsize 5000000 -reward 2 -penalty -3 -gapopen 6 -gapextend 2'.format(
-        blastn=blastn, refDb=refDb, qry=qry, min_id=min_id*100, min_ratio=min_ratio*100)
-    Popen(blast_cmd, stdout=PIPE, shell=True, universal_newlines=True).communicate()
-    if os.path.getsize(outfile) > 0 :
-        blastab = parseBlast(outfile, min_id, min_cov, min_ratio)
-        os.unlink(outfile)
+    order = np.lexsort([-blastab.score, blastab.qry])
+    qry, score = blastab.qry[order], blastab.score[order]
+    first = np.searchsorted(qry, qry)
+    keep = np.ones(order.size, dtype=bool)
+    if topK > 0 :
+        keep &= np.arange(order.size) - first < topK
+    if scoreRatio > 0 :
+        keep &= score >= scoreRatio * score[first]
+    return blastab if keep.all() else blastab.take(np.sort(order[keep]))
+
+def addChunk(chunks, blastab, prune) :
+    '''add a parsed chunk to <chunks>. With a pruning rule [topK, scoreRatio] (see topHits), the chunks are
+    merged and pruned straight away, so that the hits dropped by it are never held together.
+    The best hits of a query can only get better, so pruning early drops nothing that pruning at the end keeps.'''
+    if prune and (prune[0] > 0 or prune[1] > 0) :
+        chunks[:] = [ topHits(HitTable.concat(chunks + [blastab]), *prune) ]
     else :
-        blastab = None
-    if blastab is None :
-        return None
+        chunks.append(blastab)
+
+def streamChunks(cmd, parse, prune=None, chunkSize=50000, **kwargs) :
+    '''run <cmd> by run_external (with <kwargs>) and convert its stdout to hits by <parse> in chunks of <chunkSize>
+    lines, so that the text of at most one chunk is held in memory. The chunks are pruned by <prune> (see addChunk).
+    Returns the hits as a HitTable.'''
+    chunks, lines = [], []
+    def onLine(line) :
+        lines.append(line)
+        if len(lines) >= chunkSize :
+            addChunk(chunks, parse(lines), prune)
+            del lines[:]
+    run_external(cmd, onLine=onLine, **kwargs)
+    addChunk(chunks, parse(lines), prune)
+    return HitTable.concat(chunks)
+
+def packCigars(cigars) :
+    '''pack CIGAR strings into cigarStart, cigarLen and cigarOp as in HitTable, all in one pass: the operations
+    are the letters, and the numbers between them their lengths'''
+    code = np.frombuffer(''.join(cigars).encode('ascii'), dtype=np.uint8)
+    isOp = code >= 65
+    nOps = np.add.reduceat(isOp.astype(np.int64), np.concatenate([[0], np.cumsum([len(c) for c in cigars])[:-1]]))
+    return np.concatenate([[0], np.cumsum(nOps)]), np.array(re.findall(r'\d+', ''.join(cigars)), dtype=np.int64), code[isOp]
+
+def reverseCigars(table, mask) :
+    '''reverse, in place, the CIGARs of the hits of <table> selected by the boolean <mask>. Returns the table.'''
+    hit = np.repeat(np.arange(len(table)), np.diff(table.cigarStart))
+    pos = np.arange(table.cigarLen.size)
+    flip = np.asarray(mask, dtype=bool)[hit]
+    pos[flip] = (table.cigarStart[hit] + table.cigarStart[hit+1] - 1 - pos)[flip]
+    table.cigarLen, table.cigarOp = table.cigarLen[pos], table.cigarOp[pos]
+    return table
+
+def balancedChunks(lengths, nChunk) :
+    '''assign items of <lengths> to <nChunk> chunks of similar total length, the longest item first to the
+    lightest chunk. Returns the chunk of each item.'''
+    chunkId, heap = np.empty(len(lengths), dtype=np.int64), [ [0, id] for id in xrange(nChunk) ]
+    for i, l in zip(np.argsort(-np.asarray(lengths), kind='stable').tolist(), np.sort(lengths)[::-1].tolist()) :
+        chunkId[i] = heap[0][1]
+        heapq.heapreplace(heap, [heap[0][0] + l, heap[0][1]])
+    return chunkId
+
+def timedTask(params) :
+    id, func, args = params
+    start = time.time()
+    res = func(args)
+    return id, res, '{0}:{1}'.format(os.getpid(), threading.current_thread().name), start, time.time()
+
+def runTasks(pool, func, tasks, label) :
+    '''run <func> on all <tasks> through the task queue of <pool>, so that a worker takes the next task as soon
+    as it is idle; queue the largest tasks first. Returns the results in the order of the tasks and logs the
+    share of the run time each worker was busy. Counters and CPU time of the tasks in worker processes are
+    added to the stages of this one (see reportTask).'''
+    start, results, busy = time.time(), [None]*len(tasks), {}
+    for id, res, worker, s, e in map(mergeReport, pool.imap_unordered(reportTask(timedTask), [ [id, func, t] for id, t in enumerate(tasks) ])) :
+        results[id] = res
+        busy.setdefault(worker, []).append(e - s)
+    wall, nWorker = max(time.time() - start, 1e-6), max(min(getattr(pool, '_processes', 1), len(tasks)), len(busy))
+    if tasks :
+        logger('{0}: {1} tasks on {2} workers in {3:.1f} s, {4:.0f}% utilisation. Busy per worker: {5}'.format( \
+            label, len(tasks), nWorker, wall, 100.*sum(map(sum, busy.values()))/(wall*nWorker), \
+            ', '.join('{0:.0f}% ({1} tasks)'.format(100.*sum(t)/wall, len(t)) for w, t in sorted(busy.items(), key=lambda x:-sum(x[1]))) ))
+    return results
+
+def poolBlast(params) :
+    '''run blastn for one query shard, its output parsed and pruned as it streams (see streamChunks).
+    Returns the hits as a HitTable, or None'''
+    blastn, refDb, qry, min_id, min_cov, min_ratio = params[:6]
+    prune = params[6] if len(params) > 6 else None
+    chunkSize = params[7] if len(params) > 7 else 50000
+    blast_cmd = '{blastn} -db {refDb} -query {qry} -word_size 17 -perc_identity {min_id} -outfmt "6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue score qlen slen qseq sseq" -qcov_hsp_perc {min_ratio} -num_alignments 1000 -task blastn -evalue 1e-2 -dbsize 5000000 -reward 2 -penalty -3 -gapopen 6 -gapextend 2'.format(
+        blastn=blastn, refDb=refDb, qry=qry, min_id=min_id*100, min_ratio=min_ratio*100)
+    # refDb is the reference FASTA itself (see runBlast), so its content identifies the database
+    blastab = streamChunks(blast_cmd, lambda lines : parseBlastChunk(lines, min_id, min_cov, min_ratio), prune, chunkSize, \
+                           cache=dict(inputs=[refDb, qry], scratch=[os.path.dirname(qry)]))
+    return blastab if len(blastab) else None
+
+
+
+def parsePafChunk(lines, min_id, min_cov, min_ratio) :
+    '''convert lines of minimap2 PAF output with CIGARs (cg:Z, option -c) into a HitTable. minimap2 aligns the
+    reverse complement of the query for hits on the reverse strand; their CIGARs are reversed so that all
+    follow the query, and their reference coordinates run backwards.'''
+    rows = [ line.rstrip('\n').split('\t') for line in lines if line.strip() ]
+    if not rows :
+        return HitTable.empty()
+    cols = list(zip(*(r[:11] for r in rows)))
+    tags = [ { t[:2]: t[5:] for t in r[12:] } for r in rows ]
+    ql, qs, qe = [ np.array(c, dtype=np.int64) for c in cols[1:4] ]
+    rl, rs, r_e, nMatch, alnLen = [ np.array(c, dtype=np.int64) for c in cols[6:11] ]
+    iden = np.round(nMatch/alnLen.astype(float), 3)
+    keep = np.flatnonzero((iden >= min_id) & (qe - qs >= min_cov) & (qe - qs >= min_ratio*ql))
+    if not keep.size :
+        return HitTable.empty()
+
+    cigarStart, cigarLen, cigarOp = packCigars([ tags[i]['cg'] for i in keep.tolist() ])
+    hit = np.repeat(np.arange(keep.size), np.diff(cigarStart))
+    gapLen = np.bincount(hit, cigarLen*(cigarOp != 77), minlength=keep.size).astype(np.int64)
+    gapOpen = np.bincount(hit, cigarOp != 77, minlength=keep.size).astype(np.int64)
+    rev = (np.array(cols[4]) == '-')[keep]
+
+    rs, r_e = rs[keep] + 1, r_e[keep]
+    score = np.array([ int(tags[i].get('AS', cols[9][i])) for i in keep.tolist() ], dtype=np.int64)
+    return reverseCigars(HitTable.fromColumns(np.array(cols[0], dtype=object)[keep], np.array(cols[5], dtype=object)[keep], \
+        [iden[keep], alnLen[keep], alnLen[keep] - nMatch[keep] - gapLen, gapOpen, qs[keep] + 1, qe[keep], np.where(rev, r_e, rs), np.where(rev, rs, r_e), \
+         np.zeros(keep.size), score, ql[keep], rl[keep]], cigarStart, cigarLen, cigarOp), rev)
 
-    blastab[14] = [[list(t) for t in tab] for tab in blastab[14].tolist()]
-    np.save(qry+'.match.npy', blastab.values, allow_pickle=True)
-    return qry + '.match.npy'
+def poolMinimap(params) :
+    '''run minimap2 for one query chunk against the index of the reference, its PAF output parsed as it
+    streams (see streamChunks). Returns the hits as a HitTable, or None'''
+    minimap2, refIdx, refNA, qry, min_id, min_cov, min_ratio = params[:7]
+    prune = params[7] if len(params) > 7 else None
+    chunkSize = params[8] if len(params) > 8 else 50000
+    # every chain is reported (-P), so that all copies of a gene are found as with blastn
+    minimap_cmd = '{minimap2} -c -x asm20 -P --secondary=yes -N 1000 -s {min_score} -t 1 {refIdx} {qry}'.format( \
+        minimap2=minimap2, refIdx=refIdx, qry=qry, min_score=int(max(min_cov, 20)))
+    # the index is built from refNA, so the content of refNA identifies it
+    blastab = streamChunks(minimap_cmd.split(), lambda lines : parsePafChunk(lines, min_id, min_cov, min_ratio), prune, chunkSize, \
+                           cache=dict(inputs=[refNA, qry], scratch=[os.path.dirname(qry)]))
+    return blastab if len(blastab) else None
 
 
+# fields of the tabular diamond output that parseDiamondChunk reads
+diamondFields = 'qseqid sseqid qstart qend sstart length nident score cigar'
+
+def parseDiamondChunk(lines, qryLens, refLens, min_id, min_cov, min_ratio) :
+    '''convert lines of diamond tabular output (outfmt 6 with diamondFields) into a HitTable in nucleotide
+    coordinates. Query names end with ":<frame>" and reference names with ":<frame>:<offset of the ORF chunk>"
+    (see translateRef); <qryLens> and <refLens> are the lengths of the untranslated sequences.'''
+    cols = list(zip(*(line.rstrip('\n').split('\t') for line in lines if line.strip())))
+    if not cols :
+        return HitTable.empty()
+    qn, qf = zip(*(n.rsplit(':', 1) for n in cols[0]))
+    rn, rf, rx = zip(*(n.rsplit(':', 2) for n in cols[1]))
+    qs, qe, rs, length, nident, score = [ np.array(c, dtype=np.int64) for c in cols[2:8] ]
+    ql = np.array([qryLens[n] for n in qn], dtype=np.int64)
+    qm = qe - qs + 1
+    keep = np.flatnonzero((qm*3 >= min_cov) & (qm*3. >= min_ratio*ql))
+    if not keep.size :
+        return HitTable.empty()
+
+    # CIGAR lengths are in amino acids
+    cigarStart, cigarLen, cigarOp = packCigars([ cols[8][i] for i in keep ])
+    cigarLen *= 3
+    hit = np.repeat(np.arange(keep.size), np.diff(cigarStart))
+    alnLen = np.bincount(hit, cigarLen, minlength=keep.size).astype(np.int64)
+    gapLen = np.bincount(hit, cigarLen*(cigarOp != 77), minlength=keep.size).astype(np.int64)
+    gapOpen = np.bincount(hit, cigarOp != 77, minlength=keep.size).astype(np.int64)
+    rm = np.bincount(hit, cigarLen*(cigarOp != 73), minlength=keep.size).astype(np.int64) // 3
+
+    variation = (length[keep] - nident[keep]) * 3.
+    iden = 1 - np.round(variation/alnLen, 3)
+    qf, rf = np.array(qf, dtype=np.int64)[keep], np.array(rf, dtype=np.int64)[keep]
+    qs, qm, ql = qs[keep], qm[keep], ql[keep]
+    rs, rl = rs[keep] + np.array(rx, dtype=np.int64)[keep], np.array([refLens[rn[i]] for i in keep.tolist()], dtype=np.int64)
+    # amino acid to nucleotide coordinates; hits of reverse frames run backwards
+    rs, r_e = np.where(rf <= 3, rs*3 + rf - 3, rl - (rs*3 + rf - 6) + 1), np.where(rf <= 3, (rs + rm - 1)*3 + rf - 1, rl - ((rs + rm - 1)*3 + rf - 4) + 1)
+    qs, qe = np.where(qf <= 3, qs*3 + qf - 3, ql - ((qs + qm - 1)*3 + qf - 4) + 1), np.where(qf <= 3, (qs + qm - 1)*3 + qf - 1, ql - (qs*3 + qf - 6) + 1)
+    rs, r_e = np.where(qf <= 3, rs, r_e), np.where(qf <= 3, r_e, rs)
+
+    ok = np.flatnonzero(iden >= min_id)
+    cigarStart, cigarLen, cigarOp = packedTake(cigarStart, ok, cigarLen, cigarOp)
+    # the CIGARs of hits in reverse query frames run backwards too
+    return reverseCigars(HitTable.fromColumns(np.array(qn, dtype=object)[keep[ok]], np.array(rn, dtype=object)[keep[ok]], \
+        [iden[ok], alnLen[ok], (variation[ok] - gapLen[ok]).astype(np.int64), gapOpen[ok], qs[ok], qe[ok], rs[ok], r_e[ok], \
+         np.zeros(ok.size), score[keep[ok]], ql[ok], rl[ok]], cigarStart, cigarLen, cigarOp), qf[ok] > 3)
+
+def poolDiamond(params) :
+    '''run diamond blastp on one shard of the translated reference, its output parsed as it streams (see
+    streamChunks). Returns the hits as a HitTable.'''
+    diamond, refAA, qryAA, options, n_thread, qryLens, refLens, min_id, min_cov, min_ratio = params[:10]
+    prune = params[10] if len(params) > 10 else None
+    chunkSize = params[11] if len(params) > 11 else 50000
+    diamond_cmd = '{diamond} blastp {options} --threads {n_thread} --db {refAA} --query {qryAA} --outfmt 6 {fields}'.format( \
+        diamond=diamond, options=options, n_thread=n_thread, refAA=refAA, qryAA=qryAA, fields=diamondFields)
+    return streamChunks(diamond_cmd.split(), lambda lines : parseDiamondChunk(lines, qryLens, refLens, min_id, min_cov, min_ratio), \
+                        prune, chunkSize, n_thread=n_thread, cache=dict(inputs=[refAA, qryAA], scratch=[os.path.dirname(refAA)]))
+
+
+# the in-process aligner of --sw (see RunBlast.runSW): k-mer seeds, an ungapped x-drop filter and banded
+# affine-gap extension. nucEncoder codes (A0 C1 N2 G3 T4) as 2-bit k-mer digits; N breaks a k-mer
+swDigits = np.array([0, 1, -1, 2, 3], dtype=np.int64)
+
+@lazyJit(nogil=True)
+def kmerCodes(buf, offsets, k, digits) :
+    '''the k-mer starting at every position of the encoded sequences in <buf>, as an integer, or -1 if it runs
+    over an N or the end of its sequence'''
+    codes = np.full(buf.size, -1, dtype=np.int64)
+    mask = (1 << (2*k)) - 1
+    for r in range(offsets.size - 1) :
+        code, n = 0, 0
+        for p in range(offsets[r], offsets[r+1]) :
+            d = digits[buf[p]]
+            if d < 0 :
+                code, n = 0, 0
+                continue
+            code = ((code << 2) | d) & mask
+            n += 1
+            if n >= k :
+                codes[p-k+1] = code
+    return codes
+
+@lazyJit(nogil=True)
+def seedGroups(qRec, rRec, diag, pad, maxSpread) :
+    '''split seeds sorted by query, reference and diagonal into groups of one alignment: seeds of the same
+    query and reference whose diagonals are within <pad> of each other and within <maxSpread> of the first one'''
+    starts = np.empty(qRec.size + 1, dtype=np.int64)
+    n = 0
+    for i in range(qRec.size) :
+        if i == 0 or qRec[i] != qRec[i-1] or rRec[i] != rRec[i-1] or diag[i] - diag[i-1] > pad or diag[i] - diag[starts[n-1]] > maxSpread :
+            starts[n] = i
+            n += 1
+    starts[n] = qRec.size
+    return starts[:n+1]
+
+@lazyJit(nogil=True)
+def seedRanges(codes, tabCode, tabStart, shift) :
+    '''for every k-mer in <codes>, the range [lo, lo+cnt) of the sorted <tabCode> that holds the same k-mer.
+    tabStart indexes tabCode by the k-mers shifted right by <shift> bits.'''
+    lo, cnt = np.zeros(codes.size, dtype=np.int64), np.zeros(codes.size, dtype=np.int64)
+    for p in range(codes.size) :
+        c = codes[p]
+        if c < 0 :
+            continue
+        l, h = tabStart[c >> shift], tabStart[(c >> shift) + 1]
+        while l < h and tabCode[l] < c :
+            l += 1
+        lo[p] = l
+        while l < h and tabCode[l] == c :
+            l += 1
+        cnt[p] = l - lo[p]
+    return lo, cnt
+
+@lazyJit(nogil=True)
+def ungappedScores(qBuf, qPos, qLen, refBuf, rPos, rLen, seedQ, seedR, k, reward, penalty, xDrop) :
+    '''score of the ungapped x-drop extension of every seed, in both directions. Seed i is the k-mer at qBuf[qPos[i]]
+    and refBuf[rPos[i]], which starts seedQ[i] / seedR[i] bases into its query / reference sequence, and
+    qLen[i] / rLen[i] bases before their ends'''
+    scores = np.empty(qPos.size, dtype=np.int64)
+    for i in range(qPos.size) :
+        total = k * reward
+        for step in (1, -1) :
+            best, sc, p = 0, 0, k if step > 0 else -1
+            while p < qLen[i] and p < rLen[i] and p >= -seedQ[i] and p >= -seedR[i] :
+                qb = qBuf[qPos[i]+p]
+                sc += reward if qb == refBuf[rPos[i]+p] and qb != 2 else penalty
+                if sc > best :
+                    best = sc
+                elif sc < best - xDrop :
+                    break
+                p += step
+            total += best
+        scores[i] = total
+    return scores
+
+@lazyJit(nogil=True)
+def swExtend(s, e, qBuf, qPos, qLen, refBuf, rPos, ws, we, dLo, width, reward, penalty, gapOpen, gapExtend, res, cigarStart, cigarLen, cigarOp, cigarN) :
+    '''banded local alignment with affine gaps (a gap of n bases costs gapOpen + n*gapExtend) for the seed groups
+    [s, e). The query of group g is qBuf[qPos[g]:qPos[g]+qLen[g]] and its reference is refBuf[rPos[g]:], of which the
+    window [ws[g], we[g]) is aligned in the diagonals [dLo[g], dLo[g]+width[g]) of the window.
+    Writes [score, qStart, qEnd, rStart, rEnd, matches, mismatches, gap opens, alignment length] (1-based, in the
+    reference) into res[g] and the CIGAR into cigarLen/cigarOp from cigarStart[g], with its size in cigarN[g].'''
+    NEG = -(1 << 30)
+    for g in range(s, e) :
+        res[g, 0] = 0
+        cigarN[g] = 0
+        q0, m, r0 = qPos[g], qLen[g], rPos[g] + ws[g]
+        n, W, lo = we[g] - ws[g], width[g], dLo[g]
+        # H, E (gap in the query) and F (gap in the reference) of the previous and current rows, by band index
+        hPrev, hCur = np.zeros(W+1, dtype=np.int64), np.zeros(W+1, dtype=np.int64)
+        fPrev, fCur = np.full(W+1, NEG, dtype=np.int64), np.full(W+1, NEG, dtype=np.int64)
+        # trace bits: 0-1 source of H (0 start, 1 diagonal, 2 E, 3 F), 2 E extended, 3 F extended
+        trace = np.zeros((m+1)*W, dtype=np.uint8)
+        best, bi, bb = 0, 0, 0
+        for i in range(1, m+1) :
+            qb = qBuf[q0+i-1]
+            eCur = NEG
+            for b in range(W) :
+                j = i + lo + b
+                if j < 1 or j > n :
+                    hCur[b], fCur[b], eCur = 0, NEG, NEG
+                    continue
+                t = 0
+                # E from the left (b-1 of this row), F from above (b+1 of the previous row)
+                if b > 0 :
+                    eOpen, eExt = hCur[b-1] - gapOpen - gapExtend, eCur - gapExtend
+                else :
+                    eOpen, eExt = NEG, NEG
+                if eExt > eOpen :
+                    eCur = eExt
+                    t |= 4
+                else :
+                    eCur = eOpen
+                fOpen, fExt = hPrev[b+1] - gapOpen - gapExtend, fPrev[b+1] - gapExtend
+                if fExt > fOpen :
+                    fCur[b] = fExt
+                    t |= 8
+                else :
+                    fCur[b] = fOpen
+                rb = refBuf[r0+j-1]
+                h = hPrev[b] + (reward if qb == rb and qb != 2 else penalty)
+                src = 1
+                if eCur > h :
+                    h, src = eCur, 2
+                if fCur[b] > h :
+                    h, src = fCur[b], 3
+                if h <= 0 :
+                    h, src = 0, 0
+                hCur[b] = h
+                trace[i*W+b] = t | src
+                if h > best :
+                    best, bi, bb = h, i, b
+            hPrev, hCur = hCur, hPrev
+            fPrev, fCur = fCur, fPrev
+        if best <= 0 :
+            continue
+        # trace back from the best cell; operations are collected backwards and run-length encoded
+        ops = np.empty(m + n + 1, dtype=np.uint8)
+        nOp, i, b, state = 0, bi, bb, 0
+        nMatch, nMism, nOpen = 0, 0, 0
+        while i > 0 :
+            t = trace[i*W+b]
+            if state == 0 :
+                src = t & 3
+                if src == 0 :
+                    break
+                if src == 1 :
+                    if qBuf[q0+i-1] == refBuf[r0+i+lo+b-1] and qBuf[q0+i-1] != 2 :
+                        nMatch += 1
+                    else :
+                        nMism += 1
+                    ops[nOp] = 77
+                    nOp += 1
+                    i -= 1
+                else :
+                    state = src - 1
+                    nOpen += 1
+            elif state == 1 :
+                ops[nOp] = 68
+                nOp += 1
+                state = 1 if t & 4 else 0
+                b -= 1
+            else :
+                ops[nOp] = 73
+                nOp += 1
+                state = 2 if t & 8 else 0
+                i -= 1
+                b += 1
+        c0, nc = cigarStart[g], 0
+        for p in range(nOp-1, -1, -1) :
+            if nc > 0 and cigarOp[c0+nc-1] == ops[p] :
+                cigarLen[c0+nc-1] += 1
+            else :
+                cigarOp[c0+nc], cigarLen[c0+nc] = ops[p], 1
+                nc += 1
+        cigarN[g] = nc
+        res[g, 0], res[g, 1], res[g, 2] = best, i+1, bi
+        res[g, 3], res[g, 4] = ws[g] + i + lo + b + 1, ws[g] + bi + lo + bb
+        res[g, 5], res[g, 6], res[g, 7], res[g, 8] = nMatch, nMism, nOpen, nOp
+
 
 def getCIGAR(data) :
     ref, qry = data
@@ -336,13 +993,24 @@ def getCIGAR(data) :
 class RunBlast(object) :
     def __init__(self) :
         self.qrySeq = self.refSeq = None
-    def run(self, ref, qry, methods, min_id, min_cov, min_ratio, table_id=11, n_thread=8, useProcess=False, re_score=0, filter=[False, 0.9, 0.], linear_merge=[False, 300.,1.2], return_overlap=[True, 300, 0.6], fix_end=[6., 6.]) :
-        tools = dict(blastn=self.runBlast, diamond=self.runDiamond, diamondself=self.runDiamondSELF, diamondx=self.runDiamondx)
+    def run(self, ref, qry, methods, min_id, min_cov, min_ratio, table_id=11, n_thread=8, useProcess=False, re_score=0, filter=[False, 0.9, 0.], linear_merge=[False, 300.,1.2], return_overlap=[True, 300, 0.6], fix_end=[6., 6.], asTable=False, dedup=[False, False], prune=[0, 0.]) :
+        '''<ref> and <qry> are file names or dicts of {name: sequence} as readFastq gives them (amino acids for
+        the query of diamondx). With dedup[0], identical queries (and reverse complements with dedup[1]) are
+        searched once (see collapseQueries). prune=[topK, scoreRatio] bounds the hits kept for each query while the
+        outputs of the tools are read (see topHits); the defaults keep all of them. Returns the hits in the legacy layout (see HitTable.toRows), or as a HitTable
+        if <asTable>, followed by the overlaps if return_overlap[0] is set.'''
+        tools = dict(blastn=self.runBlast, minimap=self.runMinimap, sw=self.runSW, diamond=self.runDiamond, diamondself=self.runDiamondSELF, diamondx=self.runDiamondx)
         self.min_id = min_id
         self.min_cov = min_cov
         self.min_ratio = min_ratio
         self.table_id = table_id
         self.n_thread = n_thread
+        self.prune = list(prune)
+        # hits name their sequences by strings, so in-memory inputs are keyed the same way
+        if isinstance(ref, dict) :
+            ref = self.refSeq = ref if all(isinstance(n, str) for n in ref) else { str(n): s for n, s in ref.items() }
+        if isinstance(qry, dict) :
+            qry = self.qrySeq = qry if all(isinstance(n, str) for n in qry) else { str(n): s for n, s in qry.items() }
         if useProcess == True :
             self.pool = Pool(n_thread)
         elif useProcess == False :
@@ -350,189 +1018,393 @@ class RunBlast(object) :
         else :
             self.pool = useProcess
 
+        self.qryCopies = []
+        if dedup[0] :
+            if 'diamondx' in [ m.lower() for m in methods ] :
+                logger('Queries of diamondx are proteins and are not collapsed.')
+            else :
+                with stage('dedup') :
+                    self.collapseQueries(qry, dedup[1])
+
+        # errors of the searches and of the steps after them all reach the caller
         blastab = []
         self.dirPath = tempfile.mkdtemp(prefix='NS_', dir='.')
         try :
             for method in methods :
                 if method.lower() in tools :
-                    blastab.append(tools[method.lower()](ref, qry))
-            blastab = [b for b in blastab if b.shape[0] > 0]
-        except :
-            import traceback
-            print(traceback.print_exc())
+                    with stage(method.lower()) :
+                        blastab.append(tools[method.lower()](ref, qry))
         finally :
             shutil.rmtree(self.dirPath)
-            if blastab :
-                blastab = np.vstack(blastab)
-                blastab = np.hstack([blastab, np.arange(blastab.shape[0], dtype=int)[:, np.newaxis]])
+            if useProcess != self.pool :
+                self.pool.close()
+        blastab = [b for b in blastab if len(b) > 0]
+        if self.qryCopies :
+            blastab = [ self.expandQueries(HitTable.concat(blastab)) ] if blastab else []
+        if blastab :
+            blastab = HitTable.concat(blastab)
+            blastab.rowId = np.arange(len(blastab), dtype=np.int64)
+        else :
+            empty = HitTable.empty() if asTable else np.empty([0, 16], dtype=object)
+            if return_overlap[0] :
+                return empty, np.empty([0, 3], dtype=int)
             else :
-                if return_overlap[0] :
-                    return np.empty([0, 16], dtype=object), np.empty([0, 3], dtype=int)
-                else :
-                    return np.empty([0, 16], dtype=object)
-        if useProcess != self.pool :
-            self.pool.close()
-        
+                return empty
+
         if re_score :
-            blastab=self.reScore(ref, qry, blastab, re_score, self.min_id, self.table_id)
+            with stage('reScore') :
+                blastab=self.reScore(ref, qry, blastab, re_score, self.min_id, self.table_id)
         if filter[0] :
-            blastab=self.ovlFilter(blastab, filter)
+            with stage('ovlFilter') :
+                blastab=self.ovlFilter(blastab, filter)
         if linear_merge[0] :
-            blastab=self.linearMerge(blastab, linear_merge)
-        self.fixEnd(blastab, *fix_end)
+            with stage('linearMerge') :
+                blastab=self.linearMerge(blastab, linear_merge)
+        with stage('fixEnd') :
+            self.fixEnd(blastab, *fix_end)
         if return_overlap[0] :
-            overlap = self.returnOverlap(blastab, return_overlap)
-            blastab = pd.DataFrame(blastab).sort_values([0,1,11]).values
-            return blastab, overlap
-        else :
-            blastab = pd.DataFrame(blastab).sort_values([0,1,11]).values
+            with stage('returnOverlap') :
+                overlap = self.returnOverlap(blastab, return_overlap)
+        blastab = blastab.sortBy('qry', 'ref', 'score')
+        if not asTable :
+            blastab = blastab.toRows()
+        return (blastab, overlap) if return_overlap[0] else blastab
+
+    def collapseQueries(self, qry, revComp=False) :
+        '''keep one query of each set of identical sequences (and of reverse complements if <revComp>) for the
+        search. The others are recorded in qryCopies as [kept name, name, reverse complement] and get the hits
+        of the kept query from expandQueries.'''
+        qrySeq = self.qrySeq if self.qrySeq else readFastq(qry)[0]
+        keys = qrySeq.values()
+        if revComp :
+            keys = [ min(s, r) for s, r in zip(qrySeq.values(), SeqBatch.fromDict(qrySeq).rc().toDict().values()) ]
+        first, kept = {}, {}
+        for (n, s), k in zip(qrySeq.items(), keys) :
+            rep = first.setdefault(k, n)
+            if rep == n :
+                kept[n] = s
+            else :
+                self.qryCopies.append([rep, n, s != qrySeq[rep]])
+        logger('Collapsed {0} of {1} queries onto identical sequences ({2} reverse complements); {3} are searched.'.format( \
+            len(self.qryCopies), len(qrySeq), sum(c[2] for c in self.qryCopies), len(kept)))
+        countEvent('queries_collapsed', len(self.qryCopies))
+        self.allQrySeq, self.qrySeq = qrySeq, kept
+
+    def expandQueries(self, blastab) :
+        '''copy the hits of the kept queries to their duplicates (see collapseQueries). Hits of reverse complements
+        are turned around: the query coordinates are mirrored, the reference strand flips and the CIGAR is reversed.'''
+        self.qrySeq = self.allQrySeq
+        code = { n:i for i, n in enumerate(blastab.qryNames.tolist()) }
+        copies = [ c for c in self.qryCopies if c[0] in code ]
+        if not copies :
             return blastab
-            
+        order = np.argsort(blastab.qry, kind='stable')
+        starts = np.searchsorted(blastab.qry[order], np.arange(blastab.qryNames.size+1))
+        rep = np.array([ code[c[0]] for c in copies ], dtype=np.int64)
+        nHit = starts[rep+1] - starts[rep]
+        copyId = np.repeat(np.arange(len(copies)), nHit)
+        dup = blastab.take(order[np.repeat(starts[rep] - np.concatenate([[0], np.cumsum(nHit)[:-1]]), nHit) + np.arange(np.sum(nHit))])
+        names, inverse = np.unique(np.array([ c[1] for c in copies ], dtype=object).astype(str), return_inverse=True)
+        dup.qryNames, dup.qry = names.astype(object), inverse[copyId].astype(np.int64)
+        rev = np.array([ c[2] for c in copies ], dtype=bool)[copyId]
+        if rev.any() :
+            dup.qStart, dup.qEnd = np.where(rev, dup.qLen - dup.qEnd + 1, dup.qStart), np.where(rev, dup.qLen - dup.qStart + 1, dup.qEnd)
+            dup.rStart, dup.rEnd = np.where(rev, dup.rEnd, dup.rStart), np.where(rev, dup.rStart, dup.rEnd)
+            reverseCigars(dup, rev)
+        return HitTable.concat([blastab, dup])
+
     def returnOverlap(self, blastab, param) :
 #        logger('Calculate overlaps.')
-        
-        ovl_l, ovl_p = param[1:]
-        contigs = { tab[1]:id for id, tab in enumerate(blastab) }
-        tabs = [ [contigs[tab[1]], tab[15]] + sorted( [tab[8], tab[9]] ) for tab in blastab ]
-        tabs = np.array(sorted(tabs, key=itemgetter(0, 2, 3)), dtype=int)
-        overlaps = np.empty(shape=[1000001, 3], dtype=int)
-        overlaps[-1, :] = [0, 1, -1]
-        res = []
-        while overlaps[-1, 0] >= 0 :
-            #logger('Searching {0} / {1} tabs'.format(overlaps[-1, 0], len(tabs)))
-            overlaps[:-1, :] = -1
-            overlaps = tab2overlaps(tabs, ovl_l, ovl_p, len(tabs), overlaps)
-            res.append(overlaps[overlaps.T[2] > 0][:])
-        res = np.vstack(res)
- #       logger('Identified {0} overlaps.'.format(len(res)))
-        return res
-    
+
+        # two passes over the sorted hits: count the pairs of each hit, then write them into an array of the exact size
+        ovl_l, ovl_p = float(param[1]), float(param[2])
+        s, e = np.minimum(blastab.rStart, blastab.rEnd), np.maximum(blastab.rStart, blastab.rEnd)
+        tabs = np.ascontiguousarray(np.vstack([blastab.ref, blastab.rowId, s, e]).T[np.lexsort([e, s, blastab.ref])])
+        offsets = np.zeros(len(tabs)+1, dtype=np.int64)
+        chunks = [ [c, min(c + 100000, len(tabs))] for c in xrange(0, len(tabs), 100000) ]
+        pool = ThreadPool(min(getattr(self, 'n_thread', 1), max(len(chunks), 1)))
+        empty = np.zeros([0, 3], dtype=np.int64)
+        pool.map(lambda c : tab2overlaps(tabs, ovl_l, ovl_p, c[0], c[1], offsets, empty), chunks)
+        np.cumsum(offsets, out=offsets)
+        overlaps = np.empty([offsets[-1], 3], dtype=np.int64)
+        if overlaps.shape[0] :
+            pool.map(lambda c : tab2overlaps(tabs, ovl_l, ovl_p, c[0], c[1], offsets, overlaps), chunks)
+        pool.close()
+ #       logger('Identified {0} overlaps.'.format(len(overlaps)))
+        return overlaps
+
     def reScore(self, ref, qry, blastab, mode, min_id, table_id=11, perBatch=10000) :
-        if not self.qrySeq :
-            self.qrySeq, self.qryQual = readFastq(qry)
-        if not self.refSeq :
-            self.refSeq, self.refQual = readFastq(ref)
-        for k, v in self.qrySeq.items() :
-            self.qrySeq[k] = nucEncoder[np.array(list(v)).view(asc2int)]
-        for k, v in self.refSeq.items() :
-            self.refSeq[k] = nucEncoder[np.array(list(v)).view(asc2int)]
-        
-        nTab = len(blastab)
-        for bId in xrange(0, blastab.shape[0], perBatch) :
-            #logger('Update scores: {0} / {1}'.format(bId, nTab))
-            tabs = blastab[bId:bId+perBatch]
-            #scores = np.array([ cigar2score([t[14], self.refSeq[str(t[1])][t[8]-1:t[9]] if t[8] < t[9] else 4 - self.refSeq[str(t[1])][t[9]-1:t[8]][::-1], self.qrySeq[str(t[0])][t[6]-1:t[7]], t[6], mode, 6, 1]) for t in tabs ])
-            scores = np.array(list(map(cigar2score, ( [t[14], self.refSeq[str(t[1])][t[8]-1:t[9]] if t[8] < t[9] else 4 - self.refSeq[str(t[1])][t[9]-1:t[8]][::-1], self.qrySeq[str(t[0])][t[6]-1:t[7]], t[6], mode, 6, 1, table_id] for t in tabs ))))
-            tabs.T[2], tabs.T[11] = np.round(scores.T, 3)
-        blastab = blastab[blastab.T[2] >= min_id]
-        return blastab
+        iden, score = self.scoreHits(ref, qry, blastab, mode, table_id, perBatch)
+        blastab.iden, blastab.score = np.round(iden, 3), np.round(score, 3)
+        blastab.intScore = False
+        return blastab.take(blastab.iden >= min_id)
+
+    def scoreHits(self, ref, qry, blastab, mode, table_id=11, perBatch=10000) :
+        '''identities and scores of all hits as cigar2score gives them (before rounding). The hits are scored
+        by cigarScores in chunks of <perBatch>, spread over n_thread threads.'''
+        qrySeq, refSeq = self.encodeSeq(qry, 'qrySeq'), self.encodeSeq(ref, 'refSeq')
+        rev = blastab.rStart > blastab.rEnd
+        refBuf, refPos, refLen = hitWindows(refSeq, blastab.refNames, blastab.ref, np.minimum(blastab.rStart, blastab.rEnd)-1, np.maximum(blastab.rStart, blastab.rEnd))
+        qryBuf, qryPos, qryLen = hitWindows(qrySeq, blastab.qryNames, blastab.qry, blastab.qStart-1, blastab.qEnd)
+        gt = gtable.copy()
+        if table_id == 4 :
+            gt[56] = 22
+        iden, score = np.empty(len(blastab), dtype=np.float64), np.empty(len(blastab), dtype=np.float64)
+        def scoreChunk(bId) :
+            cigarScores(bId, min(bId+perBatch, len(blastab)), blastab.cigarStart, blastab.cigarLen, blastab.cigarOp, refBuf, refPos, refLen, rev, \
+                        qryBuf, qryPos, qryLen, blastab.qStart, mode, 6, 1, gt, blosum62, iden, score)
+        chunks = list(xrange(0, len(blastab), perBatch))
+        n_thread = min(getattr(self, 'n_thread', 1), len(chunks))
+        if n_thread > 1 :
+            pool = ThreadPool(n_thread)
+            pool.map(scoreChunk, chunks)
+            pool.close()
+        else :
+            for bId in chunks :
+                scoreChunk(bId)
+        return iden, score
+
+    def encodeSeq(self, fname, attr) :
+        # sequences with a 2-bit store are encoded per hit from the memory map instead of being loaded whole
+        if not getattr(self, attr) :
+            store = loadSeqStore(fname)
+            if store is not None :
+                return store.encoded(nucEncoder)
+            setattr(self, attr, readFastq(fname)[0])
+        return SeqBatch.fromDict(getattr(self, attr)).encode(nucEncoder)
 
     def ovlFilter(self, blastab, params) :
         coverage, delta = params[1:]
 #        logger('Run filtering. Start with {0} hits.'.format(len(blastab)))
-        blastab[blastab.T[8] > blastab.T[9], 8:10] *= -1
-
-        blastab = pd.DataFrame(blastab).sort_values(by=[1,0,8,6]).values
-        for i, t1 in enumerate(blastab) :
-            if t1[2] < 0 : continue
-            toDel = []
-            for j in xrange(i+1, blastab.shape[0]) :
-                t2 = blastab[j]
-                if t2[2] < 0 : continue
-                if np.any(t1[:2] != t2[:2]) or t1[9] < t2[8] :
-                    break
-                c = min(t1[9], t2[9]) - t2[8] + 1
-                if (c >= coverage*(t1[9]-t1[8]+1) and t2[11] - t1[11] >= delta) :
-                    t1[2] = -1.
-                    break
-                elif (c >= coverage*(t2[9]-t2[8]+1) and t1[11] - t2[11] >= delta) :
-                    toDel.append(j)
-                elif c >= (t1[9]-t1[8]+1) and c < coverage*(t2[9]-t2[8]+1) :
-                    c2 = min(t1[7], t2[7]) - max(t2[6], t1[6]) + 1
-                    if c2 >= (t1[7]-t1[6]+1) and c2 < coverage*(t2[7]-t2[6]+1) :
-                        t1[2] == -1
-                        break
-                elif c >= (t2[9]-t2[8]+1) and c < coverage*(t1[9]-t1[8]+1) :
-                    c2 = min(t1[7], t2[7]) - max(t2[6], t1[6]) + 1
-                    if c2 >= (t2[7]-t2[6]+1) and c2 < coverage*(t1[7]-t1[6]+1) :
-                        toDel.append(j)
-            if t1[2] >= 0 :
-                for j in toDel :
-                    blastab[j][2] = -1.
-        blastab = blastab[blastab.T[2] >= 0]
-        blastab[blastab.T[8] < 0, 8:10] *= -1
+        rStart, rEnd = blastab.signedRef()
+        order = np.lexsort([blastab.qStart, rStart, blastab.qry, blastab.ref])
+        removed = ovlSweep(blastab.ref[order], blastab.qry[order], rStart[order], rEnd[order], blastab.qStart[order], blastab.qEnd[order], \
+                           blastab.score[order], float(coverage), float(delta), np.zeros(len(order), dtype=bool))
 #        logger('Done filtering. End with {0} hits.'.format(blastab.shape[0]))
-        return blastab
+        return blastab.take(order[~removed])
     def linearMerge(self, blastab, params) :
 #        logger('Start merging neighboring regions.')
-        blastab[blastab.T[8] > blastab.T[9], 8:10] *= -1
-        blastab = pd.DataFrame(blastab).sort_values([0,1,8,6]).values
-        blastab = np.vstack(list(map(_linearMerge, [[matches, params] for matches in np.split(blastab, np.where(np.diff(np.unique(blastab.T[0], return_inverse=True)[1]))[0]+1 )])))
-        blastab[blastab.T[8] < 0, 8:10] *= -1
+        if not len(blastab) :
+            return blastab
+        rStart, rEnd = blastab.signedRef()
+        order = np.lexsort([blastab.qStart, rStart, blastab.ref, blastab.qry])
+        blastab, rStart, rEnd = blastab.take(order), rStart[order], rEnd[order]
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(blastab.qry))+1, [len(blastab)]])
+        kept, assigned = np.empty(len(blastab), dtype=np.int64), np.full(len(blastab), -1, dtype=np.int64)
+        nodeFirst, nodeNext, nodeSize = np.empty(3*len(blastab), dtype=np.int64), np.empty(3*len(blastab), dtype=np.int64), np.empty(3*len(blastab), dtype=np.int64)
+        nodeInfo = np.empty([3*len(blastab), 3], dtype=np.float64)
+        # query groups are merged independently, in chunks of similar numbers of hits spread over n_thread threads
+        n_thread = getattr(self, 'n_thread', 1)
+        cuts = np.unique(np.searchsorted(starts, np.linspace(0, len(blastab), 4*n_thread+1).astype(np.int64)))
+        chunks = [ [s, e] for s, e in zip(cuts[:-1], cuts[1:]) ]
+        def mergeChunk(chunk) :
+            chainHits(blastab.qStart, blastab.qEnd, rStart, rEnd, blastab.ref, blastab.iden, blastab.score, blastab.qLen, blastab.rLen, starts, \
+                      chunk[0], chunk[1], float(params[1]), float(params[2]), kept, assigned, nodeFirst, nodeNext, nodeInfo, nodeSize)
+        if n_thread > 1 and len(chunks) > 1 :
+            pool = ThreadPool(min(n_thread, len(chunks)))
+            pool.map(mergeChunk, chunks)
+            pool.close()
+        else :
+            list(map(mergeChunk, chunks))
+        # the kept hits of a query group come in the order of a set of their indices, as they always have;
+        # the final sort of uberBlast is stable, so this decides the order of hits with equal scores
+        keep = np.concatenate([ s + np.array(list(set(kept[s:e][kept[s:e] >= 0].tolist())), dtype=np.int64) for s, e in zip(starts[:-1].tolist(), starts[1:].tolist()) ])
+        nodes, rowId = assigned[keep], blastab.rowId
+        blastab = blastab.take(keep)
+        grpStart = np.concatenate([[0], np.cumsum(np.where(nodes >= 0, nodeSize[nodes], 0))])
+        # walk the members of all groups at once
+        grpMembers = np.empty(grpStart[-1], dtype=np.int64)
+        pos, cur = grpStart[:-1][nodes >= 0], nodes[nodes >= 0]
+        while cur.size :
+            grpMembers[pos] = rowId[nodeFirst[cur]]
+            pos, cur = pos + 1, nodeNext[cur]
+            pos, cur = pos[cur >= 0], cur[cur >= 0]
+        blastab.setGroups(np.where(nodes[:, np.newaxis] >= 0, nodeInfo[nodes], np.nan), grpStart, grpMembers)
  #       logger('Finish merging neighboring regions.')
         return blastab
 
     def fixEnd(self, blastab, se, ee) :
-        for p in blastab :
-            e1, e2 = p[6] - 1, p[12] - p[7]
-            cigar = p[14]
-            if p[9] > p[8] :
-                if 0 < e1 <= se :
-                    d = min(p[6]-1, p[8]-1)
-                    p[6], p[8], cigar[0][0] = p[6]-d, p[8]-d, cigar[0][0]+d
-                if 0 < e2 <= ee :
-                    d = min(p[12]-p[7], p[13]-p[9])
-                    p[7], p[9], cigar[-1][0] = p[7]+d, p[9]+d, cigar[-1][0]+d
-            else :
-                if 0 < e1 <= se :
-                    d = min(p[6]-1, p[13]-p[8])
-                    p[6], p[8], cigar[0][0] = p[6]-d, p[8]+d, cigar[0][0]+d
-                if 0 < e2 <= ee :
-                    d = min(p[12]-p[7], p[9]-1)
-                    p[7], p[9], cigar[-1][0] = p[7]+d, p[9]-d, cigar[-1][0]+d
-            p[14] = ''.join( '{0}{1}'.format(n, t) for n, t in cigar )
-
-    def runBlast(self, ref, qry) :
+        fwd = blastab.rEnd > blastab.rStart
+        e1, e2 = blastab.qStart - 1, blastab.qLen - blastab.qEnd
+        first, last = blastab.cigarStart[:-1], blastab.cigarStart[1:] - 1
+        d = np.where(fwd, np.minimum(blastab.qStart-1, blastab.rStart-1), np.minimum(blastab.qStart-1, blastab.rLen-blastab.rStart))
+        d[(e1 <= 0) | (e1 > se)] = 0
+        blastab.qStart -= d
+        blastab.rStart -= np.where(fwd, d, -d)
+        blastab.cigarLen[first] += d
+        d = np.where(fwd, np.minimum(blastab.qLen-blastab.qEnd, blastab.rLen-blastab.rEnd), np.minimum(blastab.qLen-blastab.qEnd, blastab.rEnd-1))
+        d[(e2 <= 0) | (e2 > ee)] = 0
+        blastab.qEnd += d
+        blastab.rEnd += np.where(fwd, d, -d)
+        blastab.cigarLen[last] += d
+
+    def writeRef(self, ref) :
+        '''the reference as a FASTA file in the work folder, for the programs that index it'''
+        refNA = os.path.join(self.dirPath, 'refNA')
+        if not os.path.isfile(refNA) :
+            with open(refNA, 'w') as fout :
+                refSeq = self.refSeq.items() if self.refSeq else ((n, s) for n, s, q in iterFastq(ref))
+                for n,s in refSeq :
+                    fout.write('>{0}\n{1}\n'.format(n, s))
+        return refNA
+
+    def queryChunks(self, qry, minChunk) :
+        '''write the queries into FASTA files of similar total length. Returns them heaviest first.'''
+        # queries are streamed twice: once for their lengths and once to write them into chunks of similar
+        # total length, up to four per thread so that workers that finish early take more of them. Chunks
+        # are kept above <minChunk> bases, below which starting the search costs more than the balance saves.
+        qryIter = (lambda : iter(self.qrySeq.items())) if self.qrySeq else (lambda : ((n, s) for n, s, q in iterFastq(qry)))
+        qryLen = np.array([len(s) for n, s in qryIter()], dtype=int)
+        nChunk = min(qryLen.size, self.n_thread if self.n_thread <= 1 else max(self.n_thread, min(4*self.n_thread, int(np.sum(qryLen) // minChunk))))
+        chunkId = balancedChunks(qryLen, nChunk)
+        qrys = [ os.path.join(self.dirPath, 'qryNA.{0}'.format(id)) for id in range(nChunk)]
+        fouts = [ open(q, 'w') for q in qrys ]
+        for (n, s), id in zip(qryIter(), chunkId) :
+            fouts[id].write('>{0}\n{1}\n'.format(n, s))
+        for fout in fouts :
+            fout.close()
+        return [ qrys[id] for id in np.argsort(-np.bincount(chunkId, qryLen, minlength=nChunk), kind='stable') ]
+
+    def runBlast(self, ref, qry, minChunk=100000) :
         logger('Run BLASTn starts')
+        refDb = refNA = self.writeRef(ref)
+        run_external('{makeblastdb} -dbtype nucl -in {refNA} -out {refDb}'.format(makeblastdb=makeblastdb, refNA=refNA, refDb = refDb).split(), \
+                     cache=dict(inputs=[refNA], outputs=[refDb + '*'], scratch=[self.dirPath]))
+        qrys = self.queryChunks(qry, minChunk)
+        blastab = HitTable.concat([ r for r in runTasks(self.pool, poolBlast, [ [blastn, refDb, q, self.min_id, self.min_cov, self.min_ratio, self.prune] for q in qrys ], 'BLASTn') if r is not None ])
+        logger('Run BLASTn finishes. Got {0} alignments'.format(len(blastab)))
+        return blastab
+
+    def runMinimap(self, ref, qry, minChunk=100000) :
+        logger('Run minimap2 starts')
+        refNA = self.writeRef(ref)
+        refIdx = refNA + '.mmi'
+        run_external('{minimap2} -x asm20 -d {refIdx} {refNA}'.format(minimap2=minimap2, refIdx=refIdx, refNA=refNA).split(), \
+                     cache=dict(inputs=[refNA], outputs=[refIdx], scratch=[self.dirPath]))
+        qrys = self.queryChunks(qry, minChunk)
+        blastab = HitTable.concat([ r for r in runTasks(self.pool, poolMinimap, [ [minimap2, refIdx, refNA, q, self.min_id, self.min_cov, self.min_ratio, self.prune] for q in qrys ], 'minimap2') if r is not None ])
+        logger('Run minimap2 finishes. Got {0} alignments'.format(len(blastab)))
+        return blastab
+
+    def runSW(self, ref, qry, k=None, pad=24, maxSpread=96, maxCheck=8, minUngapped=40, ext=64, scoring=[2, -3, 6, 2], xDrop=20) :
+        '''align in this process, without a database: the k-mers of the queries (both strands) are looked up in the
+        reference, seeds on nearby diagonals are grouped, groups of few seeds need an ungapped extension of one seed
+        that scores >= <minUngapped>, and each group is aligned (Smith-Waterman) in the band of its diagonals +- <pad>.
+        <scoring> is [reward, penalty, gap open, gap extend] as for BLASTn. The groups are aligned by n_thread threads.
+        Without a <k>, it is 11 for small searches and grows with their size, to keep the number of random seeds
+        around a million.'''
+        logger('Run SW starts')
         if not self.qrySeq :
-            self.qrySeq, self.qryQual = readFastq(qry)
+            self.qrySeq = readFastq(qry)[0]
         if not self.refSeq :
-            self.refSeq, self.refQual = readFastq(ref)
-        refDb = refNA = os.path.join(self.dirPath, 'refNA')
-        with open(refNA, 'w') as fout :
-            for n,s in self.refSeq.items() :
-                fout.write('>{0}\n{1}\n'.format(n, s))
-        Popen('{makeblastdb} -dbtype nucl -in {refNA} -out {refDb}'.format(makeblastdb=makeblastdb, refNA=refNA, refDb = refDb).split(), stderr=PIPE, stdout=PIPE, universal_newlines=True).communicate()
-        qrySeq = sorted(list(self.qrySeq.items()), key=lambda s:-len(s[1]))
-        qrys = [ os.path.join(self.dirPath, 'qryNA.{0}'.format(id)) for id in range(min(len(qrySeq), self.n_thread))]
-        for id, q in enumerate(qrys) :
-            with open(q, 'w') as fout :
-                for n, s in qrySeq[id::self.n_thread] :
-                    fout.write('>{0}\n{1}\n'.format(n, s))
-        blastab = []
-        for r in self.pool.imap_unordered(poolBlast, [ [blastn, refDb, q, self.min_id, self.min_cov, self.min_ratio] for q in qrys ]) :
-            if r is not None :
-                blastab.append(np.load(r, allow_pickle=True))
-                os.unlink(r)
-        if len(blastab) :
-            blastab = np.vstack(blastab)
+            self.refSeq = readFastq(ref)[0]
+        reward, penalty, gapOpen, gapExtend = scoring
+        # queries and their reverse complements, one record each
+        qrys = SeqBatch.fromDict(self.qrySeq)
+        nQry, qryLen = len(qrys), qrys.lengths
+        qBuf = np.concatenate([qrys.encode(nucEncoder).buffer, qrys.rc().encode(nucEncoder).buffer])
+        qOff = np.concatenate([qrys.offsets, qrys.offsets[1:] + qrys.offsets[-1]])
+        refs = SeqBatch.fromDict(self.refSeq).encode(nucEncoder)
+        refLen = refs.lengths
+        if not k :
+            k = int(np.clip(np.ceil(np.log(2.*np.sum(qryLen)*np.sum(refLen)/1e6)/np.log(4)), 11, 15))
+
+        qCodes = kmerCodes(qBuf, qOff, k, swDigits)
+        tabPos = np.flatnonzero(qCodes >= 0)
+        tabPos = tabPos[np.argsort(qCodes[tabPos], kind='stable')]
+        tabCode = qCodes[tabPos]
+        # the query k-mers are indexed by their first 11 bases
+        shift = 2*max(k - 11, 0)
+        tabStart = np.zeros(4**min(k, 11) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tabCode >> shift, minlength=4**min(k, 11)), out=tabStart[1:])
+        lo, cnt = seedRanges(kmerCodes(refs.buffer, refs.offsets, k, swDigits), tabCode, tabStart, shift)
+        rGlob = np.flatnonzero(cnt)
+        lo, cnt = lo[rGlob], cnt[rGlob]
+        qGlob = tabPos[np.repeat(lo - np.cumsum(cnt) + cnt, cnt) + np.arange(np.sum(cnt))]
+        rGlob = np.repeat(rGlob, cnt)
+        qRec, rRec = np.searchsorted(qOff, qGlob, 'right') - 1, np.searchsorted(refs.offsets, rGlob, 'right') - 1
+        qSeed, rSeed = qGlob - qOff[qRec], rGlob - refs.offsets[rRec]
+        diag = rSeed - qSeed
+        order = np.lexsort([rSeed, diag, rRec, qRec])
+        qRec, rRec, qSeed, rSeed, diag, qGlob, rGlob = [ v[order] for v in (qRec, rRec, qSeed, rSeed, diag, qGlob, rGlob) ]
+
+        # groups of up to <maxCheck> seeds are aligned only if one of their seeds passes the ungapped filter
+        gStart = seedGroups(qRec, rRec, diag, pad, maxSpread)
+        gSize = np.diff(gStart)
+        seedGroup = np.repeat(np.arange(gSize.size), gSize)
+        check = np.flatnonzero(gSize[seedGroup] <= maxCheck)
+        ungapped = ungappedScores(qBuf, qGlob[check], (qOff[qRec+1] - qGlob)[check], refs.buffer, rGlob[check], (refs.offsets[rRec+1] - rGlob)[check], \
+                                  qSeed[check], rSeed[check], k, reward, penalty, xDrop)
+        groups = gSize > maxCheck
+        groups[np.unique(seedGroup[check[ungapped >= minUngapped]])] = True
+        logger('SW: {0} seeds in {1} groups, {2} of which are aligned'.format(diag.size, gSize.size, np.sum(groups)))
+        first, last = gStart[:-1][groups], gStart[1:][groups] - 1
+
+        gq, gr, gMin, gMax = qRec[first], rRec[first], diag[first], diag[last]
+        qLen, rLen = np.diff(qOff)[gq], refLen[gr]
+        # the rows [qa, qb) of the query are aligned: all of it for large groups, and up to <ext> bases around the seeds for small ones
+        qa = np.where(gSize[groups] > maxCheck, 0, np.maximum(np.minimum.reduceat(qSeed, gStart[:-1])[groups] - ext, 0))
+        qb = np.where(gSize[groups] > maxCheck, qLen, np.minimum(np.maximum.reduceat(qSeed, gStart[:-1])[groups] + k + ext, qLen))
+        ws, we = np.maximum(gMin - pad + qa, 0), np.minimum(gMax + pad + qb, rLen)
+        dLo, width = gMin - pad + qa - ws, gMax - gMin + 2*pad + 1
+        cigarStart = np.concatenate([[0], np.cumsum(qb - qa + we - ws + 1)])
+        res, cigarN = np.zeros([first.size, 9], dtype=np.int64), np.zeros(first.size, dtype=np.int64)
+        cigarLen, cigarOp = np.empty(cigarStart[-1], dtype=np.int64), np.empty(cigarStart[-1], dtype=np.uint8)
+        def alignChunk(chunk) :
+            swExtend(chunk[0], chunk[1], qBuf, qOff[gq] + qa, qb - qa, refs.buffer, refs.offsets[gr], ws, we, dLo, width, \
+                     reward, penalty, gapOpen, gapExtend, res, cigarStart, cigarLen, cigarOp, cigarN)
+        # chunks of similar numbers of DP cells
+        cells = np.cumsum((qb - qa) * width)
+        cuts = np.unique(np.searchsorted(cells, np.linspace(0, cells[-1] if cells.size else 0, 4*self.n_thread+1)[1:-1]))
+        chunks = [ [s, e] for s, e in zip(np.concatenate([[0], cuts]), np.concatenate([cuts, [first.size]])) if e > s ]
+        if self.n_thread > 1 and len(chunks) > 1 :
+            pool = ThreadPool(min(self.n_thread, len(chunks)))
+            pool.map(alignChunk, chunks)
+            pool.close()
         else :
-            blastab = np.empty([0, 15], dtype=object)
-        logger('Run BLASTn finishes. Got {0} alignments'.format(blastab.shape[0]))
+            list(map(alignChunk, chunks))
+
+        # one hit per distinct alignment; those of reverse-complemented queries are turned to the query strand
+        score, qs, qe, rs, rEnd, nMatch, nMism, nOpen, alnLen = res.T
+        qs, qe = qs + qa, qe + qa
+        rev = gq >= nQry
+        gq = np.where(rev, gq - nQry, gq)
+        keep = np.flatnonzero((score > 0) & (nMatch >= min(self.min_id, 1.) * alnLen) & (qe - qs + 1 >= self.min_cov) & (qe - qs + 1 >= self.min_ratio * qLen))
+        keep = keep[np.unique(np.vstack([gq, gr, qs, qe, rs, rEnd, rev])[:, keep], axis=1, return_index=True)[1]]
+        keep = np.sort(keep)
+        n, rev = cigarN[keep], rev[keep]
+        newStart = np.concatenate([[0], np.cumsum(n)])
+        pos = np.repeat(cigarStart[keep] - newStart[:-1], n) + np.arange(newStart[-1])
+        qs, qe, rs, rEnd, ql = qs[keep], qe[keep], rs[keep], rEnd[keep], qLen[keep]
+        blastab = reverseCigars(HitTable.fromColumns(np.array(qrys.names, dtype=object)[gq[keep]], np.array(refs.names, dtype=object)[gr[keep]], \
+            [np.round(nMatch[keep]/alnLen[keep].astype(float), 3), alnLen[keep], nMism[keep], nOpen[keep], np.where(rev, ql-qe+1, qs), np.where(rev, ql-qs+1, qe), \
+             np.where(rev, rEnd, rs), np.where(rev, rs, rEnd), np.zeros(keep.size), score[keep], ql, rLen[keep]], newStart, cigarLen[pos], cigarOp[pos]), rev)
+        logger('Run SW finishes. Got {0} alignments'.format(len(blastab)))
         return blastab
 
+    def translateRef(self, frames, chunkSize=1000) :
+        '''translate the reference in all <frames> in one batch and cut each frame into ORF chunks (see orfChunks)'''
+        refAA, stops = transeqBatch(SeqBatch.fromDict(self.refSeq), frames, self.table_id, stops=True)
+        aaSeq, frames = refAA.buffer.tobytes().decode('ascii'), transeqFrames(frames)
+        toWrite = []
+        for n in sorted(self.refSeq) :
+            for id, f in enumerate(frames) :
+                i = refAA.index[(n, f)]
+                s, e = refAA.offsets[i], refAA.offsets[i+1]
+                xs = stops[np.searchsorted(stops, s):np.searchsorted(stops, e)] - s
+                for cs, ce in orfChunks(xs, e - s, chunkSize) :
+                    toWrite.append('>{0}:{1}:{2}\n{3}\n'.format(n, id+1, cs, aaSeq[s+cs:s+ce]))
+        return toWrite
+
     def runDiamondSELF(self, ref, qry) :
         return self.runDiamond(ref, qry, nhits=200, frames='F')
     
     
     def runDiamondx(self, ref, qry, nhits=5, frames='7'):
-        refAA = os.path.join(self.dirPath, 'refAA')
         qryAA = os.path.join(self.dirPath, 'qryAA')
-        aaMatch = os.path.join(self.dirPath, 'aaMatch')
 
-        if not self.qrySeq:
-            qryAASeq, self.qryAAQual = readFastq(qry)
-            self.qrySeq = {n: rev_transeq(s) for n, s in qryAASeq.items()}
+        qryAASeq = qry if isinstance(qry, dict) else readFastq(qry)[0]
+        self.qrySeq = {n: rev_transeq(s) for n, s in qryAASeq.items()}
         if not self.refSeq:
             self.refSeq, self.refQual = readFastq(ref)
 
@@ -542,98 +1414,102 @@ class RunBlast(object) :
 
         diamond_fmt = '{diamond} makedb --db {qryAA} --in {qryAA}'.format(
             diamond=diamond, qryAA=qryAA)
-        p = Popen(diamond_fmt.split(), stderr=PIPE, stdout=PIPE, universal_newlines=True).communicate()
+        run_external(diamond_fmt.split(), cache=dict(inputs=[qryAA], outputs=[qryAA + '.dmnd'], scratch=[self.dirPath]))
 
-        refAASeq = transeq(self.refSeq, frames, transl_table=self.table_id)
-        toWrite = []
-        for n, ss in sorted(refAASeq.items()):
-            for id, s in enumerate(ss):
-                cdss = re.findall('.{1000,}?X|.{1,1000}$', s + 'X')
-                cdss[-1] = cdss[-1][:-1]
-                cdsi = np.cumsum([0] + list(map(len, cdss[:-1])))
-                for ci, cs in zip(cdsi, cdss):
-                    if len(cs):
-                        toWrite.append('>{0}:{1}:{2}\n{3}\n'.format(n, id + 1, ci, cs))
-
-        for id in range(5):
-            with open('{0}.{1}'.format(refAA, id), 'w') as fout:
-                for line in toWrite[id::5]:
-                    fout.write(line)
-            diamond_cmd = '{diamond} blastp --gapopen 9 --no-self-hits --threads {n_thread} --db {refAA} --query {qryAA} --out {aaMatch} --id {min_id} --query-cover {min_ratio} --evalue 1 -k {nhits} --max-hsps {nhits} --dbsize 5000000 --outfmt 101'.format(
-                diamond=diamond, refAA='{0}.{1}'.format(refAA, id), qryAA=qryAA, aaMatch='{0}.{1}'.format(aaMatch, id),
-                n_thread=self.n_thread, min_id=self.min_id * 100., nhits=nhits, min_ratio=self.min_ratio * 100.)
-            Popen(diamond_cmd.split(), stdout=PIPE, stderr=PIPE, universal_newlines=True).communicate()
-        blastab = []
-        for r in self.pool.imap_unordered(parseDiamond, [
-            ['{0}.{1}'.format(aaMatch, id), self.refSeq, self.qrySeq, self.min_id, self.min_cov, self.min_ratio] for id
-            in range(5)]):
-            if r is not None:
-                blastab.append(np.load(r, allow_pickle=True))
-                os.unlink(r)
-        blastab = np.vstack(blastab) if len(blastab) else []
-        return blastab
+        return self.diamondShards(ref, frames, qryAA, '--gapopen 9 --no-self-hits --max-hsps {0}'.format(nhits), nhits)
 
     def runDiamond(self, ref, qry, nhits=10, frames='7') :
         logger('Run diamond starts')
 
-        refAA = os.path.join(self.dirPath, 'refAA')
         qryAA = os.path.join(self.dirPath, 'qryAA')
-        aaMatch = os.path.join(self.dirPath, 'aaMatch')
         
         if not self.qrySeq :
             self.qrySeq, self.qryQual = readFastq(qry)
         if not self.refSeq :
             self.refSeq, self.refQual = readFastq(ref)
 
-        qryAASeq = transeq(self.qrySeq, frame='F', transl_table=self.table_id)
+        # pick, for each query, the forward frame with the fewest internal stops
+        qryAASeq, stops = transeqBatch(SeqBatch.fromDict(self.qrySeq), 'F', self.table_id, stops=True)
+        entry = np.searchsorted(qryAASeq.offsets, stops, 'right') - 1
+        internal = entry[stops < qryAASeq.offsets[entry+1] - 1]
+        frame = np.argmin(np.bincount(internal, minlength=len(qryAASeq)).reshape(-1, 3), 1)
+        aaSeq, o = qryAASeq.buffer.tobytes().decode('ascii'), qryAASeq.offsets
         with open(qryAA, 'w') as fout :
-            for n, ss in sorted(qryAASeq.items()) :
-                _, id, s = min([ (len(s[:-1].split('X')), id, s) for id, s in enumerate(ss) ])
-                fout.write('>{0}:{1}\n{2}\n'.format(n, id+1, s))
+            for n in sorted(self.qrySeq) :
+                i = qryAASeq.index[(n, 1)]
+                i, id = i + frame[i//3], frame[i//3]
+                fout.write('>{0}:{1}\n{2}\n'.format(n, id+1, aaSeq[o[i]:o[i+1]]))
         
         diamond_fmt = '{diamond} makedb --db {qryAA} --in {qryAA}'.format(
             diamond=diamond, qryAA=qryAA)
-        p = Popen(diamond_fmt.split(), stderr=PIPE, stdout=PIPE, universal_newlines=True).communicate()
-        
-        refAASeq = transeq(self.refSeq, frames, transl_table=self.table_id)
-        toWrite = []
-        for n, ss in sorted(refAASeq.items()) :
-            for id, s in enumerate(ss) :
-                cdss = re.findall('.{1000,}?X|.{1,1000}$', s + 'X')
-                cdss[-1] = cdss[-1][:-1]
-                cdsi = np.cumsum([0]+list(map(len, cdss[:-1])))
-                for ci, cs in zip(cdsi, cdss) :
-                    if len(cs) :
-                        toWrite.append('>{0}:{1}:{2}\n{3}\n'.format(n, id+1, ci, cs))
+        run_external(diamond_fmt.split(), cache=dict(inputs=[qryAA], outputs=[qryAA + '.dmnd'], scratch=[self.dirPath]))
         
-        for id in xrange(5) :
-            with open('{0}.{1}'.format(refAA, id), 'w') as fout :
-                for line in toWrite[id::5] :
-                    fout.write(line)
-            diamond_cmd = '{diamond} blastp --no-self-hits --threads {n_thread} --db {refAA} --query {qryAA} --out {aaMatch} --id {min_id} --query-cover {min_ratio} --evalue 1 -k {nhits} --dbsize 5000000 --outfmt 101'.format(
-                diamond=diamond, refAA='{0}.{1}'.format(refAA, id), qryAA=qryAA, aaMatch='{0}.{1}'.format(aaMatch, id), n_thread=self.n_thread, min_id=self.min_id*100., nhits=nhits, min_ratio=self.min_ratio*100.)
-            Popen(diamond_cmd.split(), stdout=PIPE, stderr=PIPE, universal_newlines=True).communicate()
-        blastab = []
-        for r in self.pool.imap_unordered(parseDiamond, [ ['{0}.{1}'.format(aaMatch, id), self.refSeq, self.qrySeq, self.min_id, self.min_cov, self.min_ratio] for id in xrange(5) ]) :
-            if r is not None :
-                blastab.append(np.load(r, allow_pickle=True))
-                os.unlink(r)
-        blastab = np.vstack(blastab)
-        logger('Run diamond finishes. Got {0} alignments'.format(blastab.shape[0]))
+        blastab = self.diamondShards(ref, frames, qryAA, '--no-self-hits', nhits)
+        logger('Run diamond finishes. Got {0} alignments'.format(len(blastab)))
         return blastab
 
+    def refShards(self, ref, frames, shardSize=20000000, chunkSize=1000) :
+        '''diamond databases of the reference translated in <frames> (see translateRef), split into shards of
+        about <shardSize> residues, at most one per thread. With ${ETOKI_CACHE} set, the databases are cached
+        by the content of the reference, the frames, the genetic table, the chunk size and the number of shards,
+        so that a reference searched again (exemplars in ortho, allele sets in MLSTdb) is neither translated
+        nor indexed again.'''
+        frames = transeqFrames(frames)
+        # each frame gives about one residue per codon
+        nShard = int(min(max(self.n_thread, 1), max(np.ceil(sum(map(len, self.refSeq.values()))*len(frames)/3./shardSize), 1)))
+        shards = [ os.path.join(self.dirPath, 'refAA.{0}'.format(id)) for id in xrange(nShard) ]
+        cmd = 'translateRef --frames {0} --table {1} --chunk {2} --shards {3}'.format(','.join(map(str, frames)), self.table_id, chunkSize, nShard)
+        inputs = [ref]
+        if isinstance(ref, dict) :
+            # an in-memory reference has no file to digest; its sequences go into the key instead
+            digest = hashlib.sha1()
+            for n in sorted(ref) :
+                digest.update('>{0}\n{1}\n'.format(n, ref[n]).encode())
+            cmd, inputs = cmd + ' --ref ' + digest.hexdigest(), []
+        call = cachedCall([cmd] + ['{0} makedb --db {1} --in {1}'.format(diamond, shard) for shard in shards], \
+                          inputs=inputs, outputs=[shard + '.dmnd' for shard in shards], scratch=[self.dirPath])
+        if not call.restore() :
+            toWrite = self.translateRef(frames, chunkSize)
+            for id, shard in enumerate(shards) :
+                with open(shard, 'w') as fout :
+                    for line in toWrite[id::nShard] :
+                        fout.write(line)
+                run_external('{0} makedb --db {1} --in {1}'.format(diamond, shard).split())
+            call.store()
+        return [ shard + '.dmnd' for shard in shards ]
 
+    def diamondShards(self, ref, frames, qryAA, options, nhits, shardSize=20000000) :
+        '''search the reference translated in <frames> in shards (see refShards). The shards run at the same
+        time and share the thread budget; each is parsed (see poolDiamond) while the others are still running.'''
+        shards = self.refShards(ref, frames, shardSize)
+        nShard = len(shards)
+        # -k applies per shard: keep the number of hits per query at what five shards gave
+        options = '{0} --id {1} --query-cover {2} --evalue 1 -k {3} --dbsize 5000000'.format(options, self.min_id*100., self.min_ratio*100., int(np.ceil(nhits*5./nShard)))
+        qryLens, refLens = {n: len(s) for n, s in self.qrySeq.items()}, {n: len(s) for n, s in self.refSeq.items()}
+        # the shards split the reference, so the hits of a query are pruned once more after they are merged
+        return topHits(HitTable.concat(runTasks(self.pool, poolDiamond, [ [diamond, shard, qryAA, options, max(self.n_thread // nShard, 1), qryLens, refLens, \
+                                                                          self.min_id, self.min_cov, self.min_ratio, self.prune] for shard in shards ], 'diamond')), *self.prune)
 
-def uberBlast(args, extPool=None) :
+
+
+def uberBlastParser() :
     import argparse
     parser = argparse.ArgumentParser(description='Five different alignment methods. ')
-    parser.add_argument('-r', '--reference',     help='[INPUT; REQUIRED] filename for the reference. This is normally a genomic assembly. ', required=True)
-    parser.add_argument('-q', '--query',  help='[INPUT; REQUIRED] filename for the query. This can be short-reads or genes or genomic assemblies. ', required=True)
+    parser.add_argument('-r', '--reference',     help='[INPUT; REQUIRED unless --convert] filename for the reference. This is normally a genomic assembly. ', default=None)
+    parser.add_argument('-q', '--query',  help='[INPUT; REQUIRED unless --convert] filename for the query. This can be short-reads or genes or genomic assemblies. ', default=None)
     parser.add_argument('-o', '--output', help='[OUTPUT; Default: None] save result to a file or to screen (stdout). Default do nothing. ', default=None)
+    parser.add_argument('--outfmt', help='[DEFAULT: tab] format of the output. tab: one tab-delimited line per alignment; npz: compressed binary columns, read by readHits', choices=['tab', 'npz'], default='tab')
+    parser.add_argument('--convert', help='[INPUT] convert a result saved with --outfmt npz into the tab-delimited format (see --output) instead of running a search', default=None)
     parser.add_argument('--blastn',       help='Run BLASTn. Slowest. Good for identities between [70, 100]', action='store_true', default=False)
+    parser.add_argument('--minimap',      help='Run minimap2. Fastest. Good for identities between [90-100]', action='store_true', default=False)
+    parser.add_argument('--sw',           help='Run the built-in banded Smith-Waterman aligner. No external program or database; for small sets of references or queries. Good for identities between [80-100]', action='store_true', default=False)
     parser.add_argument('--diamond',      help='Run diamond on tBLASTn mode. Fast. Good for identities between [30-100]', action='store_true', default=False)
     parser.add_argument('--diamondx',      help='Run diamond on BLASTx mode. Fast. Good for identities between [30-100]', action='store_true', default=False)
     parser.add_argument('--diamondSELF',      help='Run diamond on tBLASTn mode. Fast. Good for identities between [30-100]', action='store_true', default=False)
+    parser.add_argument('--dedup', help='[DEFAULT: False] Search identical queries only once and copy their hits', action='store_true', default=False)
+    parser.add_argument('--dedup_rc', help='[DEFAULT: False] As --dedup, also for queries that are reverse complements of each other', action='store_true', default=False)
+    parser.add_argument('--top_k', help='[DEFAULT: 0] Keep at most this number of best scoring alignments per query (before reScore) while the results are read. 0 keeps all', type=int, default=0)
+    parser.add_argument('--score_ratio', help='[DEFAULT: 0] Drop alignments scoring below this proportion of the best alignment of the same query while the results are read', type=float, default=0.)
     parser.add_argument('--gtable',       help='[DEFAULT: 11] genetic table to use. 11 for bacterial genomes and 4 for Mycoplasma', default=11, type=int)
     
     parser.add_argument('--min_id', help='[DEFAULT: 0.25] Minimum identity before reScore for an alignment to be kept', type=float, default=0.25)
@@ -654,27 +1530,73 @@ def uberBlast(args, extPool=None) :
     parser.add_argument('-t', '--n_thread', help='[DEFAULT: 8] Number of threads to use. ', type=int, default=1)
     parser.add_argument('-p', '--process', help='[DEFAULT: False] Use processes instead of threads. ', action='store_true', default=False)
     
+    return parser
+
+def blastParams(**kwargs) :
+    '''the options of uberBlast as an object, starting from the defaults of the command line. Keywords are the
+    long option names, e.g. blastParams(blastn=True, diamond=True, min_id=0.5, linear_merge=True, fix_end=[0, 3]).'''
+    params = uberBlastParser().parse_args(['-r', '', '-q', ''])
+    params.reference = params.query = None
+    for key, value in kwargs.items() :
+        if key not in params.__dict__ :
+            raise ValueError('Unknown uberBlast option: {0}'.format(key))
+        setattr(params, key, value)
+    return params
+
+def blastSeqs(reference, query, params, extPool=None, asTable=False) :
+    '''uberBlast without a command line. <reference> and <query> are file names or dicts of {name: sequence}
+    (as readFastq gives them), so that loaded sequences are neither written out nor parsed again
+    (BLASTn and diamond still get the files they index). <params> comes from blastParams.
+    Returns what uberBlast returns, with the hits as a HitTable if <asTable>.'''
+    methods = [ method for method in ('blastn', 'minimap', 'sw', 'diamond', 'diamondSELF', 'diamondx') if getattr(params, method) ]
+    fix_end = params.fix_end.split(',') if isinstance(params.fix_end, str) else params.fix_end
+    return RunBlast().run(reference, query, methods, params.min_id, params.min_cov, params.min_ratio, params.gtable, \
+                          params.n_thread, params.process if extPool is None else extPool, params.re_score, \
+                          [params.filter, params.filter_cov, params.filter_score], \
+                          [params.linear_merge, params.merge_gap, params.merge_diff], \
+                          [params.return_overlap, params.overlap_length, params.overlap_proportion], \
+                          list(map(float, fix_end[-2:])), asTable, [params.dedup or params.dedup_rc, params.dedup_rc], \
+                          [params.top_k, params.score_ratio])
+
+def readHits(fname, asTable=False) :
+    '''read a result of uberBlast, saved with --outfmt npz or as text. Returns it as uberBlast does: the hits in the
+    legacy layout, or as a HitTable if <asTable>, followed by the overlaps if the file has them (npz only).
+    The groups of linearMerge are only kept in npz.'''
+    overlap = None
+    if zipfile.is_zipfile(fname) :
+        blastab, overlap = HitTable.load(fname)
+    else :
+        with open(fname) as fin :
+            rows = [ line.rstrip('\n').split('\t')[:16] for line in fin if line.strip() ]
+        rows = np.array(rows, dtype=object).reshape(-1, 16)
+        rows.T[11] = [ int(v) if v.lstrip('-').isdigit() else float(v) for v in rows.T[11] ]
+        blastab = HitTable.fromRows(rows)
+    if not asTable :
+        blastab = blastab.toRows()
+    return blastab if overlap is None else (blastab, overlap)
+
+def writeHits(blastab, fout) :
+    '''write hits in the legacy layout as tab-delimited text'''
+    for t in blastab :
+        fout.write ('\t'.join([str(tt) for tt in t ]) + '\n')
+
+def uberBlast(args, extPool=None) :
+    parser = uberBlastParser()
     args = parser.parse_args(args)
-    if extPool is not None :
-        args.process =extPool
-    methods = []
-    for method in ('blastn', 'diamond', 'diamondSELF', 'diamondx') :
-        if args.__dict__[method] :
-            methods.append(method)
-    for opt in ('fix_end',) :
-        args.__dict__[opt] = args.__dict__[opt].split(',')
-        args.__dict__[opt][-2:] = list(map(float, args.__dict__[opt][-2:]))
-    data = RunBlast().run(args.reference, args.query, methods, args.min_id, args.min_cov, args.min_ratio, args.gtable, 
-                          args.n_thread, args.process, args.re_score, \
-                             [args.filter, args.filter_cov, args.filter_score], \
-                             [args.linear_merge, args.merge_gap, args.merge_diff], \
-                             [args.return_overlap, args.overlap_length, args.overlap_proportion], \
-                             args.fix_end)
+    if args.convert :
+        data = readHits(args.convert)
+    elif args.reference is None or args.query is None :
+        parser.error('-r/--reference and -q/--query are required')
+    else :
+        data = blastSeqs(args.reference, args.query, args, extPool, asTable=(args.outfmt == 'npz'))
     if args.output :
-        fout = sys.stdout if args.output.upper() == 'STDOUT' else open(args.output, 'w')
-        for t in data :
-            fout.write ('\t'.join([str(tt) for tt in t ]) + '\n')
-        fout.close()
+        if args.outfmt == 'npz' and not args.convert :
+            blastab, overlap = data if isinstance(data, tuple) else (data, None)
+            blastab.save(sys.stdout.buffer if args.output.upper() == 'STDOUT' else args.output, overlap)
+        else :
+            fout = sys.stdout if args.output.upper() == 'STDOUT' else open(args.output, 'w')
+            writeHits(data[0] if isinstance(data, tuple) else data, fout)
+            fout.close()
     return data
 
 if __name__ == '__main__' :